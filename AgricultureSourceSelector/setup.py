@@ -5,10 +5,15 @@ setup(
     version="0.1.0",
     packages=find_packages(where="src"),
     package_dir={"": "src"},
+    package_data={"crewai_test": ["config/*.yaml"]},
     install_requires=[
         "crewai>=0.13.0",
         "openai>=1.3.0",
         "python-dotenv>=1.0.0",
         "pysbd>=0.3.4",
+        "pyyaml>=6.0.1",
+        # Ortak kaynak kayıt defteri, hız sınırlayıcı, dayanıklılık ve izleme
+        # modülleri; depo kökünden kurulur: pip install ..
+        "routing-common>=0.1.0",
     ],
 )
\ No newline at end of file
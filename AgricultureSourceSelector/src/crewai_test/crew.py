@@ -1,11 +1,19 @@
+import contextvars
 import os
-import openai
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from crewai_test.config.config import openai_config
 from crewai import Agent, Crew, Process, Task, LLM
 from crewai.project import CrewBase, agent, crew, task, before_kickoff, after_kickoff
 from dotenv import load_dotenv
-from typing import Dict, Any
-from .tools.source_selector_tool import SourceSelectorTool
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple
+from routing_common.tracing import tracer
+from .llm import get_client, llm_guard
+from routing_common.rate_limit import BATCH, estimate_request_tokens, priority
+from .tools.source_selector_tool import SourceSelectorTool, build_sources_prompt_prefix, fallback_source
+from routing_common.source_registry import SourceRegistry, get_registry
 
 # Uncomment the following line to use an example of a custom tool
 # from crewai_test.tools.custom_tool import MyCustomTool
@@ -13,85 +21,349 @@ from .tools.source_selector_tool import SourceSelectorTool
 # Check our tools documentations for more information on how to use them
 # from crewai_tools import SerperDevTool
 
-# OpenAI yapılandırması
-openai.api_type = "azure"
-openai.api_base = openai_config.endpoint
-openai.api_key = openai_config.subscription_key
-openai.api_version = openai_config.api_version
+class AgricultureSourceSelector:
+    def __init__(self, registry: Optional[SourceRegistry] = None):
+        self._registry = registry
 
+    @property
+    def registry(self) -> SourceRegistry:
+        # Açık bir kayıt defteri verilmediyse, dosyası yeniden yüklenen ortak kayıt defterini izle
+        return self._registry or get_registry()
 
-class AgricultureSourceSelector:
-    def __init__(self):
-        self.sources = [
-            {"name": "Eurostat International Trade in Goods",
-             "url": "https://ec.europa.eu/eurostat/web/international-trade-in-goods",
-             "description": "Provides statistical data on international trade in goods for the EU."},
-            {"name": "Fastmarkets", "url": "https://www.fastmarkets.com/",
-             "description": "Offers market intelligence on global commodity prices and trends."},
-            {"name": "Trade Data Monitor", "url": "https://tradedatamonitor.com/",
-             "description": "Aggregates trade data from multiple countries to monitor global trade flows."},
-            {"name": "USDA ESRQuery", "url": "https://apps.fas.usda.gov/esrquery/ESRHome.aspx",
-             "description": "Delivers export sales reporting data from the USDA."},
-            {"name": "USDA Foreign Agricultural Service", "url": "https://www.fas.usda.gov/",
-             "description": "Focuses on international trade policy and export support for U.S. agriculture."},
-            {"name": "USDA National Agricultural Statistics Service", "url": "https://www.nass.usda.gov/",
-             "description": "Provides comprehensive agricultural statistics for the U.S."}
-        ]
+    @property
+    def sources(self):
+        return self.registry.sources
 
     def recommend_source(self, query: str) -> dict:
+        registry = self.registry
         prompt = (
-                "You are an AI system that recommends data sources based on user queries. Here is the list of sources: \n"
-                + "\n".join([f"{s['name']}: {s['description']}" for s in self.sources]) + "\n\n"
+                build_sources_prompt_prefix(registry.prompt_entries)
                 + f"User query: {query}\n"
                 + "Which data source is the most relevant? Respond with the name and URL only."
         )
 
-        response = openai.ChatCompletion.create(
-            engine=openai_config.deployment,
-            messages=[{"role": "system", "content": prompt}],
-            temperature=0
-        )
+        try:
+            response = llm_guard.call(
+                get_client().chat.completions.create,
+                model=openai_config.deployment,
+                messages=[{"role": "system", "content": prompt}],
+                temperature=0
+            )
+        except Exception as e:
+            return fallback_source(query, e)
+
+        result = response.choices[0].message.content or ""
+        return registry.match(result) or {"name": "Unknown", "url": "No matching source found"}
+
+
+@lru_cache(maxsize=None)
+def load_env(env_path: str) -> bool:
+    """.env dosyasını süreç başına yalnızca bir kez oku"""
+    return load_dotenv(dotenv_path=env_path)
+
+
+class RateLimitedLLM(LLM):
+    """Her çağrıdan önce llm_guard'ın hız sınırlayıcısından tahmini token maliyetiyle sıra alan LLM"""
+
+    def call(self, messages, *args, **kwargs):
+        limiter = llm_guard.limiter
+        if limiter is not None:
+            prompt = [{"role": "user", "content": messages}] if isinstance(messages, str) else messages
+            limiter.acquire(estimate_request_tokens({'messages': prompt, 'max_tokens': getattr(self, 'max_tokens', None)}))
+        return super().call(messages, *args, **kwargs)
 
-        result = response.choices[0].message['content']
-        for source in self.sources:
-            if source['name'] in result:
-                return source
-        return {"name": "Unknown", "url": "No matching source found"}
+
+@lru_cache(maxsize=8)
+def shared_llm(model: Optional[str], api_key: Optional[str], base_url: Optional[str],
+               api_version: Optional[str], stream: bool = False) -> LLM:
+    """Aynı yapılandırma için tek bir LLM istemcisi paylaşılır"""
+    return RateLimitedLLM(
+        model=model,
+        api_key=api_key,
+        base_url=base_url,
+        api_version=api_version,
+        timeout=llm_guard.timeout,
+        **({'stream': True} if stream else {}),
+    )
+
+
+# Akış parçaları LLM olay yolundan gelir; her kickoff kendi iş parçacığındaki
+# on_token'a yönlendirilir. Olay yolu olmayan crewai sürümlerinde yalnızca
+# task bazında akış yapılır.
+try:
+    from crewai.utilities.events import crewai_event_bus
+    from crewai.utilities.events.llm_events import LLMStreamChunkEvent
+except ImportError:
+    crewai_event_bus = None
+
+_stream_target = threading.local()
+
+if crewai_event_bus is not None:
+    @crewai_event_bus.on(LLMStreamChunkEvent)
+    def _forward_chunk(source, event):
+        on_token = getattr(_stream_target, 'on_token', None)
+        if on_token is not None:
+            on_token(event.chunk)
+
+
+# Ön yönlendirmede seçilen kaynaklar için crew başına önbellek boyutu
+SOURCE_CACHE_SIZE = 1024
 
 
 @CrewBase
 class CrewaiTest():
     """Tarım Veri Analizi Crew'u"""
 
-    def __init__(self):
+    def __init__(self, pre_route_source: bool = False, stream: bool = False, top_k_sources: int = 1,
+                 max_parallel_analyses: int = 4):
         self.source_selector = SourceSelectorTool()
+        self.pre_route_source = pre_route_source
+        self.stream_llm = stream
+        self.top_k_sources = top_k_sources
+        self.max_parallel_analyses = max_parallel_analyses
+        self._crew: Optional[Crew] = None
+        self._analysis_crew: Optional[Crew] = None
+        self._stage_crews: Dict[str, Crew] = {}
+        self._source_cache: Dict[str, Any] = {}
+        self._usage_totals: Dict[int, Tuple[int, int]] = {}
         super().__init__()
 
     def llm(self):
-        env_path = os.path.join(os.path.dirname(__file__), '.env')
-        load_dotenv(dotenv_path=env_path)
-
-        return LLM(
-            model=os.environ.get("AZURE_API_MODEL"),
-            api_key=os.environ.get("AZURE_API_KEY"),
-            base_url=os.environ.get("AZURE_API_BASE"),
-            api_version=os.environ.get("AZURE_API_VERSION"),
+        load_env(os.path.join(os.path.dirname(__file__), '.env'))
+
+        return shared_llm(
+            os.environ.get("AZURE_API_MODEL"),
+            os.environ.get("AZURE_API_KEY"),
+            os.environ.get("AZURE_API_BASE"),
+            os.environ.get("AZURE_API_VERSION"),
+            self.stream_llm,
+        )
+
+    def get_crew(self) -> Crew:
+        """Crew, agent ve task'lar ilk çağrıda bir kez oluşturulur ve sonra yeniden kullanılır"""
+        if self._crew is None:
+            self._crew = self.crew()
+        return self._crew
+
+    def get_analysis_crew(self) -> Crew:
+        """find_source_task'ı içermeyen crew; kaynak önceden seçildiğinde kullanılır"""
+        if self._analysis_crew is None:
+            self._analysis_crew = self.analysis_crew()
+        return self._analysis_crew
+
+    def get_stage_crew(self, stage: str) -> Crew:
+        """Paralel modun aşama crew'ları ('search', 'analysis', 'report'); ilk çağrıda oluşturulur"""
+        if stage not in self._stage_crews:
+            factories = {'search': self.search_crew, 'analysis': self.source_analysis_crew, 'report': self.report_crew}
+            self._stage_crews[stage] = factories[stage]()
+        return self._stage_crews[stage]
+
+    def reset(self):
+        """Bir önceki çalıştırmadan kalan task çıktılarını ve araç sonuçlarını temizle"""
+        for crew_instance in (self._crew, self._analysis_crew, *self._stage_crews.values()):
+            if crew_instance is None:
+                continue
+            for crew_task in crew_instance.tasks:
+                crew_task.output = None
+            for crew_agent in crew_instance.agents:
+                if hasattr(crew_agent, 'tools_results'):
+                    crew_agent.tools_results = []
+
+    def select_source(self, query: str) -> dict:
+        """Kaynağı agent'sız, doğrudan SourceSelectorTool ile seç; aynı sorgu tekrar sorulmaz"""
+        key = " ".join(query.lower().split())
+        with tracer.span("source.select") as span:
+            source = self._source_cache.get(key)
+            span.set(cache="hit" if source is not None else "miss")
+            if source is None:
+                source = self.source_selector._run(query)
+                self._remember_source(key, source)
+        return source
+
+    def select_sources(self, query: str, k: int) -> List[dict]:
+        """En alakalı en fazla ``k`` kaynak, doğrudan SourceSelectorTool ile; aynı sorgu tekrar sorulmaz"""
+        key = f"{k}:" + " ".join(query.lower().split())
+        with tracer.span("source.select", k=k) as span:
+            sources = self._source_cache.get(key)
+            span.set(cache="hit" if sources is not None else "miss")
+            if sources is None:
+                sources = self.source_selector.select_sources(query, k)
+                self._remember_source(key, sources)
+        return sources
+
+    def _remember_source(self, key: str, value: Any):
+        if len(self._source_cache) >= SOURCE_CACHE_SIZE:
+            self._source_cache.pop(next(iter(self._source_cache)))
+        self._source_cache[key] = value
+
+    def kickoff(self, inputs: Dict[str, Any], on_task: Optional[Callable[[Any], None]] = None,
+                on_token: Optional[Callable[[str], None]] = None) -> Any:
+        """
+        Hazır crew'u yeni girdilerle çalıştır.
+
+        "basic" derinlikte yalnızca kaynak seçimi gerekir; üç agent'lık zincir
+        yerine tek bir SourceSelectorTool çağrısı yapılır ve sonuç hemen döner.
+        ``pre_route_source`` açıksa "detailed" derinlikte de kaynak aynı şekilde
+        seçilir ve yalnızca analiz ile rapor task'ları çalışır. ``top_k_sources``
+        1'den büyükse en alakalı kaynaklar paralel analiz edilir (bkz. _kickoff_parallel).
+
+        ``on_task`` her task bittiğinde TaskOutput ile, ``on_token`` ise
+        (``stream=True`` ile oluşturulmuş crew'da) her LLM metin parçasıyla çağrılır.
+        """
+        inputs = self.setup_query(dict(inputs))
+        with tracer.span("crew.kickoff", depth=inputs['analysis_depth'],
+                         pre_routed=self.pre_route_source) as span:
+            return self._kickoff(inputs, span, on_task, on_token)
+
+    def _kickoff(self, inputs: Dict[str, Any], span, on_task: Optional[Callable[[Any], None]],
+                 on_token: Optional[Callable[[str], None]]) -> Any:
+        if inputs['analysis_depth'] == 'basic':
+            source = self.select_source(inputs['query'])
+            result = f"Seçilen kaynak: {source['name']}\nURL: {source['url']}"
+            if on_token is not None:
+                on_token(result)
+            return result
+
+        if self.top_k_sources > 1:
+            return self._kickoff_parallel(inputs, span, on_task, on_token)
+
+        if self.pre_route_source:
+            # Kaynak seçimi ReAct döngüsü olmadan yapılır, analiz task'ı selected_source'u okur
+            source = self.select_source(inputs['query'])
+            inputs['selected_source'] = f"{source['name']} ({source['url']})"
+            crew_instance = self.get_analysis_crew()
+        else:
+            crew_instance = self.get_crew()
+        self.reset()
+        return self._run_crew(crew_instance, inputs, span, on_task, on_token)
+
+    def _run_crew(self, crew_instance: Crew, inputs: Dict[str, Any], span,
+                  on_task: Optional[Callable[[Any], None]], on_token: Optional[Callable[[str], None]]) -> Any:
+        # Sıralı süreçte bir task'ın süresi, önceki task'ın bitişinden kendi bitişine kadardır
+        task_span = [tracer.start_span("crew.task")]
+
+        def traced_task(output):
+            task_span[0].set(task=getattr(output, 'name', None) or str(getattr(output, 'description', ''))[:60],
+                             agent=str(getattr(output, 'agent', '')))
+            task_span[0].finish()
+            task_span[0] = tracer.start_span("crew.task")
+            if on_task is not None:
+                on_task(output)
+
+        crew_instance.task_callback = traced_task
+        crew_instance.step_callback = lambda step: tracer.count("crew.agent_steps", type(step).__name__)
+        _stream_target.on_token = on_token
+        try:
+            # Crew çalıştırmaları toplu iştir: etkileşimli yönlendirme çağrılarının arkasında sıra bekler
+            with priority(BATCH):
+                result = crew_instance.kickoff(inputs=inputs)
+        finally:
+            _stream_target.on_token = None
+            crew_instance.task_callback = None
+            crew_instance.step_callback = None
+        self._record_usage(span, crew_instance, result)
+        return result
+
+    def _kickoff_parallel(self, inputs: Dict[str, Any], span, on_task: Optional[Callable[[Any], None]],
+                          on_token: Optional[Callable[[str], None]]) -> Any:
+        """
+        Kaynak bulma, kaynak başına paralel analiz ve birleştirilmiş rapor.
+
+        Kaynakların analizleri birbirinden bağımsızdır; analiz aşaması toplam
+        değil en yavaş kaynağın süresi kadar sürer. Analiz crew'u her kaynak
+        için kopyalanır (agent durumu paylaşılmaz) ve aynı anda en fazla
+        ``max_parallel_analyses`` analiz çalışır. Analizler bittikçe ``on_task``
+        ile bildirilir; ``on_token`` yalnızca rapor aşamasının akışını alır.
+        """
+        sources = self.find_sources(inputs, on_task)
+        span.set(sources=len(sources))
+        template = self.get_stage_crew('analysis')
+
+        def analyze(source: dict) -> Any:
+            crew_instance = template.copy()
+            source_inputs = {**inputs, 'selected_source': f"{source['name']} ({source['url']})"}
+            with tracer.span("crew.analysis", source=source['name']) as analysis_span:
+                try:
+                    return self._run_crew(crew_instance, source_inputs, analysis_span, on_task, None)
+                finally:
+                    self._usage_totals.pop(id(crew_instance), None)
+
+        workers = max(1, min(self.max_parallel_analyses, len(sources)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crew-analysis") as pool:
+            # Her analiz çağıranın bağlamında çalışır: iz ebeveyni ve LLM önceliği korunur
+            futures = [pool.submit(contextvars.copy_context().run, analyze, source) for source in sources]
+            analyses = [future.result() for future in futures]
+
+        inputs['analysis_results'] = "\n\n".join(
+            f"Kaynak: {source['name']} ({source['url']})\n{getattr(analysis, 'raw', analysis)}"
+            for source, analysis in zip(sources, analyses)
         )
+        self.reset()
+        return self._run_crew(self.get_stage_crew('report'), inputs, span, on_task, on_token)
+
+    def find_sources(self, inputs: Dict[str, Any], on_task: Optional[Callable[[Any], None]] = None) -> List[dict]:
+        """
+        Sorgu için en alakalı ``top_k_sources`` kaynak. ``pre_route_source`` açıksa
+        doğrudan SourceSelectorTool ile, değilse find_source_task'ın çıktısından seçilir.
+        """
+        k = self.top_k_sources
+        if self.pre_route_source:
+            return self.select_sources(inputs['query'], k)
+        self.reset()
+        with tracer.span("crew.search", k=k) as search_span:
+            result = self._run_crew(self.get_stage_crew('search'), {**inputs, 'top_k_sources': k},
+                                    search_span, on_task, None)
+        found = get_registry().match_all(str(getattr(result, 'raw', result)), k)
+        return found or self.select_sources(inputs['query'], k)
+
+    def _record_usage(self, span, crew_instance: Crew, result: Any):
+        """Agent'lar yeniden kullanıldığından token_usage birikimlidir; bu çalıştırmanın payını kaydet"""
+        usage = getattr(result, 'token_usage', None)
+        if usage is None:
+            return
+        current = (getattr(usage, 'prompt_tokens', 0) or 0, getattr(usage, 'completion_tokens', 0) or 0)
+        previous = self._usage_totals.get(id(crew_instance), (0, 0))
+        self._usage_totals[id(crew_instance)] = current
+        if current[0] < previous[0] or current[1] < previous[1]:
+            previous = (0, 0)
+        span.set(prompt_tokens=current[0] - previous[0], completion_tokens=current[1] - previous[1])
+
+    def stream(self, inputs: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+        """
+        kickoff'u arka planda çalıştırır ve olayları geldikçe üretir:
+        ("token", str), ("task", TaskOutput) ve en sonda ("result", çıktı).
+        """
+        events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+
+        def run():
+            try:
+                result = self.kickoff(inputs,
+                                      on_task=lambda output: events.put(('task', output)),
+                                      on_token=lambda text: events.put(('token', text)))
+                events.put(('result', result))
+            except Exception as e:
+                events.put(('error', e))
+
+        threading.Thread(target=run, name="crew-stream", daemon=True).start()
+        while True:
+            kind, value = events.get()
+            if kind == 'error':
+                raise value
+            yield kind, value
+            if kind == 'result':
+                return
 
     @before_kickoff
     def setup_query(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
         """Sorgu başlamadan önce gerekli hazırlıkları yap"""
         if 'query' not in inputs:
             inputs['query'] = "Tarım ürünleri ihracat verileri"
-        inputs['analysis_depth'] = inputs.get('analysis_depth', 'detailed')
+        inputs['analysis_depth'] = (inputs.get('analysis_depth') or 'detailed').strip().lower()
         return inputs
 
     @after_kickoff
     def log_results(self, output: Any) -> Any:
-        """Sonuçları kaydet ve formatla"""
-        print(f"Analiz Tamamlandı. Sonuçlar:")
-        print("-" * 50)
-        print(output)
+        """Sonuçlar çağırana döner; yazdırma işi REPL'in ve servis modunun"""
         return output
 
     @agent
@@ -159,6 +431,8 @@ class CrewaiTest():
 
 			Lütfen bu sorgu için en uygun veri kaynağını belirleyin. 
 			Kaynakın neden seçildiğini ve ne tür veriler içerdiğini açıklayın.
+			İstenen kaynak sayısı: {inputs.get('top_k_sources', 1)} (birden fazlaysa en uygundan
+			başlayarak her satıra bir kaynak adı ve URL'si yazın)
 			""",
             expected_output="Seçilen kaynak, URL'si ve seçim gerekçesi"
         )
@@ -220,3 +494,45 @@ class CrewaiTest():
             process=Process.sequential,
             verbose=True
         )
+
+    def analysis_crew(self) -> Crew:
+        """Kaynağı önceden seçilmiş sorgular için analiz ve rapor crew'u"""
+        return Crew(
+            agents=[
+                self.data_analyst(),
+                self.report_writer()
+            ],
+            tasks=[
+                self.analyze_data_task(),
+                self.create_report_task()
+            ],
+            process=Process.sequential,
+            verbose=True
+        )
+
+    def search_crew(self) -> Crew:
+        """Paralel mod: yalnızca kaynak araştırması (find_source_task)"""
+        return Crew(
+            agents=[self.source_researcher()],
+            tasks=[self.find_source_task()],
+            process=Process.sequential,
+            verbose=True
+        )
+
+    def source_analysis_crew(self) -> Crew:
+        """Paralel mod: tek bir kaynağın analizi; her kaynak için kopyası çalışır"""
+        return Crew(
+            agents=[self.data_analyst()],
+            tasks=[self.analyze_data_task()],
+            process=Process.sequential,
+            verbose=True
+        )
+
+    def report_crew(self) -> Crew:
+        """Paralel mod: kaynak analizlerini tek raporda birleştirir (analysis_results)"""
+        return Crew(
+            agents=[self.report_writer()],
+            tasks=[self.create_report_task()],
+            process=Process.sequential,
+            verbose=True
+        )
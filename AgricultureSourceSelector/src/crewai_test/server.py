@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+"""
+Çoklu sorgu servis modu.
+
+Birden fazla {query, analysis_depth} işini sınırlı bir iş parçacığı havuzunda
+eşzamanlı çalıştırır ve her iş bittikçe sonucunu JSON satırı olarak döner.
+
+    python -m crewai_test.main batch < jobs.jsonl
+    python -m crewai_test.main serve --port 8080
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from crewai_test.crew import CrewaiTest
+from routing_common.tracing import tracer
+from crewai_test.llm import llm_guard
+
+
+class QueueFullError(Exception):
+    """İş kuyruğu dolu"""
+    pass
+
+
+class CrewService:
+    """
+    CrewaiTest kickoff'larını sınırlı bir havuzda çalıştırır.
+
+    Her işçi iş parçacığının kendi CrewaiTest örneği vardır; crew nesneleri
+    iş parçacıkları arasında paylaşılmaz. Çalışan ve bekleyen iş sayısı
+    ``workers + queue_size`` ile sınırlıdır; dolduğunda ``submit`` bekler
+    veya ``block=False`` ise QueueFullError fırlatır. ``job_timeout``
+    saniyeyi aşan iş zaman aşımı sonucu döner (arka plandaki kickoff
+    durdurulamaz, bitince sessizce atılır).
+    """
+
+    # run_jobs kuyrukta yer beklerken biten sonuçları bu aralıkla kontrol eder
+    poll_interval = 0.1
+
+    def __init__(self, workers: int = 4, queue_size: int = 32, job_timeout: float = 300.0,
+                 crew_factory: Callable[[], CrewaiTest] = CrewaiTest):
+        self.workers = workers
+        self.job_timeout = job_timeout
+        self.crew_factory = crew_factory
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crew-worker")
+        self.capacity = workers + queue_size
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._job_ids = 0
+        self.metrics = {
+            'submitted': 0, 'completed': 0, 'failed': 0, 'timed_out': 0, 'rejected': 0,
+            'queued': 0, 'running': 0,
+        }
+
+    def _crew(self) -> CrewaiTest:
+        crew = getattr(self._local, 'crew', None)
+        if crew is None:
+            crew = self._local.crew = self.crew_factory()
+        return crew
+
+    def _count(self, name: str, delta: int = 1):
+        with self._lock:
+            self.metrics[name] += delta
+
+    @staticmethod
+    def _inputs(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'query': job['query'],
+            'analysis_depth': job.get('analysis_depth', 'detailed'),
+        }
+
+    def submit(self, job: Dict[str, Any], block: bool = True) -> Future:
+        """İşi kuyruğa al; dönen Future iş sonucunu (dict) taşır"""
+        inputs = self._inputs(job)
+        if not self._slots.acquire(blocking=block):
+            self._count('rejected')
+            raise QueueFullError("İş kuyruğu dolu, daha sonra tekrar deneyin")
+        return self._start(job, inputs)
+
+    def _start(self, job: Dict[str, Any], inputs: Dict[str, Any]) -> Future:
+        """Kuyruk yeri alınmış işi çalıştır"""
+        with self._lock:
+            self._job_ids += 1
+            job_id = job.get('id', self._job_ids)
+            self.metrics['submitted'] += 1
+            self.metrics['queued'] += 1
+
+        result: Future = Future()
+        settle_lock = threading.Lock()
+
+        def settle(payload: Dict[str, Any], metric: str):
+            # Zaman aşımı ile gerçek sonuçtan hangisi önce gelirse o geçerlidir
+            with settle_lock:
+                if result.done():
+                    return
+                self._count(metric)
+                result.set_result(payload)
+
+        def execute():
+            self._count('queued', -1)
+            self._count('running')
+            started = time.monotonic()
+            timer = threading.Timer(self.job_timeout, settle, args=(
+                {'id': job_id, **inputs, 'status': 'timeout',
+                 'error': f"İş {self.job_timeout:g} saniyede tamamlanmadı"}, 'timed_out'))
+            timer.daemon = True
+            timer.start()
+            try:
+                output = self._crew().kickoff(inputs)
+                settle({'id': job_id, **inputs, 'status': 'ok', 'result': str(output),
+                        'elapsed_ms': round((time.monotonic() - started) * 1000.0, 1)}, 'completed')
+            except Exception as e:
+                settle({'id': job_id, **inputs, 'status': 'error', 'error': str(e),
+                        'elapsed_ms': round((time.monotonic() - started) * 1000.0, 1)}, 'failed')
+            finally:
+                timer.cancel()
+                self._count('running', -1)
+                self._slots.release()
+
+        self._executor.submit(execute)
+        return result
+
+    def run_jobs(self, jobs: Iterable[Dict[str, Any]], block: bool = True,
+                 max_in_flight: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        İşleri gönder ve sonuçları bitiş sırasına göre üret.
+
+        Gönderim ile sonuç üretimi iç içe yürür: biten işler sonraki iş
+        gönderilmeden önce üretilir, kuyrukta yer beklenirken de bekletilmez.
+        Sonucu alınmamış iş sayısı ``max_in_flight`` ile (varsayılan
+        ``workers + queue_size``) sınırlıdır; sınırda yeni iş okunmaz.
+        """
+        limit = max_in_flight or self.capacity
+        pending = set()
+
+        def finished():
+            done = {future for future in pending if future.done()}
+            pending.difference_update(done)
+            return [future.result() for future in done]
+
+        for job in jobs:
+            try:
+                inputs = self._inputs(job)
+            except KeyError:
+                yield {'id': job.get('id'), 'status': 'error', 'error': "'query' alanı zorunludur"}
+                continue
+            while True:
+                yield from finished()
+                if len(pending) >= limit:
+                    wait(pending, return_when=FIRST_COMPLETED)
+                    continue
+                if self._slots.acquire(blocking=False):
+                    pending.add(self._start(job, inputs))
+                    break
+                if not block:
+                    self._count('rejected')
+                    yield {'id': job.get('id'), 'query': job.get('query'), 'status': 'rejected',
+                           'error': "İş kuyruğu dolu, daha sonra tekrar deneyin"}
+                    break
+                if not pending:
+                    # Bekleyen sonucumuz yok; yer açılana kadar beklemek bir şey geciktirmez
+                    self._slots.acquire()
+                    pending.add(self._start(job, inputs))
+                    break
+                # Yer başka isteklerin işlerinden de açılabilir; beklerken biten sonuçları üret
+                wait(pending, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+        while pending:
+            wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.metrics, 'workers': self.workers}
+
+    def prometheus_text(self) -> str:
+        """Servis sayaçları ve aşama histogramları, Prometheus metin formatında"""
+        lines = []
+        for name, value in self.snapshot().items():
+            kind = "gauge" if name in ('queued', 'running', 'workers') else "counter"
+            metric = f"crew_service_{name}" + ("_total" if kind == "counter" else "")
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n" + tracer.prometheus_text(prefix="crew")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def serve_jsonl(service: CrewService, stream=sys.stdin, out=sys.stdout):
+    """Her satırı bir iş olarak oku; kuyruk dolduğunda okumayı beklet"""
+    def jobs():
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+    for result in service.run_jobs(jobs(), block=True):
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+
+
+def make_http_server(service: CrewService, host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+    """
+    POST /jobs  : tek iş ({query, analysis_depth}) ya da {"jobs": [...]};
+                  sonuçlar bittikçe NDJSON olarak akıtılır
+    GET /metrics: kuyruk derinliği, sayaçlar, aşama süreleri ve LLM devre kesici durumu (JSON)
+    GET /metrics/prometheus: aynı ölçümler Prometheus metin formatında
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status: int, payload: Dict[str, Any]):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.startswith("/metrics/prometheus"):
+                data = service.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            elif self.path.startswith("/metrics"):
+                self._send_json(200, {**service.snapshot(), 'stages': tracer.histograms(),
+                                      'counters': tracer.counters(), 'llm': llm_guard.stats()})
+            else:
+                self._send_json(404, {'error': "Bulunamadı"})
+
+        def do_POST(self):
+            if not self.path.startswith("/jobs"):
+                self._send_json(404, {'error': "Bulunamadı"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            except ValueError:
+                self._send_json(400, {'error': "Geçersiz JSON"})
+                return
+            jobs = body.get('jobs', [body]) if isinstance(body, dict) else body
+            if not all(isinstance(job, dict) and 'query' in job for job in jobs):
+                self._send_json(400, {'error': "'query' alanı zorunludur"})
+                return
+
+            # Kuyruk doluysa bekletmek yerine istemciyi geri çevir
+            futures = []
+            for job in jobs:
+                try:
+                    futures.append(service.submit(job, block=False))
+                except QueueFullError as e:
+                    if not futures:
+                        self._send_json(429, {'error': str(e), **service.snapshot()})
+                        return
+                    break
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for future in as_completed(futures):
+                self._write_chunk(json.dumps(future.result(), ensure_ascii=False).encode("utf-8") + b"\n")
+            for job in jobs[len(futures):]:
+                rejected = {'id': job.get('id'), 'query': job.get('query'), 'status': 'rejected',
+                            'error': "İş kuyruğu dolu, daha sonra tekrar deneyin"}
+                self._write_chunk(json.dumps(rejected, ensure_ascii=False).encode("utf-8") + b"\n")
+            self._write_chunk(b"")
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Tarım Veri Analizi servis modu")
+    parser.add_argument("mode", choices=["batch", "serve"],
+                        help="batch: stdin'den JSONL işler; serve: HTTP/JSON uç noktası")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=32)
+    parser.add_argument("--job-timeout", type=float, default=300.0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--pre-route-source", action="store_true",
+                        help="kaynağı agent döngüsü yerine doğrudan SourceSelectorTool ile seç")
+    parser.add_argument("--top-k-sources", type=int, default=1,
+                        help="1'den büyükse en alakalı k kaynak paralel analiz edilip tek raporda birleştirilir")
+    parser.add_argument("--max-parallel-analyses", type=int, default=4,
+                        help="bir iş içinde aynı anda çalışan kaynak analizi sayısı")
+    args = parser.parse_args(argv)
+
+    service = CrewService(args.workers, args.queue_size, args.job_timeout,
+                          partial(CrewaiTest, pre_route_source=args.pre_route_source,
+                                  top_k_sources=args.top_k_sources,
+                                  max_parallel_analyses=args.max_parallel_analyses))
+    try:
+        if args.mode == "batch":
+            serve_jsonl(service)
+        else:
+            server = make_http_server(service, args.host, args.port)
+            print(f"Servis http://{args.host}:{server.server_address[1]} adresinde çalışıyor", file=sys.stderr)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                server.shutdown()
+    finally:
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cache import normalize_query
+
+MAGIC = b"RIDX"
+FORMAT_VERSION = 2
+# magic, format version, build version, rules fingerprint, entries, slots, tables
+_HEADER = struct.Struct("<4sIQQIII")
+# key hash, key offset, key length, table index; hash 0 marks an empty slot
+_SLOT = struct.Struct("<QIHH")
+_TABLE_NAME = struct.Struct("<H")
+_MAX_KEY_BYTES = 0xFFFF
+
+DEFAULT_PATH = os.getenv("ROUTING_ANSWER_INDEX") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "routing_index.bin")
+
+
+def _hash(key: bytes) -> int:
+    # hashlib loads OpenSSL; processes without an index never pay for it
+    from hashlib import blake2b
+    return int.from_bytes(blake2b(key, digest_size=8).digest(), 'little') or 1
+
+
+def collect_answers(rules: Dict[str, Dict], log_paths: Iterable[str] = (), min_count: int = 1) -> Dict[str, str]:
+    """Normalized query -> table from the rules' example queries and logged (query, table) pairs.
+
+    Logged queries take their most frequent table and need at least
+    ``min_count`` records of it. Example queries are curated and win over
+    the logs; an example listed under several rules keeps the first rule.
+    """
+    counts: Dict[str, Dict[str, int]] = {}
+    for path in log_paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                query, table = record.get('query'), record.get('table')
+                if isinstance(query, str) and query.strip() and isinstance(table, str) and table:
+                    tables = counts.setdefault(normalize_query(query), {})
+                    tables[table] = tables.get(table, 0) + 1
+
+    answers: Dict[str, str] = {}
+    for key, tables in counts.items():
+        table, count = max(tables.items(), key=lambda item: item[1])
+        if count >= min_count:
+            answers[key] = table
+    examples: Dict[str, str] = {}
+    for rule in rules.values():
+        for example in rule['example_queries']:
+            examples.setdefault(normalize_query(example), rule['default_table'])
+    answers.update(examples)
+    return answers
+
+
+def write_index(answers: Dict[str, str], path: str, version: Optional[int] = None,
+                rules_fingerprint: int = 0) -> int:
+    """Write ``{normalized query: table}`` as an index file and return its build version.
+
+    ``rules_fingerprint`` records the ``RuleSet.fingerprint`` the answers
+    were collected under, so readers can tell answers made stale by a rules
+    change. The file is written next to ``path`` and renamed over it, so
+    readers either see the old or the new index, never a partial one.
+    """
+    version = time.time_ns() if version is None else version
+    tables = sorted(set(answers.values()))
+    table_ids = {table: index for index, table in enumerate(tables)}
+    entries = [(key.encode('utf-8'), table_ids[table]) for key, table in answers.items()]
+    entries = [(key, table) for key, table in entries if len(key) <= _MAX_KEY_BYTES]
+
+    # Power-of-two slot count at most half full keeps probe sequences short
+    slot_count = 8
+    while slot_count < 2 * len(entries):
+        slot_count *= 2
+    mask = slot_count - 1
+    slots: List[Optional[Tuple[int, int, int, int]]] = [None] * slot_count
+    keys = bytearray()
+    for key, table in entries:
+        digest = _hash(key)
+        index = digest & mask
+        while slots[index] is not None:
+            index = (index + 1) & mask
+        slots[index] = (digest, len(keys), len(key), table)
+        keys += key
+
+    head = bytearray(_HEADER.pack(MAGIC, FORMAT_VERSION, version, rules_fingerprint,
+                                  len(entries), slot_count, len(tables)))
+    for table in tables:
+        name = table.encode('utf-8')
+        head += _TABLE_NAME.pack(len(name)) + name
+    head += b"\0" * (-len(head) % 8)
+    empty = _SLOT.pack(0, 0, 0, 0)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(head)
+        f.write(b"".join(_SLOT.pack(*slot) if slot else empty for slot in slots))
+        f.write(keys)
+    os.replace(tmp_path, path)
+    return version
+
+
+class _Mapping:
+    """One opened index file; never modified, so a lookup runs on a single consistent version"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        (magic, file_format, self.version, self.rules_fingerprint,
+         self.entries, self.slot_count, table_count) = _HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or file_format != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} routing index")
+        offset = _HEADER.size
+        self.tables: List[str] = []
+        for _ in range(table_count):
+            (length,) = _TABLE_NAME.unpack_from(self.data, offset)
+            offset += _TABLE_NAME.size
+            self.tables.append(self.data[offset:offset + length].decode('utf-8'))
+            offset += length
+        self.slots_offset = offset + (-offset % 8)
+        self.keys_offset = self.slots_offset + self.slot_count * _SLOT.size
+
+    def get(self, key: bytes) -> Optional[str]:
+        digest = _hash(key)
+        mask = self.slot_count - 1
+        index = digest & mask
+        while True:
+            slot_hash, key_offset, key_length, table = _SLOT.unpack_from(
+                self.data, self.slots_offset + index * _SLOT.size)
+            if slot_hash == 0:
+                return None
+            if slot_hash == digest and key_length == len(key):
+                start = self.keys_offset + key_offset
+                if self.data[start:start + key_length] == key:
+                    return self.tables[table]
+            index = (index + 1) & mask
+
+
+class AnswerIndex:
+    """Read side of the precomputed query -> table index.
+
+    Queries are normalized like cache keys and looked up in an
+    open-addressing hash table inside the memory-mapped file, so a lookup
+    costs a hash and a probe or two whatever the index size, and every
+    worker process shares the same page cache. The file is checked at most
+    every ``check_seconds``; a rebuilt file is mapped and swapped in whole,
+    lookups already running finish on the old mapping. A missing file just
+    means no index.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, check_seconds: float = 1.0):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.reloads = 0
+        self._mapping: Optional[_Mapping] = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def _current(self) -> Optional[_Mapping]:
+        now = time.monotonic()
+        # One thread re-checks the file; the others keep using the mapping they have
+        if (self._checked is None or now - self._checked >= self.check_seconds) and self._lock.acquire(blocking=False):
+            try:
+                self._checked = now
+                self._refresh()
+            finally:
+                self._lock.release()
+        return self._mapping
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._mapping = None
+            return
+        current = self._mapping
+        if current is not None and current.identity == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            return
+        try:
+            mapping = _Mapping(self.path)
+        except (OSError, ValueError, struct.error) as e:
+            logging.getLogger(__name__).warning(f"Routing index {self.path} not loaded: {e}")
+            return
+        # Readers drop the old mapping when they finish; it is unmapped once unreferenced
+        self._mapping = mapping
+        self.reloads += 1
+        logging.getLogger(__name__).info(
+            f"Routing index version {mapping.version} loaded ({mapping.entries} answers)")
+
+    def reload(self):
+        """Check the file now instead of waiting for the next interval"""
+        self._checked = None
+        self._current()
+
+    def lookup(self, query: str) -> Optional[str]:
+        """Table for a known query, None when the query (or the index) is unknown"""
+        entry = self.lookup_entry(query)
+        return entry[0] if entry else None
+
+    def lookup_entry(self, query: str) -> Optional[Tuple[str, int]]:
+        """(table, rules fingerprint of the index it came from) for a known query"""
+        mapping = self._current()
+        if mapping is None:
+            return None
+        table = mapping.get(normalize_query(query).encode('utf-8'))
+        return (table, mapping.rules_fingerprint) if table else None
+
+    @property
+    def version(self) -> Optional[int]:
+        mapping = self._current()
+        return mapping.version if mapping is not None else None
+
+    def stats(self) -> Dict[str, object]:
+        mapping = self._current()
+        return {'path': self.path, 'version': mapping.version if mapping else None,
+                'rules_fingerprint': mapping.rules_fingerprint if mapping else None,
+                'entries': mapping.entries if mapping else 0, 'reloads': self.reloads}
+
+
+class AnswerLog:
+    """Appends routing decisions as ``{"query": ..., "table": ...}`` JSONL, the traffic input of a build"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def record(self, query: str, table: str):
+        line = json.dumps({'query': query, 'table': table}, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, 'a', encoding='utf-8')
+                self._file.write(line)
+                self._file.flush()
+            except OSError as e:
+                logging.getLogger(__name__).warning(f"Answer log write failed: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or query the precomputed routing answer index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile the rules' example queries and logged answers")
+    build.add_argument("--log", action="append", default=[],
+                       help="JSONL of {\"query\": ..., \"table\": ...} records (ROUTING_ANSWER_LOG); repeatable")
+    build.add_argument("--min-count", type=int, default=1,
+                       help="records a logged query needs before it is trusted")
+    build.add_argument("--rules", help="rules file; defaults to ROUTING_RULES_PATH or rules.json")
+    build.add_argument("--out", default=DEFAULT_PATH)
+    lookup = commands.add_parser("lookup", help="print the indexed table of a query")
+    lookup.add_argument("query")
+    lookup.add_argument("--index", default=DEFAULT_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        # Only the rules are needed: no LLM client or deployment settings
+        from rule_config import RuleSet, load_rules
+        routing = RuleSet(load_rules(args.rules))
+        answers = collect_answers(routing.rules, args.log, args.min_count)
+        version = write_index(answers, args.out, rules_fingerprint=routing.fingerprint)
+        print(json.dumps({'path': args.out, 'version': version, 'entries': len(answers)}))
+    else:
+        print(AnswerIndex(args.index).lookup(args.query) or "")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
-import openai
+import os
+import sys
+import json
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+from routing_common.source_registry import SourceRegistry, get_registry
+from routing_common.resilience import Resilient, RetryPolicy, is_unavailable
+from routing_common.rate_limit import shared_limiter
 
 @dataclass
 class OpenAIConfig:
@@ -22,44 +30,132 @@ openai_config = OpenAIConfig(
     location=""
 )
 
-openai.api_type = "azure"
-openai.api_base = openai_config.endpoint
-openai.api_key = openai_config.subscription_key
-openai.api_version = openai_config.api_version
+_client = None
+
+def get_client():
+    """Shared AzureOpenAI client, created on the first recommendation"""
+    global _client
+    if _client is None:
+        from openai import AzureOpenAI
+        _client = AzureOpenAI(
+            azure_endpoint=openai_config.endpoint,
+            api_key=openai_config.subscription_key,
+            api_version=openai_config.api_version,
+            # llm_guard owns retries
+            max_retries=0
+        )
+    return _client
+
+# Per-call timeout, retries and circuit breaker for the recommendation calls
+llm_guard = Resilient(
+    "source_selector",
+    timeout=float(os.getenv("ROUTING_LLM_TIMEOUT", "10")),
+    policy=RetryPolicy(max_attempts=int(os.getenv("ROUTING_LLM_MAX_ATTEMPTS", "3"))),
+    # Same deployment as the router: share its RPM/TPM budget
+    limiter=shared_limiter(openai_config.deployment),
+)
+
+@lru_cache(maxsize=8)
+def build_sources_prompt_prefix(sources: Tuple[Tuple[str, str], ...]) -> str:
+    """Static part of the recommendation prompt, rebuilt only when the sources change"""
+    return (
+        "You are an AI system that recommends data sources based on user queries. Here is the list of sources: \n"
+        + "\n".join([f"{name}: {description}" for name, description in sources]) + "\n\n"
+    )
+
+def build_recommendation_prompt(registry: SourceRegistry, query: str) -> str:
+    """Full recommendation prompt; the ensemble's source selector vote asks the same question"""
+    return (
+        build_sources_prompt_prefix(registry.prompt_entries)
+        + f"User query: {query}\n"
+        + "Which data source is the most relevant? Respond with the name and URL only."
+    )
 
 class AgricultureSourceSelector:
-    def __init__(self):
-        self.sources = [
-            {"name": "Eurostat International Trade in Goods", "url": "https://ec.europa.eu/eurostat/web/international-trade-in-goods", "description": "Provides statistical data on international trade in goods for the EU."},
-            {"name": "Fastmarkets", "url": "https://www.fastmarkets.com/", "description": "Offers market intelligence on global commodity prices and trends."},
-            {"name": "Trade Data Monitor", "url": "https://tradedatamonitor.com/", "description": "Aggregates trade data from multiple countries to monitor global trade flows."},
-            {"name": "USDA ESRQuery", "url": "https://apps.fas.usda.gov/esrquery/ESRHome.aspx", "description": "Delivers export sales reporting data from the USDA."},
-            {"name": "USDA Foreign Agricultural Service", "url": "https://www.fas.usda.gov/", "description": "Focuses on international trade policy and export support for U.S. agriculture."},
-            {"name": "USDA National Agricultural Statistics Service", "url": "https://www.nass.usda.gov/", "description": "Provides comprehensive agricultural statistics for the U.S."}
-        ]
+    def __init__(self, registry: Optional[SourceRegistry] = None):
+        self._registry = registry
+
+    @property
+    def registry(self) -> SourceRegistry:
+        # Without an explicit registry follow the shared one as its file is reloaded
+        return self._registry or get_registry()
+
+    @property
+    def sources(self):
+        return self.registry.sources
 
     def recommend_source(self, query: str) -> dict:
-        prompt = (
-            "You are an AI system that recommends data sources based on user queries. Here is the list of sources: \n"
-            + "\n".join([f"{s['name']}: {s['description']}" for s in self.sources]) + "\n\n"
-            + f"User query: {query}\n"
-            + "Which data source is the most relevant? Respond with the name and URL only."
-        )
+        registry = self.registry
+        prompt = build_recommendation_prompt(registry, query)
 
-        response = openai.ChatCompletion.create(
-            engine=openai_config.deployment,
-            messages=[{"role": "system", "content": prompt}],
-            temperature=0
-        )
+        try:
+            response = llm_guard.call(
+                get_client().chat.completions.create,
+                model=openai_config.deployment,
+                messages=[{"role": "system", "content": prompt}],
+                temperature=0
+            )
+        except Exception as e:
+            # Degrade to a guess from the query words while the LLM is unreachable;
+            # a bad request or a bug is raised instead of being hidden behind a guess
+            source = registry.guess(query) if is_unavailable(e) else None
+            if source is None:
+                raise
+            logging.getLogger(__name__).warning(f"LLM unavailable, using local guess: {source['name']}")
+            return source
+
+        result = response.choices[0].message.content or ""
+        return registry.match(result) or {"name": "Unknown", "url": "No matching source found"}
+
+def recommend_sources_jsonl(selector: AgricultureSourceSelector, stream=sys.stdin, out=sys.stdout,
+                            workers: int = 8, max_in_flight: Optional[int] = None):
+    """Read {"query": ...} lines and write each recommendation as soon as it is ready.
+
+    Finished recommendations are written before the next line is submitted,
+    and no more lines are read while ``max_in_flight`` (default twice the
+    workers) are pending. A line that is not JSON or has no "query" string
+    gets an error record instead of stopping the run.
+    """
+    limit = max_in_flight or 2 * workers
+
+    def write(payload):
+        out.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        out.flush()
+
+    def finish(done):
+        for future in done:
+            job = futures.pop(future)
+            try:
+                write({"id": job.get("id"), "query": job["query"], "status": "ok", "source": future.result()})
+            except Exception as e:
+                write({"id": job.get("id"), "query": job["query"], "status": "error", "error": str(e)})
 
-        result = response.choices[0].message['content']
-        for source in self.sources:
-            if source['name'] in result:
-                return source
-        return {"name": "Unknown", "url": "No matching source found"}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                write({"line": number, "status": "error", "error": f"Invalid JSON: {e}"})
+                continue
+            if not isinstance(job, dict) or not isinstance(job.get("query"), str):
+                write({"id": job.get("id") if isinstance(job, dict) else None, "line": number,
+                       "status": "error", "error": 'Each line needs a "query" string'})
+                continue
+            finish([future for future in futures if future.done()])
+            if len(futures) >= limit:
+                finish(wait(futures, return_when=FIRST_COMPLETED).done)
+            futures[pool.submit(selector.recommend_source, job["query"])] = job
+        while futures:
+            finish(wait(futures, return_when=FIRST_COMPLETED).done)
 
 if __name__ == "__main__":
     selector = AgricultureSourceSelector()
+    if "--jsonl" in sys.argv:
+        recommend_sources_jsonl(selector)
+        sys.exit(0)
     print("Tarım Verisi Kaynak Seçim Sistemi")
     while True:
         query = input("Sorgunuzu girin (çıkmak için 'exit' yazın): ")
@@ -0,0 +1,259 @@
+"""Local stand-in for the Azure OpenAI chat completions endpoint.
+
+Serves ``POST /openai/deployments/<deployment>/chat/completions`` (what both
+``AzureOpenAI`` and the legacy ``openai.ChatCompletion`` with
+``api_type = "azure"`` call) plus ``/v1/chat/completions``. Answers come from
+a label table keyed by normalized query, with optional injected latency,
+error rate (wrong answers) and failure rate (HTTP 429 with ``Retry-After`` or
+503, for exercising retries and the circuit breaker), and replies use the same shape the real service returns for
+free-text, ``select_rule`` function calls and JSON-mode batch prompts. Requests
+with ``"stream": true`` get the reply as server-sent ``chat.completion.chunk``
+events, one word per delta after the injected latency, led by the choiceless
+chunk Azure sends first.
+Rule-matching prompts are answered from the ``rule`` table and source
+selector prompts ("User query: ...") from the ``source`` table.
+
+Run standalone with ``python benchmarks/fake_azure.py --port 8765``; GET
+``/stats`` returns request and token counters.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _key(query: str) -> str:
+    return _WHITESPACE_RE.sub(' ', query).strip().lower()
+
+
+def _tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class FakeAzure:
+    """Answer table, latency model and counters shared by all handler threads"""
+
+    def __init__(self, labels: Optional[Dict[str, Dict[str, str]]] = None, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0, seed: int = 0,
+                 failure_rate: float = 0.0, retry_after_ms: int = 50):
+        self.labels = {
+            kind: {_key(query): label for query, label in table.items()}
+            for kind, table in (labels or {}).items()
+        }
+        self.choices = {kind: sorted(set(table.values())) for kind, table in self.labels.items()}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.failure_rate = failure_rate
+        self.retry_after_ms = retry_after_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'failures': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+    def answer(self, query: str, kind: str = "rule") -> str:
+        label = self.labels.get(kind, {}).get(_key(query))
+        with self._lock:
+            wrong = self._random.random() < self.error_rate
+            if label is None or wrong:
+                others = [choice for choice in self.choices.get(kind, []) if choice != label]
+                return self._random.choice(others) if others else "unknown"
+        return label
+
+    def failure(self) -> Optional[int]:
+        """Status of an injected transient failure (429 or 503), or None"""
+        with self._lock:
+            if self._random.random() >= self.failure_rate:
+                return None
+            self.stats['failures'] += 1
+            return self._random.choice((429, 503))
+
+    def delay(self):
+        with self._lock:
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def complete(self, body: Dict) -> Dict:
+        self.delay()
+        prompt = "\n".join(str(message.get("content") or "") for message in body.get("messages", []))
+        message: Dict = {"role": "assistant", "content": None}
+
+        tools = body.get("tools") or []
+        if "Queries:\n" in prompt and (body.get("response_format") or {}).get("type") == "json_object":
+            lines = prompt.rsplit("Queries:\n", 1)[1].strip().splitlines()
+            answers = {}
+            for line in lines:
+                index, _, query = line.partition(": ")
+                answers[index] = self.answer(query)
+            message["content"] = json.dumps(answers)
+        elif tools:
+            query = self._extract(prompt, "Query: ")
+            if tools[0]["function"]["name"] == "rank_rules":
+                arguments = json.dumps({"rankings": [{"rule": self.answer(query), "score": 0.9}]})
+            else:
+                arguments = json.dumps({"rule": self.answer(query), "confidence": 0.9})
+            message["tool_calls"] = [{
+                "id": "call_0", "type": "function",
+                "function": {"name": tools[0]["function"]["name"], "arguments": arguments}
+            }]
+        else:
+            query = self._extract(prompt, "User query: ") or self._extract(prompt, "Kullanıcı sorgusu: ")
+            if query:
+                message["content"] = f"The most appropriate choice is {self.answer(query, 'source')}."
+            else:
+                query = self._extract(prompt, "Query: ")
+                message["content"] = f"The most appropriate choice is {self.answer(query)}."
+
+        prompt_tokens = _tokens(prompt) + (_tokens(json.dumps(tools)) if tools else 0)
+        completion_tokens = _tokens(message["content"] or json.dumps(message.get("tool_calls")))
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['completion_tokens'] += completion_tokens
+        return {
+            "id": f"chatcmpl-{self.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": message,
+                         "finish_reason": "tool_calls" if tools else "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    @staticmethod
+    def chunks(completion: Dict) -> List[Dict]:
+        """``complete``'s reply as the chunk sequence of a streamed response"""
+        message = completion["choices"][0]["message"]
+        base = {key: completion[key] for key in ("id", "created", "model")}
+        base["object"] = "chat.completion.chunk"
+        deltas: List[Dict] = [{"role": "assistant", "content": ""}]
+        if message.get("tool_calls"):
+            deltas.append({"tool_calls": [dict(call, index=index) for index, call in enumerate(message["tool_calls"])]})
+        else:
+            deltas.extend({"content": word} for word in re.findall(r"\S+\s*", message["content"] or ""))
+        chunks = [dict(base, choices=[], prompt_filter_results=[])]
+        chunks.extend(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]) for delta in deltas)
+        chunks.append(dict(base, choices=[{"index": 0, "delta": {},
+                                           "finish_reason": completion["choices"][0]["finish_reason"]}]))
+        return chunks
+
+    @staticmethod
+    def _extract(prompt: str, marker: str) -> str:
+        position = prompt.rfind(marker)
+        if position < 0:
+            return ""
+        return prompt[position + len(marker):].split("\n", 1)[0]
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+
+def _handler(fake: FakeAzure):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, chunks: List[Dict]):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in chunks:
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.startswith("/stats"):
+                self._send(200, fake.snapshot())
+            else:
+                self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            path = self.path.split("?", 1)[0]
+            if not path.endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send(400, {"error": {"message": "invalid JSON"}})
+                return
+            status = fake.failure()
+            if status == 429:
+                self._send(429, {"error": {"code": "429", "message": "Rate limit exceeded"}},
+                           {"retry-after-ms": str(fake.retry_after_ms)})
+            elif status is not None:
+                self._send(status, {"error": {"message": "Service unavailable"}})
+            elif body.get("stream"):
+                self._stream(fake.chunks(fake.complete(body)))
+            else:
+                self._send(200, fake.complete(body))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections are not errors
+        if not isinstance(sys.exc_info()[1], ConnectionResetError):
+            super().handle_error(request, client_address)
+
+
+def start_server(fake: FakeAzure, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Serve ``fake`` on a daemon thread; the bound address is ``server.server_address``"""
+    server = _Server((host, port), _handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-azure", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Azure OpenAI chat completions endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--labels", help='JSON file: {"rule": {query: rule}, "source": {query: source name}}')
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered 429/503")
+    args = parser.parse_args()
+
+    labels = {}
+    if args.labels:
+        with open(args.labels, encoding="utf-8") as f:
+            labels = json.load(f)
+    server = start_server(FakeAzure(labels, args.latency_ms, args.jitter_ms, args.error_rate,
+                                    failure_rate=args.failure_rate),
+                          args.host, args.port)
+    print(f"Fake Azure endpoint on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
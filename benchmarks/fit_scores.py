@@ -0,0 +1,156 @@
+"""Fit the ranking score parameters on labelled queries.
+
+Reads JSONL records ``{"query": ..., "rule": ...}`` (``"rules": [...]`` when
+several rules are right), ranks every query through the LLM with
+temperature scaling off and through the keyword router, and prints the
+``ROUTING_RANK_TEMPERATURE`` and ``ROUTING_KEYWORD_CONFIDENCE`` that
+minimize the log loss of "this rule applies" on those labels. Use reviewed
+traffic: the rules' own example queries are what the keyword router is
+built from, so they would fit an overconfident keyword score. Run from the
+repository root:
+
+    python benchmarks/fit_scores.py labelled.jsonl [--out fit.json]
+
+With ``--fake-error-rate`` the LLM calls go to the local fake endpoint in
+``benchmarks/fake_azure.py`` instead, answering from the labels with that
+fraction of wrong answers; that only exercises the fit itself.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+from typing import Iterable, List, Optional, Set, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+_GOLDEN = (math.sqrt(5) - 1) / 2
+
+
+def load_labels(path: str) -> List[Tuple[str, Set[str]]]:
+    """(query, acceptable rule names) from a JSONL file; malformed lines are skipped"""
+    labelled = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            rules = record.get('rules') or ([record['rule']] if record.get('rule') else [])
+            if isinstance(record.get('query'), str) and rules:
+                labelled.append((record['query'], set(rules)))
+    return labelled
+
+
+def log_loss(samples: Iterable[Tuple[float, bool]], temperature: float = 1.0) -> float:
+    """Mean negative log-likelihood of the outcomes under the temperature-scaled scores"""
+    from main import calibrate_score
+
+    losses = []
+    for score, applies in samples:
+        probability = min(max(calibrate_score(score, temperature), 1e-4), 1 - 1e-4)
+        losses.append(-math.log(probability if applies else 1 - probability))
+    return sum(losses) / len(losses) if losses else 0.0
+
+
+def fit_temperature(samples: List[Tuple[float, bool]], low: float = 0.05, high: float = 20.0,
+                    iterations: int = 60) -> float:
+    """Temperature minimizing ``log_loss``; golden-section search over its logarithm"""
+    if not samples:
+        return 1.0
+    a, b = math.log(low), math.log(high)
+    loss = lambda x: log_loss(samples, math.exp(x))
+    c, d = b - _GOLDEN * (b - a), a + _GOLDEN * (b - a)
+    loss_c, loss_d = loss(c), loss(d)
+    for _ in range(iterations):
+        if loss_c < loss_d:
+            b, d, loss_d = d, c, loss_c
+            c = b - _GOLDEN * (b - a)
+            loss_c = loss(c)
+        else:
+            a, c, loss_c = c, d, loss_d
+            d = a + _GOLDEN * (b - a)
+            loss_d = loss(d)
+    return round(math.exp((a + b) / 2), 3)
+
+
+def fit_keyword_confidence(outcomes: List[bool]) -> Optional[float]:
+    """Share of queries whose best keyword hit was right, kept off 0 and 1"""
+    if not outcomes:
+        return None
+    return round(min(max(sum(outcomes) / len(outcomes), 0.01), 0.99), 4)
+
+
+def collect(labelled: List[Tuple[str, Set[str]]]) -> Tuple[List[Tuple[float, bool]], List[bool]]:
+    """(stated LLM score, rule applies) per ranked rule and best-keyword-hit outcomes per query"""
+    import main
+
+    llm_samples: List[Tuple[float, bool]] = []
+    keyword_outcomes: List[bool] = []
+    temperature, main.RANK_TEMPERATURE = main.RANK_TEMPERATURE, 1.0
+    try:
+        for query, rules in labelled:
+            for rule_name, score in main.rank_query_rules(query, local_first=False):
+                llm_samples.append((score, rule_name in rules))
+            scored = main.routing.keyword_router.score(query)
+            if scored:
+                keyword_outcomes.append(scored[0][0] in rules)
+    finally:
+        main.RANK_TEMPERATURE = temperature
+    return llm_samples, keyword_outcomes
+
+
+def run(args) -> dict:
+    labelled = load_labels(args.labels)
+    server = None
+    if args.fake_error_rate is not None:
+        from openai import AzureOpenAI
+        from fake_azure import FakeAzure, start_server
+        import main
+
+        fake = FakeAzure({'rule': {query: sorted(rules)[0] for query, rules in labelled}},
+                         error_rate=args.fake_error_rate, seed=args.seed)
+        server = start_server(fake)
+        main.set_client(AzureOpenAI(azure_endpoint=f"http://127.0.0.1:{server.server_address[1]}",
+                                    api_key="fake", max_retries=0,
+                                    api_version=main.openai_config.api_version or "2024-02-15-preview"))
+    try:
+        llm_samples, keyword_outcomes = collect(labelled)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    temperature = fit_temperature(llm_samples)
+    keyword_confidence = fit_keyword_confidence(keyword_outcomes)
+    env = {'ROUTING_RANK_TEMPERATURE': str(temperature)}
+    if keyword_confidence is not None:
+        env['ROUTING_KEYWORD_CONFIDENCE'] = str(keyword_confidence)
+    return {
+        'queries': len(labelled),
+        'llm_samples': len(llm_samples),
+        'keyword_samples': len(keyword_outcomes),
+        'temperature': temperature,
+        'log_loss': {'stated': round(log_loss(llm_samples), 4),
+                     'fitted': round(log_loss(llm_samples, temperature), 4)},
+        'keyword_confidence': keyword_confidence,
+        'env': env,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the ranking score temperature and keyword confidence")
+    parser.add_argument("labels", help='JSONL of {"query": ..., "rule": ...} or {"query": ..., "rules": [...]}')
+    parser.add_argument("--fake-error-rate", type=float,
+                        help="rank against the local fake endpoint with this fraction of wrong answers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
@@ -0,0 +1,77 @@
+"""Cold import cost of the router module.
+
+Runs ``python -X importtime -c "import main"`` in a fresh interpreter a few
+times, reports the best cumulative import time of ``main`` and the heaviest
+modules it pulled in, and checks that the heavy optional dependencies were
+not imported. Run from the repository root:
+
+    python benchmarks/import_time.py [--module main] [--runs 5] [--budget-ms 150]
+
+Exits non-zero when a forbidden module is imported at startup or the budget
+is exceeded, so it can guard CI.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must only be imported on first LLM call / first agent access, or, for
+# sqlite3 and numpy, when the persistent or semantic cache is first used
+FORBIDDEN = ('crewai', 'openai', 'httpx', 'sqlite3', 'numpy')
+
+
+def import_profile(module: str) -> Tuple[Dict[str, Tuple[int, int]], List[str]]:
+    """{module: (self_us, cumulative_us)} and the forbidden modules that got imported"""
+    probe = (f"import {module}, sys, json; "
+             f"print(json.dumps([m for m in {FORBIDDEN!r} if m in sys.modules]))")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    timings: Dict[str, Tuple[int, int]] = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings, json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run(module: str, runs: int, top: int) -> Dict:
+    best = None
+    for _ in range(runs):
+        timings, forbidden = import_profile(module)
+        total = timings[module][1]
+        if best is None or total < best[0]:
+            best = (total, timings, forbidden)
+    total, timings, forbidden = best
+    heaviest = sorted(timings.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    return {
+        'module': module,
+        'cumulative_ms': round(total / 1000.0, 2),
+        'forbidden_imported': forbidden,
+        'heaviest_self_ms': {name: round(self_us / 1000.0, 2) for name, (self_us, _) in heaviest},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time benchmark for the router module")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5, help="best of N fresh interpreters")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, help="fail when the cumulative import time exceeds this")
+    args = parser.parse_args()
+
+    report = run(args.module, args.runs, args.top)
+    print(json.dumps(report, indent=2))
+    if report['forbidden_imported']:
+        sys.exit(f"imported at startup: {', '.join(report['forbidden_imported'])}")
+    if args.budget_ms is not None and report['cumulative_ms'] > args.budget_ms:
+        sys.exit(f"import took {report['cumulative_ms']} ms, budget {args.budget_ms} ms")
@@ -0,0 +1,82 @@
+"""Per-call prompt assembly cost, before and after prompt prefix caching.
+
+Run from the repository root:
+
+    python benchmarks/prompt_assembly.py [--number 20000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from azureAIsystem import AgricultureSourceSelector, build_sources_prompt_prefix
+from routing_common.source_registry import get_registry
+
+QUERY = "What is the weekly percentage of corn planted in each state?"
+
+
+def legacy_rule_prompt(query: str) -> str:
+    # The per-call string concatenation match_query_to_rule used to do
+    prompt = """Match the query to the most appropriate rule based on the rule descriptions below:
+
+Rules and Descriptions:
+"""
+    for rule_name, rule_details in main.rules.items():
+        prompt += f"\nRule: {rule_name}\n"
+        prompt += f"Description: {rule_details['description']}\n"
+        prompt += f"Keywords: {', '.join(rule_details['keywords'])}\n"
+        prompt += f"Example Queries:\n"
+        for example in rule_details['example_queries']:
+            prompt += f"- {example}\n"
+    prompt += f"\nQuery: {query}\n"
+    prompt += "Please match the query to the most appropriate rule and explain why. Make sure to include the rule name in your response."
+    return prompt
+
+
+def cached_rule_prompt(query: str) -> str:
+    return main.rule_prompt.render(query=query)
+
+
+def legacy_sources_prompt(sources, query: str) -> str:
+    return (
+        "You are an AI system that recommends data sources based on user queries. Here is the list of sources: \n"
+        + "\n".join([f"{s['name']}: {s['description']}" for s in sources]) + "\n\n"
+        + f"User query: {query}\n"
+        + "Which data source is the most relevant? Respond with the name and URL only."
+    )
+
+
+def cached_sources_prompt(sources, query: str) -> str:
+    return (
+        build_sources_prompt_prefix(get_registry().prompt_entries)
+        + f"User query: {query}\n"
+        + "Which data source is the most relevant? Respond with the name and URL only."
+    )
+
+
+def measure(label: str, func, number: int) -> float:
+    per_call = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"{label:<32} {per_call * 1e6:8.2f} us/call")
+    return per_call
+
+
+def run(number: int):
+    sources = AgricultureSourceSelector().sources
+    assert legacy_rule_prompt(QUERY) == cached_rule_prompt(QUERY)
+    assert legacy_sources_prompt(sources, QUERY) == cached_sources_prompt(sources, QUERY)
+
+    before = measure("rules prompt (concatenation)", lambda: legacy_rule_prompt(QUERY), number)
+    after = measure("rules prompt (cached prefix)", lambda: cached_rule_prompt(QUERY), number)
+    print(f"{'':<32} {before / after:8.1f}x faster")
+    before = measure("sources prompt (join)", lambda: legacy_sources_prompt(sources, QUERY), number)
+    after = measure("sources prompt (cached prefix)", lambda: cached_sources_prompt(sources, QUERY), number)
+    print(f"{'':<32} {before / after:8.1f}x faster")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    run(parser.parse_args().number)
@@ -0,0 +1,354 @@
+"""Offline routing benchmark.
+
+Replays a labelled corpus (every ``example_queries`` entry in ``main.rules``
+plus generated paraphrases) against the router and the source selectors,
+with all LLM traffic going to the local fake Azure endpoint in
+``benchmarks/fake_azure.py``. Prints one JSON report with throughput,
+p50/p95/p99 latency, cache hit rate and token counts per target.
+
+The fake answers from the corpus labels, so this measures cost, not
+routing quality. ``label_agreement`` only checks that those answers
+survive prompting, parsing, caching and fallbacks intact: it is 1.0
+unless ``--error-rate`` injects wrong answers or something along the way
+loses them. Run from the repository root:
+
+    python benchmarks/routing_benchmark.py --latency-ms 300 --concurrency 8 --out report.json
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Set, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_azure import FakeAzure, start_server
+from routing_common.source_registry import get_registry
+
+DEFAULT_TOOL_PACKAGES = (os.path.join("AgricultureSourceSelector", "src"), os.path.join("crewai_test", "src"))
+
+
+def rule_sources(rules: Dict) -> Dict[str, str]:
+    """Which source each rule's questions should be answered from, via the registry aliases"""
+    return {name: get_registry().get(rule['default_table'])['name'] for name, rule in rules.items()}
+
+COMMODITIES = ['corn', 'wheat', 'barley', 'sorghum', 'soybeans']
+
+PARAPHRASE_TEMPLATES = {
+    'price_rules': [
+        "{c} price list for this month",
+        "average, low and high {c} prices over the past 90 days",
+        "how much does {c} cost on the spot market",
+    ],
+    'agriculture_rules': [
+        "weekly percentage of {c} planted in each state",
+        "annual national {c} yield per acre harvested",
+        "crop condition of {c} rated excellent or good on US farms",
+    ],
+    'export_rules': [
+        "weekly net export sales and cumulative sales of {c}",
+        "{c} export sales compared with the USDA forecast",
+    ],
+    'europe_rules': [
+        "{c} production in european countries by year",
+        "EU {c} output for France and Germany",
+    ],
+    'trade_rules': [
+        "monthly {c} import and export trade flows for Brazil and Ukraine",
+        "international trade balance of {c} by country",
+    ],
+    'psd_rules': [
+        "{c} production, supply and distribution balance",
+        "PSD ending stocks and supply of {c}",
+    ],
+}
+
+
+def build_corpus(rules: Dict) -> List[Tuple[str, Set[str]]]:
+    """(query, acceptable rule names); examples listed under several rules accept any of them"""
+    accepted: Dict[str, Set[str]] = {}
+    for rule_name, rule_details in rules.items():
+        for example in rule_details['example_queries']:
+            accepted.setdefault(example, set()).add(rule_name)
+            # Case and spacing variants exercise cache key normalization
+            accepted.setdefault("  " + example.lower(), set()).add(rule_name)
+    for rule_name, templates in PARAPHRASE_TEMPLATES.items():
+        if rule_name not in rules:
+            continue
+        for template in templates:
+            for commodity in COMMODITIES:
+                accepted.setdefault(template.format(c=commodity), set()).add(rule_name)
+    return sorted(accepted.items())
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def replay(fake: FakeAzure, corpus: List[Tuple[str, Set[str]]], call: Callable[[str], str],
+           expected: Callable[[Set[str]], Set[str]], concurrency: int, passes: int,
+           cache_stats: Callable[[], Dict] = None) -> Dict:
+    before = fake.snapshot()
+    cache_before = cache_stats() if cache_stats else None
+    latencies: List[float] = []
+    agreed = errors = 0
+    sample_errors: List[str] = []
+
+    def one(item):
+        query, labels = item
+        start = time.perf_counter()
+        try:
+            answer = call(query)
+            error = None
+        except Exception as e:
+            answer, error = None, f"{type(e).__name__}: {e}"
+        return time.perf_counter() - start, answer in expected(labels), error
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(passes):
+            for elapsed, agrees, error in pool.map(one, corpus):
+                latencies.append(elapsed * 1000.0)
+                agreed += agrees
+                if error:
+                    errors += 1
+                    if len(sample_errors) < 3:
+                        sample_errors.append(error)
+    wall = time.perf_counter() - started
+
+    after = fake.snapshot()
+    total = len(corpus) * passes
+    report = {
+        'queries': total,
+        'errors': errors,
+        'throughput_qps': round(total / wall, 2) if wall else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 3),
+            'p95': round(percentile(latencies, 0.95), 3),
+            'p99': round(percentile(latencies, 0.99), 3),
+            'mean': round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        },
+        'llm_calls': after['requests'] - before['requests'],
+        'served_without_llm': round(1 - (after['requests'] - before['requests']) / total, 4) if total else None,
+        'tokens': {
+            'prompt': after['prompt_tokens'] - before['prompt_tokens'],
+            'completion': after['completion_tokens'] - before['completion_tokens'],
+        },
+        'label_agreement': round(agreed / total, 4) if total else None,
+    }
+    if cache_stats:
+        cache_after = cache_stats()
+        hits = cache_after.get('hits', 0) - cache_before.get('hits', 0)
+        misses = cache_after.get('misses', 0) - cache_before.get('misses', 0)
+        report['cache_hit_rate'] = round(hits / (hits + misses), 4) if hits + misses else 0.0
+    if sample_errors:
+        report['sample_errors'] = sample_errors
+    return report
+
+
+def _memory_cache_stats(cache) -> Callable[[], Dict]:
+    # LayeredCache reports per layer; the memory layer is what callers hit first
+    return lambda: cache.stats().get('memory', cache.stats())
+
+
+def bench_router(base_url: str, fake: FakeAzure, corpus, args) -> Dict:
+    from openai import AzureOpenAI
+    import main
+
+    main.set_client(AzureOpenAI(azure_endpoint=base_url, api_key="fake",
+                                api_version=main.openai_config.api_version or "2024-02-15-preview",
+                                max_retries=0))
+    results = {}
+    main.tracer.reset()
+    rule_tables = lambda labels: {main.rules[name]['default_table'] for name in labels}
+
+    main.query_cache.clear()
+    main.semantic_cache.clear()
+    rule_names = {id(rule): name for name, rule in main.rules.items()}
+    results['match_query_to_rule'] = replay(
+        fake, corpus, lambda q: rule_names.get(id(main.match_query_to_rule(q))),
+        lambda labels: labels, args.concurrency, 1)
+    results['get_appropriate_data_source'] = replay(
+        fake, corpus, main.get_appropriate_data_source, rule_tables,
+        args.concurrency, args.passes, _memory_cache_stats(main.query_cache))
+    # Explained match streamed token by token; time to first token is the
+    # llm.call ttft mark in the stage histograms
+    results['stream_rule_explanation'] = replay(
+        fake, corpus, lambda q: rule_names.get(id(main.match_query_to_rule(q, explain=True, on_token=lambda text: None))),
+        lambda labels: labels, args.concurrency, 1)
+
+    # Same replay with the rules' example queries compiled into an answer index
+    from answer_index import AnswerIndex, collect_answers, write_index
+
+    main.query_cache.clear()
+    main.semantic_cache.clear()
+    with tempfile.TemporaryDirectory() as directory:
+        index_path = os.path.join(directory, "routing_index.bin")
+        write_index(collect_answers(main.rules), index_path, rules_fingerprint=main.routing.fingerprint)
+        default_index, main.answer_index = main.answer_index, AnswerIndex(index_path)
+        try:
+            results['answer_index'] = replay(
+                fake, corpus, main.get_appropriate_data_source, rule_tables,
+                args.concurrency, args.passes, _memory_cache_stats(main.query_cache))
+        finally:
+            main.answer_index = default_index
+
+    main.query_cache.clear()
+    main.semantic_cache.clear()
+    batch_queries = [query for query, _ in corpus]
+    before = fake.snapshot()
+    start = time.perf_counter()
+    answers = main.get_appropriate_data_sources(batch_queries)
+    wall = time.perf_counter() - start
+    after = fake.snapshot()
+    agreed = sum(answer in rule_tables(labels) for answer, (_, labels) in zip(answers, corpus))
+    results['get_appropriate_data_sources'] = {
+        'queries': len(batch_queries),
+        'wall_ms': round(wall * 1000.0, 3),
+        'throughput_qps': round(len(batch_queries) / wall, 2) if wall else None,
+        'llm_calls': after['requests'] - before['requests'],
+        'tokens': {'prompt': after['prompt_tokens'] - before['prompt_tokens'],
+                   'completion': after['completion_tokens'] - before['completion_tokens']},
+        'label_agreement': round(agreed / len(batch_queries), 4),
+    }
+    # Top-k ranking from one call; agreement counts the best-ranked source
+    main.query_cache.clear()
+    main.semantic_cache.clear()
+    results['get_ranked_data_sources'] = replay(
+        fake, corpus, lambda q: next(iter(main.get_ranked_data_sources(q)), (None, 0.0))[0], rule_tables,
+        args.concurrency, args.passes, _memory_cache_stats(main.query_cache))
+
+    # Concurrent vote of keyword router, both agent personas and the source selector
+    from ensemble import EnsembleRouter
+
+    main.query_cache.clear()
+    main.semantic_cache.clear()
+    ensemble = EnsembleRouter()
+    results['ensemble'] = replay(
+        fake, corpus, ensemble.get_appropriate_data_source, rule_tables, args.concurrency, 1)
+    results['ensemble']['decisions'] = main.tracer.counters().get('ensemble.decision', {})
+
+    # Per-stage latency and token totals across all router runs above
+    results['stages'] = {'histograms': main.tracer.histograms(), 'counters': main.tracer.counters()}
+    # Retries, failures and breaker state of the LLM guard
+    results['llm_guard'] = main.llm_guard.stats()
+    return results
+
+
+def _point_at(config, base_url: str):
+    """Aim an OpenAIConfig at the fake endpoint before its client is first created"""
+    config.endpoint = base_url
+    config.subscription_key = "fake"
+    config.api_version = config.api_version or "2024-02-15-preview"
+    config.deployment = config.deployment or "fake"
+
+
+def _load_tool(package: str, base_url: str):
+    """SourceSelectorTool of one ``src`` directory; both packages are named crewai_test"""
+    for name in [name for name in sys.modules if name == "crewai_test" or name.startswith("crewai_test.")]:
+        del sys.modules[name]
+    # Configs that read their settings from the environment pick the fake up on import
+    os.environ.update(AZURE_API_BASE=base_url, AZURE_API_KEY="fake",
+                      AZURE_API_VERSION=os.getenv("AZURE_API_VERSION", "2024-02-15-preview"),
+                      AZURE_API_MODEL=os.getenv("AZURE_API_MODEL", "fake"))
+    sys.path.insert(0, os.path.join(ROOT, package))
+    try:
+        tool_module = importlib.import_module("crewai_test.tools.source_selector_tool")
+    finally:
+        sys.path.remove(os.path.join(ROOT, package))
+    _point_at(tool_module.openai_config, base_url)
+    return tool_module.SourceSelectorTool()
+
+
+def bench_selectors(base_url: str, fake: FakeAzure, corpus, args) -> Dict:
+    results = {}
+    import main
+
+    sources = rule_sources(main.rules)
+    expected = lambda labels: {sources[name] for name in labels}
+
+    import azureAIsystem
+    _point_at(azureAIsystem.openai_config, base_url)
+    selector = azureAIsystem.AgricultureSourceSelector()
+    results['AgricultureSourceSelector.recommend_source'] = replay(
+        fake, corpus, lambda q: selector.recommend_source(q)['name'], expected, args.concurrency, 1)
+
+    for package in args.tool_package or DEFAULT_TOOL_PACKAGES:
+        target = f"SourceSelectorTool._run[{package.split(os.sep)[0]}]"
+        try:
+            tool = _load_tool(package, base_url)
+        except Exception as e:
+            # A package whose config or dependencies (crewai, langchain) are missing here
+            results[target] = f"skipped: {type(e).__name__}: {e}"
+            continue
+        results[target] = replay(fake, corpus, lambda q: tool._run(q)['name'], expected, args.concurrency, 1)
+    return results
+
+
+def run(args) -> Dict:
+    import main
+
+    corpus = build_corpus(main.rules)
+    sources = rule_sources(main.rules)
+    labels = {
+        'rule': {query: sorted(names)[0] for query, names in corpus},
+        'source': {query: sources[sorted(names)[0]] for query, names in corpus},
+    }
+    fake = FakeAzure(labels, args.latency_ms, args.jitter_ms, args.error_rate, args.seed,
+                     failure_rate=args.failure_rate)
+    server = start_server(fake)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        report = {
+            'config': {
+                'corpus_size': len(corpus),
+                'latency_ms': args.latency_ms,
+                'jitter_ms': args.jitter_ms,
+                'error_rate': args.error_rate,
+                'failure_rate': args.failure_rate,
+                'concurrency': args.concurrency,
+                'passes': args.passes,
+            },
+            'results': {},
+        }
+        report['results'].update(bench_router(base_url, fake, corpus, args))
+        if not args.router_only:
+            report['results'].update(bench_selectors(base_url, fake, corpus, args))
+    finally:
+        server.shutdown()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline routing benchmark against a fake Azure endpoint")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="injected LLM latency")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of deliberately wrong LLM answers")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of LLM requests failing with 429/503")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--passes", type=int, default=2, help="replays of the corpus through the cached path")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tool-package", action="append",
+                        help="src directory whose crewai_test.tools.SourceSelectorTool is benchmarked; "
+                             "repeatable, both packages by default")
+    parser.add_argument("--router-only", action="store_true")
+    parser.add_argument("--out", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
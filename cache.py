@@ -0,0 +1,441 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, Any, Optional, Tuple
+
+if TYPE_CHECKING:
+    import sqlite3
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Fold Turkish dotted/dotless i variants onto plain 'i' before case folding
+_TURKISH_I_FOLD = str.maketrans({'İ': 'i', 'I': 'i', 'ı': 'i'})
+
+
+def normalize_query(query: str) -> str:
+    """Cache key for a query: NFKC, Turkish i folding, case folding, single spaces"""
+    text = unicodedata.normalize('NFKC', query).translate(_TURKISH_I_FOLD).casefold()
+    text = text.replace('i̇', 'i')
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def _entry_size(key: str, value: Any) -> int:
+    # Approximate footprint; exact accounting is not worth the cost here
+    return len(key.encode('utf-8')) + len(repr(value))
+
+
+class _Stripe:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.bytes = 0
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def remove(self, key: str):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+
+class QueryCache:
+    """Bounded, thread-safe LRU cache with a per-entry TTL.
+
+    Keys are normalized with ``normalize_query`` and spread over independently
+    locked stripes, so concurrent workers rarely contend. Entry and byte caps
+    are split evenly between stripes. Expired entries are dropped when read
+    and by an amortized sweep every ``sweep_every`` writes to a stripe.
+
+    With ``stale_minutes`` set, expired entries are kept that much longer so
+    ``get_stale`` can serve them while a refresh runs.
+    """
+
+    def __init__(self, expiry_minutes: int = 60, max_entries: int = 10000,
+                 max_bytes: int = 16 * 1024 * 1024, stripes: int = 8, sweep_every: int = 256,
+                 stale_minutes: int = 0):
+        self.expiry = expiry_minutes
+        self.stale = stale_minutes
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_every = sweep_every
+        self._stripes = [_Stripe() for _ in range(stripes)]
+        self._stripe_entries = max(1, -(-max_entries // stripes))
+        self._stripe_bytes = max(1, -(-max_bytes // stripes))
+
+    def _stripe(self, key: str) -> _Stripe:
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.get_stale(key)
+        if entry is None or not entry[1]:
+            return None
+        return entry[0]
+
+    def get_stale(self, key: str) -> Optional[Tuple[Dict[str, Any], bool]]:
+        """(value, is_fresh) for entries within TTL plus the stale window"""
+        key = normalize_query(key)
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.get(key)
+            if entry is None:
+                stripe.misses += 1
+                return None
+            value, expires_at, _ = entry
+            now = time.monotonic()
+            if now >= expires_at + self.stale * 60:
+                stripe.remove(key)
+                stripe.expirations += 1
+                stripe.misses += 1
+                return None
+            stripe.entries.move_to_end(key)
+            if now >= expires_at:
+                stripe.misses += 1
+                return value, False
+            stripe.hits += 1
+            return value, True
+
+    def set(self, key: str, value: Dict[str, Any], ttl_seconds: Optional[float] = None):
+        key = normalize_query(key)
+        size = _entry_size(key, value)
+        ttl = self.expiry * 60 if ttl_seconds is None else ttl_seconds
+        stripe = self._stripe(key)
+        with stripe.lock:
+            if key in stripe.entries:
+                stripe.remove(key)
+            stripe.entries[key] = (value, time.monotonic() + ttl, size)
+            stripe.bytes += size
+            stripe.writes += 1
+            if stripe.writes % self.sweep_every == 0:
+                self._sweep(stripe, self.stale * 60)
+            while stripe.entries and (len(stripe.entries) > self._stripe_entries
+                                      or stripe.bytes > self._stripe_bytes):
+                oldest = next(iter(stripe.entries))
+                stripe.remove(oldest)
+                stripe.evictions += 1
+
+    def delete(self, key: str):
+        key = normalize_query(key)
+        stripe = self._stripe(key)
+        with stripe.lock:
+            if key in stripe.entries:
+                stripe.remove(key)
+
+    def clear(self):
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+                stripe.bytes = 0
+
+    def invalidate(self, predicate: Callable[[str, Dict[str, Any]], bool]) -> int:
+        """Drop the entries whose (normalized key, value) match ``predicate``; returns how many"""
+        removed = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                doomed = [key for key, (value, _, _) in stripe.entries.items() if predicate(key, value)]
+                for key in doomed:
+                    stripe.remove(key)
+            removed += len(doomed)
+        return removed
+
+    @staticmethod
+    def _sweep(stripe: _Stripe, grace: float = 0.0):
+        now = time.monotonic() - grace
+        expired = [key for key, (_, expires_at, _) in stripe.entries.items() if now >= expires_at]
+        for key in expired:
+            stripe.remove(key)
+        stripe.expirations += len(expired)
+
+    def sweep(self):
+        """Drop every expired entry now"""
+        for stripe in self._stripes:
+            with stripe.lock:
+                self._sweep(stripe, self.stale * 60)
+
+    def __len__(self) -> int:
+        return sum(len(stripe.entries) for stripe in self._stripes)
+
+    def stats(self) -> Dict[str, int]:
+        totals = {'entries': 0, 'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        for stripe in self._stripes:
+            with stripe.lock:
+                totals['entries'] += len(stripe.entries)
+                totals['bytes'] += stripe.bytes
+                totals['hits'] += stripe.hits
+                totals['misses'] += stripe.misses
+                totals['evictions'] += stripe.evictions
+                totals['expirations'] += stripe.expirations
+        return totals
+
+
+class SQLiteQueryCache:
+    """Persistent ``QueryCache`` backend shared by processes on one host.
+
+    The database runs in WAL mode so any number of worker processes can read
+    while one writes. Expiry is stored as wall-clock time and checked on read;
+    expired rows are physically removed by ``compact``, which also runs every
+    ``compact_every`` writes. Read counts are kept in memory and flushed during
+    compaction so that ``warm_start`` can preload the hottest keys.
+    """
+
+    def __init__(self, path: str, expiry_minutes: int = 60, compact_every: int = 1000,
+                 stale_minutes: int = 0):
+        self.path = path
+        self.expiry = expiry_minutes
+        self.stale = stale_minutes
+        self.compact_every = compact_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending_hits: Dict[str, int] = {}
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS query_cache_hits ON query_cache (hits)")
+
+    def _connect(self) -> "sqlite3.Connection":
+        # sqlite3 connections must not cross threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Imported here so processes without a persistent cache never load it
+            import sqlite3
+
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.get_stale(key)
+        if entry is None or not entry[1]:
+            return None
+        return entry[0]
+
+    def get_stale(self, key: str) -> Optional[Tuple[Dict[str, Any], bool]]:
+        entry = self.get_entry(key)
+        return None if entry is None else entry[:2]
+
+    def get_entry(self, key: str) -> Optional[Tuple[Dict[str, Any], bool, float]]:
+        """(value, is_fresh, expires_at) like ``get_stale``, with the row's wall-clock expiry"""
+        key = normalize_query(key)
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM query_cache WHERE key = ?", (key,)
+        ).fetchone()
+        now = time.time()
+        with self._lock:
+            if row is None or row[1] + self.stale * 60 <= now:
+                self.misses += 1
+                return None
+            fresh = row[1] > now
+            if fresh:
+                self.hits += 1
+                self._pending_hits[key] = self._pending_hits.get(key, 0) + 1
+            else:
+                self.misses += 1
+        return json.loads(row[0]), fresh, row[1]
+
+    def set(self, key: str, value: Dict[str, Any], ttl_seconds: Optional[float] = None):
+        key = normalize_query(key)
+        ttl = self.expiry * 60 if ttl_seconds is None else ttl_seconds
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO query_cache (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl)
+            )
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.compact_every == 0
+        if due:
+            self.compact()
+
+    def delete(self, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM query_cache WHERE key = ?", (normalize_query(key),))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM query_cache")
+
+    def invalidate(self, predicate: Callable[[str, Dict[str, Any]], bool]) -> int:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT key, value FROM query_cache").fetchall()
+            doomed = [(key,) for key, value in rows if predicate(key, json.loads(value))]
+            conn.executemany("DELETE FROM query_cache WHERE key = ?", doomed)
+        return len(doomed)
+
+    def compact(self, vacuum: bool = False):
+        """Flush read counts and delete expired rows"""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "UPDATE query_cache SET hits = hits + ? WHERE key = ?",
+                [(count, key) for key, count in pending.items()]
+            )
+            conn.execute("DELETE FROM query_cache WHERE expires_at <= ?", (time.time() - self.stale * 60,))
+        if vacuum:
+            conn.execute("VACUUM")
+
+    def warm_start(self, target: "QueryCache", limit: int = 1000) -> int:
+        """Copy the hottest unexpired entries into ``target``, keeping their remaining TTL"""
+        self.compact()
+        now = time.time()
+        rows = self._connect().execute(
+            "SELECT key, value, expires_at FROM query_cache WHERE expires_at > ? "
+            "ORDER BY hits DESC LIMIT ?", (now, limit)
+        ).fetchall()
+        for key, value, expires_at in rows:
+            target.set(key, json.loads(value), ttl_seconds=expires_at - now)
+        return len(rows)
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM query_cache").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self), 'hits': self.hits, 'misses': self.misses}
+
+
+class LayeredCache:
+    """In-memory cache in front of a shared persistent one.
+
+    Reads fall through to ``back`` and backfill ``front`` for the entry's
+    remaining TTL, so a backfilled copy never outlives the persistent one;
+    writes go to both.
+    """
+
+    def __init__(self, front: QueryCache, back: SQLiteQueryCache):
+        self.front = front
+        self.back = back
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.front.get(key)
+        if value is None:
+            entry = self.back.get_entry(key)
+            if entry is None or not entry[1]:
+                return None
+            value = entry[0]
+            self._backfill(key, value, entry[2])
+        return value
+
+    def get_stale(self, key: str) -> Optional[Tuple[Dict[str, Any], bool]]:
+        entry = self.front.get_stale(key)
+        if entry is not None and entry[1]:
+            return entry
+        backing = self.back.get_entry(key)
+        if backing is not None and backing[1]:
+            self._backfill(key, backing[0], backing[2])
+            return backing[:2]
+        return entry or (backing[:2] if backing else None)
+
+    def _backfill(self, key: str, value: Dict[str, Any], expires_at: float):
+        ttl = expires_at - time.time()
+        if ttl > 0:
+            self.front.set(key, value, ttl_seconds=ttl)
+
+    def set(self, key: str, value: Dict[str, Any], ttl_seconds: Optional[float] = None):
+        self.front.set(key, value, ttl_seconds)
+        self.back.set(key, value, ttl_seconds)
+
+    def delete(self, key: str):
+        self.front.delete(key)
+        self.back.delete(key)
+
+    def clear(self):
+        self.front.clear()
+        self.back.clear()
+
+    def invalidate(self, predicate: Callable[[str, Dict[str, Any]], bool]) -> int:
+        # The memory layer only holds a subset of the persistent one
+        self.front.invalidate(predicate)
+        return self.back.invalidate(predicate)
+
+    def warm_start(self, limit: int = 1000) -> int:
+        return self.back.warm_start(self.front, limit)
+
+    def __len__(self) -> int:
+        return len(self.back)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'memory': self.front.stats(), 'persistent': self.back.stats()}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one execution.
+
+    The first caller runs the function; callers arriving while it runs
+    block until it finishes and receive the same result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.shared = 0
+
+    def do(self, key: str, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._calls
+
+    def do_in_background(self, key: str, func: Callable[[], Any]) -> bool:
+        """Start ``func`` on a daemon thread unless ``key`` is already in flight"""
+        if self.in_flight(key):
+            return False
+
+        def run():
+            try:
+                self.do(key, func)
+            except Exception as e:
+                # The stale value stays in place until the next attempt
+                logging.getLogger(__name__).warning(f"Background refresh failed for {key!r}: {str(e)}")
+
+        threading.Thread(target=run, name=f"refresh:{key[:32]}", daemon=True).start()
+        return True
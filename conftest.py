@@ -0,0 +1 @@
+# Makes the repository-root modules importable when the suite runs as plain ``pytest``
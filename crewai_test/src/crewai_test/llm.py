@@ -0,0 +1,56 @@
+import os
+
+from routing_common.rate_limit import shared_limiter
+from routing_common.resilience import CircuitBreaker, Resilient, RetryPolicy
+from routing_common.tracing import tracer
+
+from .config.config import openai_config
+
+# Kaynak seçici ve analiz LLM çağrılarının ortak koruması. Ayarlar CREW_LLM_* ortam
+# değişkenlerinden okunur. Hız sınırı Azure'daki gibi dağıtım başınadır: aynı dağıtımı
+# kullanan yönlendiriciyle tek kova paylaşılır; kota CREW_LLM_RPM / CREW_LLM_TPM,
+# yoksa ROUTING_LLM_RPM / ROUTING_LLM_TPM ile verilir.
+llm_guard = Resilient(
+    "crew",
+    timeout=float(os.getenv("CREW_LLM_TIMEOUT", "30")),
+    policy=RetryPolicy(max_attempts=int(os.getenv("CREW_LLM_MAX_ATTEMPTS", "3"))),
+    breaker=CircuitBreaker(
+        error_rate=float(os.getenv("CREW_BREAKER_ERROR_RATE", "0.5")),
+        min_calls=int(os.getenv("CREW_BREAKER_MIN_CALLS", "10")),
+        open_seconds=float(os.getenv("CREW_BREAKER_OPEN_SECONDS", "30")),
+    ),
+    on_event=lambda name, event: tracer.count(f"{name}.{event}"),
+    limiter=shared_limiter(openai_config.deployment, "CREW"),
+)
+# Yönlendiricinin router.* ölçümleriyle karışmasın diye crew.* adlarıyla
+tracer.gauge("crew.breaker_state", llm_guard.state_value)
+if llm_guard.limiter is not None:
+    tracer.gauge("crew.rate_limit_queue", llm_guard.limiter.queue_depth)
+
+
+def _client_settings() -> dict:
+    return dict(
+        azure_endpoint=openai_config.endpoint,
+        api_key=openai_config.subscription_key,
+        api_version=openai_config.api_version,
+        # Yeniden denemeleri llm_guard yapar
+        max_retries=0
+    )
+
+
+_client = None
+
+
+def get_client():
+    """Paylaşılan AzureOpenAI istemcisi; ilk LLM çağrısında oluşturulur"""
+    global _client
+    if _client is None:
+        from openai import AzureOpenAI
+        _client = AzureOpenAI(**_client_settings())
+    return _client
+
+
+def new_async_client():
+    """Yeni bir AsyncAzureOpenAI istemcisi; asenkron istemciler olay döngüsüne bağlı olduğundan döngü başına bir tane"""
+    from openai import AsyncAzureOpenAI
+    return AsyncAzureOpenAI(**_client_settings())
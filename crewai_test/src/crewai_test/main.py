@@ -1,12 +1,35 @@
 #!/usr/bin/env python
 import sys
 import warnings
+from typing import Any, Dict
 from crewai_test.crew import CrewaiTest
 
 warnings.filterwarnings("ignore", category=SyntaxWarning, module="pysbd")
 
+def print_stream(crew: CrewaiTest, inputs: Dict[str, Any]) -> Any:
+    """LLM metin parçalarını geldikçe yazdır; parça gelmeyen task'ların çıktısı task bitince yazılır"""
+    streamed = False
+    for kind, value in crew.stream(inputs):
+        if kind == 'token':
+            print(value, end="", flush=True)
+            streamed = True
+        elif kind == 'task':
+            if not streamed:
+                print(value.raw)
+            print(f"\n[{value.agent}] tamamlandı")
+            print("-" * 50, flush=True)
+            streamed = False
+        elif kind == 'result':
+            return value
+
 def main():
-    crew = CrewaiTest()
+    # Servis modları: "batch" (stdin JSONL) ve "serve" (HTTP/JSON)
+    if len(sys.argv) > 1 and sys.argv[1] in ("batch", "serve"):
+        from crewai_test.server import main as serve_main
+        serve_main(sys.argv[1:])
+        return
+
+    crew = CrewaiTest(stream=True)
     print("Tarım Veri Analizi Sistemi")
     print("=" * 50)
     print("Bu sistem, tarım verilerini analiz etmek için üç uzman agent kullanmaktadır:")
@@ -30,12 +53,10 @@ def main():
                 'query': query,
                 'analysis_depth': analysis_depth
             }
-            result = crew.crew().kickoff(inputs=inputs)
+            print_stream(crew, inputs)
 
             print("\nAnaliz tamamlandı!")
             print("=" * 50)
-            print("Sonuçlar:")
-            print(result)
 
         except Exception as e:
             print(f"\nHata oluştu: {str(e)}")
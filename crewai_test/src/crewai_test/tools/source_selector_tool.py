@@ -1,7 +1,84 @@
+import asyncio
+import logging
+import weakref
 from langchain.tools import BaseTool
-from typing import Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 from ..config.config import openai_config
-import openai
+from routing_common.source_registry import get_registry
+from routing_common.tracing import tracer
+from ..llm import get_client, llm_guard, new_async_client
+from routing_common.resilience import is_unavailable
+
+@lru_cache(maxsize=8)
+def build_sources_prompt_prefix(sources: Tuple[Tuple[str, str], ...]) -> str:
+    # Kaynak listesi değişmedikçe aynı önek döner
+    return (
+        "Aşağıdaki veri kaynakları listesinden, verilen sorgu için en uygun olanı seçin:\n"
+        + "\n".join([f"{name}: {description}" for name, description in sources])
+    )
+
+
+# Asenkron çağrılar için olay döngüsü başına tek istemci, eşzamanlılık sınırı
+# ve aynı sorgular için paylaşılan bekleyen istekler
+ASYNC_MAX_IN_FLIGHT = 16
+
+class _AsyncState:
+    def __init__(self):
+        self.client = new_async_client()
+        self.semaphore = asyncio.Semaphore(ASYNC_MAX_IN_FLIGHT)
+        self.in_flight: Dict[str, asyncio.Future] = {}
+
+_async_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncState]" = weakref.WeakKeyDictionary()
+
+def _async_state() -> _AsyncState:
+    loop = asyncio.get_running_loop()
+    state = _async_states.get(loop)
+    if state is None:
+        state = _async_states[loop] = _AsyncState()
+    return state
+
+def _request(prompt: str) -> Dict[str, Any]:
+    return {'model': openai_config.deployment, 'messages': [{"role": "system", "content": prompt}], 'temperature': 0}
+
+def _content(span, response) -> str:
+    """Yanıt metni; token kullanımı span'e yazılır. Senkron ve asenkron yol aynı ayrıştırmayı kullanır"""
+    if response.usage is not None:
+        span.set(prompt_tokens=response.usage.prompt_tokens, completion_tokens=response.usage.completion_tokens)
+    return response.choices[0].message.content or ""
+
+def _query_key(query: str) -> str:
+    return " ".join(query.lower().split())
+
+def _complete(prompt: str) -> str:
+    with tracer.span("llm.call", tool="source_selector") as span:
+        return _content(span, llm_guard.call(get_client().chat.completions.create, **_request(prompt)))
+
+async def _complete_async(prompt: str) -> str:
+    state = _async_state()
+    with tracer.span("llm.call", tool="source_selector") as span:
+        # Semafor yalnızca deneme süresince tutulur, yeniden deneme beklemesinde bırakılır
+        async def create(**request):
+            async with state.semaphore:
+                span.mark("queue")
+                return await state.client.chat.completions.create(**request)
+
+        return _content(span, await llm_guard.acall(create, **_request(prompt)))
+
+
+def fallback_source(query: str, error: Exception) -> Dict[str, Any]:
+    """
+    LLM'e ulaşılamadığında kaynağı sorgu kelimelerinden tahmin et; tahmin yoksa hatayı yükselt.
+    Hatalı istek ya da kod hatası gibi servisle ilgisiz hatalar tahminle örtülmez, aynen yükseltilir.
+    """
+    if not is_unavailable(error):
+        raise error
+    source = get_registry().guess(query)
+    tracer.count("tool.source_selector.fallback", "hit" if source else "miss")
+    if source is None:
+        raise error
+    logging.getLogger(__name__).warning(f"LLM'e ulaşılamadı, yerel tahmin kullanılıyor: {source['name']}")
+    return source
 
 class SourceSelectorTool(BaseTool):
     name = "Tarım Veri Kaynağı Seçici"
@@ -9,43 +86,55 @@ class SourceSelectorTool(BaseTool):
 
     def __init__(self):
         super().__init__()
-        self.sources = [
-            {"name": "Eurostat International Trade in Goods",
-             "url": "https://ec.europa.eu/eurostat/web/international-trade-in-goods",
-             "description": "AB için uluslararası mal ticareti istatistiksel verileri."},
-            {"name": "Fastmarkets",
-             "url": "https://www.fastmarkets.com/",
-             "description": "Küresel emtia fiyatları ve trendleri hakkında pazar istihbaratı."},
-            {"name": "USDA Foreign Agricultural Service",
-             "url": "https://www.fas.usda.gov/",
-             "description": "ABD tarımı için uluslararası ticaret politikası ve ihracat desteği."},
-            {"name": "Trade Data Monitor", "url": "https://tradedatamonitor.com/",
-             "description": "Aggregates trade data from multiple countries to monitor global trade flows."},
-            {"name": "USDA ESRQuery", "url": "https://apps.fas.usda.gov/esrquery/ESRHome.aspx",
-             "description": "Delivers export sales reporting data from the USDA."},
-            {"name": "USDA National Agricultural Statistics Service", "url": "https://www.nass.usda.gov/",
-             "description": "Provides comprehensive agricultural statistics for the U.S."}
-        ]
+        # Kaynaklar routing_common paketindeki sources.yaml'dan (veya SOURCE_REGISTRY_PATH) gelir
+        self.sources = get_registry().sources
 
-    def _run(self, query: str) -> dict:
-        prompt = (
-            "Aşağıdaki veri kaynakları listesinden, verilen sorgu için en uygun olanı seçin:\n"
-            + "\n".join([f"{s['name']}: {s['description']}" for s in self.sources])
+    def _build_prompt(self, query: str, k: int = 1) -> str:
+        if k > 1:
+            instruction = (f"En alakalı {k} veri kaynağını, en alakalıdan başlayarak her satıra bir tane "
+                           "olacak şekilde yalnızca ad ve URL ile yanıtlayın.")
+        else:
+            instruction = "Hangi veri kaynağı en alakalı? Sadece kaynak adı ve URL'sini yanıtlayın."
+        return (
+            build_sources_prompt_prefix(get_registry().prompt_entries)
             + f"\n\nKullanıcı sorgusu: {query}\n"
-            + "Hangi veri kaynağı en alakalı? Sadece kaynak adı ve URL'sini yanıtlayın."
+            + instruction
         )
 
-        response = openai.ChatCompletion.create(
-            engine=openai_config.deployment,
-            messages=[{"role": "system", "content": prompt}],
-            temperature=0
-        )
+    def _match_source(self, result: str) -> dict:
+        return get_registry().match(result) or {"name": "Bulunamadı", "url": "Eşleşen kaynak bulunamadı"}
+
+    def _run(self, query: str) -> dict:
+        with tracer.span("tool.source_selector"):
+            try:
+                result = _complete(self._build_prompt(query))
+            except Exception as e:
+                return fallback_source(query, e)
+            return self._match_source(result)
 
-        result = response.choices[0].message['content']
-        for source in self.sources:
-            if source['name'] in result:
-                return source
-        return {"name": "Bulunamadı", "url": "Eşleşen kaynak bulunamadı"}
+    def select_sources(self, query: str, k: int) -> List[Dict[str, Any]]:
+        """
+        Sorgu için en alakalı en fazla ``k`` kaynak, en alakalıdan başlayarak.
+        LLM'e ulaşılamazsa tek bir yerel tahmin döner.
+        """
+        with tracer.span("tool.source_selector", k=k):
+            try:
+                result = _complete(self._build_prompt(query, k))
+            except Exception as e:
+                return [fallback_source(query, e)]
+            return get_registry().match_all(result, k) or [self._match_source(result)]
 
-    def _arun(self, query: str) -> dict:
-        raise NotImplementedError("Bu araç asenkron çalışmayı desteklemiyor") 
\ No newline at end of file
+    async def _arun(self, query: str) -> dict:
+        # Aynı anda gelen aynı sorgular tek bir isteği bekler
+        state = _async_state()
+        key = _query_key(query)
+        future = state.in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(_complete_async(self._build_prompt(query)))
+            state.in_flight[key] = future
+            future.add_done_callback(lambda _: state.in_flight.pop(key, None))
+        try:
+            result = await asyncio.shield(future)
+        except Exception as e:
+            return fallback_source(query, e)
+        return self._match_source(result) 
\ No newline at end of file
@@ -0,0 +1,197 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import main
+from azureAIsystem import build_recommendation_prompt
+from routing_common.source_registry import get_registry
+from routing_common.tracing import tracer
+
+# A voter returns (rule name or None, confidence in [0, 1])
+VoteFunc = Callable[[str], Tuple[Optional[str], float]]
+
+
+@dataclass
+class Voter:
+    name: str
+    func: VoteFunc
+    weight: float = 1.0
+
+
+@dataclass
+class Vote:
+    voter: str
+    rule: Optional[str]
+    weight: float
+    latency_ms: float
+    error: Optional[str] = None
+
+
+@dataclass
+class EnsembleResult:
+    rule: Optional[str]
+    tally: Dict[str, float]
+    votes: List[Vote] = field(default_factory=list)
+    quorum_reached: bool = False
+
+    @property
+    def rule_details(self) -> Dict:
+        # Looked up in the current rules: a reload during the vote may have removed the rule
+        return (main.routing.rules.get(self.rule) if self.rule else None) or {"default_table": "Unknown Source"}
+
+
+def persona_voter(persona_name: str) -> VoteFunc:
+    """LLM vote through select_rule with one of the agent personas as the system message"""
+    persona = main.AGENT_PERSONAS[persona_name]
+
+    def vote(query: str) -> Tuple[Optional[str], float]:
+        request = main.build_rule_request(query, persona=persona)
+        with tracer.span("llm.call", voter=persona_name) as span:
+            completion = main.llm_guard.call(main.get_client().chat.completions.create, **request)
+            main.record_usage(span, completion)
+        return main.parse_rule_selection(completion)
+
+    return vote
+
+
+def keyword_vote(query: str) -> Tuple[Optional[str], float]:
+    """Local vote; confidence is the top rule's share of all keyword scores"""
+    ranked = main.routing.keyword_router.score(query)
+    if not ranked:
+        return None, 0.0
+    return ranked[0][0], ranked[0][1] / sum(score for _, score in ranked)
+
+
+def source_selector_vote(query: str) -> Tuple[Optional[str], float]:
+    """LLM picks a data source from the registry; the vote goes to the rule served by that source"""
+    registry = get_registry()
+    prompt = build_recommendation_prompt(registry, query)
+    with tracer.span("llm.call", voter="source_selector") as span:
+        completion = main.llm_guard.call(
+            main.get_client().chat.completions.create,
+            model=main.openai_config.deployment,
+            messages=[{"role": "system", "content": prompt}],
+            max_tokens=60,
+            temperature=0,
+        )
+        main.record_usage(span, completion)
+    source = registry.match(completion.choices[0].message.content or "")
+    if source is None:
+        return None, 0.0
+    for rule_name, rule in main.routing.rules.items():
+        table_source = registry.get(rule['default_table'])
+        if table_source is not None and table_source['name'] == source['name']:
+            return rule_name, 1.0
+    return None, 0.0
+
+
+def default_voters() -> List[Voter]:
+    return [
+        Voter('keyword_router', keyword_vote),
+        Voter('data_source_expert', persona_voter('data_source_expert')),
+        Voter('rule_analyst', persona_voter('rule_analyst')),
+        Voter('source_selector', source_selector_vote),
+    ]
+
+
+class EnsembleRouter:
+    """Routes hard queries by a concurrent weighted vote of independent classifiers.
+
+    The default voters are the local keyword router, the two agent personas
+    of ``main.AGENT_PERSONAS`` as separate LLM calls, and the source
+    selector. A vote counts the voter's weight times its confidence.
+    ``quorum`` is the share of the total voter weight a rule needs; the vote
+    stops as soon as one rule holds it. If no rule gets there before all
+    voters finish (or ``timeout`` seconds pass) the rule with the most weight
+    wins. Voter failures count as abstentions. Since the vote returns on
+    quorum, latency follows the fastest agreeing voters; slower ones finish
+    in the background and are ignored. With the four default voters
+    of weight 1 the default quorum of 0.4 takes two confident agreeing votes,
+    so no single voter decides alone.
+    """
+
+    def __init__(self, voters: Optional[List[Voter]] = None, quorum: float = 0.4,
+                 timeout: Optional[float] = None, max_workers: int = 16):
+        self.voters = voters if voters is not None else default_voters()
+        self.quorum = quorum
+        self.timeout = timeout
+        self._max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # Shared and never shut down per call: voters still running after an early
+        # return must not hold up the caller
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="ensemble")
+            return self._pool
+
+    @staticmethod
+    def _cast(voter: Voter, query: str) -> Vote:
+        start = time.perf_counter()
+        try:
+            rule, confidence = voter.func(query)
+            error = None
+        except Exception as e:
+            rule, confidence, error = None, 0.0, f"{type(e).__name__}: {e}"
+            logging.getLogger(__name__).warning(f"Voter {voter.name} failed: {error}")
+        weight = voter.weight * max(0.0, min(1.0, confidence)) if rule else 0.0
+        return Vote(voter.name, rule, weight, (time.perf_counter() - start) * 1000.0, error)
+
+    def vote(self, query: str) -> EnsembleResult:
+        if not query.strip():
+            raise main.QueryMatchError("Query cannot be empty")
+
+        needed = self.quorum * sum(voter.weight for voter in self.voters)
+        tally: Dict[str, float] = {}
+        votes: List[Vote] = []
+        with tracer.span("ensemble", voters=len(self.voters)) as span:
+            pool = self._executor()
+            # Each voter runs in the caller's context: trace parent and rate-limit priority carry over
+            pending = {pool.submit(contextvars.copy_context().run, self._cast, voter, query)
+                       for voter in self.voters}
+            deadline = None if self.timeout is None else time.monotonic() + self.timeout
+            winner = None
+            while pending and winner is None:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    vote = future.result()
+                    votes.append(vote)
+                    if vote.rule:
+                        tally[vote.rule] = tally.get(vote.rule, 0.0) + vote.weight
+                        if tally[vote.rule] >= needed and winner is None:
+                            winner = vote.rule
+            quorum_reached = winner is not None
+            if winner is None and tally:
+                winner = max(tally, key=tally.__getitem__)
+            span.set(rule=winner, quorum=quorum_reached, voted=len(votes))
+        tracer.count("ensemble.decision", "quorum" if quorum_reached else ("plurality" if winner else "none"))
+        return EnsembleResult(winner, tally, votes, quorum_reached)
+
+    def route(self, query: str) -> Dict:
+        """Rule details for a query; cached like the single-call router"""
+        cached = main.lookup_cached_rule(query)
+        if cached:
+            return cached
+        result = self.vote(query)
+        if result.rule:
+            main.cache_rule(query, result.rule_details)
+        return result.rule_details
+
+    def get_appropriate_data_source(self, query: str) -> str:
+        with tracer.span("route", mode="ensemble") as span:
+            source = self.route(query).get("default_table", "Data source not found")
+            span.set(source=source)
+        return source
+
+
+# Process-wide router with the default voters
+ensemble_router = EnsembleRouter()
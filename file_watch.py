@@ -0,0 +1,69 @@
+import logging
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def _signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class FileWatcher:
+    """Polls files for changes on a daemon thread.
+
+    A file counts as changed when its inode, mtime or size differs from the
+    last check, which covers both in-place edits and editors or deploy
+    tools that replace the file. Callbacks run on the watcher thread; one
+    that raises is logged and called again on the next change. Polling keeps
+    it dependency-free; a config file is cheap to stat every few seconds.
+    """
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self._watches: Dict[str, Tuple[Callable[[str], None], Optional[Tuple[int, int, int]]]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, path: str, on_change: Callable[[str], None]):
+        """Call ``on_change(path)`` whenever ``path`` changes from its current state"""
+        with self._lock:
+            self._watches[path] = (on_change, _signature(path))
+
+    def check(self) -> List[str]:
+        """One polling pass; returns the paths whose callbacks ran"""
+        with self._lock:
+            watches = list(self._watches.items())
+        changed = []
+        for path, (on_change, seen) in watches:
+            current = _signature(path)
+            if current == seen or current is None:
+                # A missing file is usually a replace in progress; keep the last state
+                continue
+            try:
+                on_change(path)
+            except Exception as e:
+                logging.getLogger(__name__).error(f"Reloading {path} failed: {type(e).__name__}: {e}")
+            with self._lock:
+                if path in self._watches:
+                    self._watches[path] = (on_change, current)
+            changed.append(path)
+        return changed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self) -> "FileWatcher":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="file-watch", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
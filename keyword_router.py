@@ -0,0 +1,99 @@
+import math
+import re
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'by', 'different', 'does', 'each',
+    'for', 'from', 'given', 'how', 'in', 'is', 'it', 'many', 'of', 'on', 'or',
+    'over', 'related', 'same', 'the', 'their', 'this', 'to', 'used', 'was',
+    'what', 'which', 'with',
+})
+
+# Curated keywords weigh more than prose descriptions and example queries
+FIELD_WEIGHTS = {
+    'keywords': 3.0,
+    'description': 1.0,
+    'example_queries': 0.5,
+}
+
+
+def stem(token: str) -> str:
+    """Very light plural stripping so 'exports' and 'export' share a posting"""
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS or token.isdigit():
+            continue
+        tokens.append(stem(token))
+    return tokens
+
+
+class KeywordRouter:
+    """TF-IDF scorer over the rules dict, compiled once into an inverted index.
+
+    A query is routed locally only when the best rule clears ``min_score`` and
+    beats the runner-up by a relative margin of at least ``min_margin``;
+    everything else is left to the LLM.
+    """
+
+    def __init__(self, rules: Dict[str, Dict[str, Any]], min_score: float = 1.0, min_margin: float = 0.5):
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.index = self._build_index(rules)
+
+    @staticmethod
+    def _build_index(rules: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+        term_freqs: Dict[str, Dict[str, float]] = {}
+        for rule_name, rule_details in rules.items():
+            tf: Dict[str, float] = defaultdict(float)
+            for field, weight in FIELD_WEIGHTS.items():
+                value = rule_details.get(field, [])
+                texts = [value] if isinstance(value, str) else value
+                for text in texts:
+                    for token in tokenize(text):
+                        tf[token] += weight
+            term_freqs[rule_name] = tf
+
+        doc_freq: Dict[str, int] = defaultdict(int)
+        for tf in term_freqs.values():
+            for token in tf:
+                doc_freq[token] += 1
+
+        # Terms that appear in every rule get idf 0 and never reach the index
+        rule_count = len(rules)
+        index: Dict[str, Dict[str, float]] = defaultdict(dict)
+        for rule_name, tf in term_freqs.items():
+            for token, freq in tf.items():
+                idf = math.log(rule_count / doc_freq[token])
+                if idf > 0:
+                    index[token][rule_name] = math.log1p(freq) * idf
+        return dict(index)
+
+    def score(self, query: str) -> List[Tuple[str, float]]:
+        """Rules with a non-zero score, best first"""
+        scores: Dict[str, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            for rule_name, weight in self.index.get(token, {}).items():
+                scores[rule_name] += weight
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+    def route(self, query: str) -> Optional[str]:
+        """Return the confidently matching rule name, or None if ambiguous"""
+        ranked = self.score(query)
+        if not ranked:
+            return None
+        best_rule, best_score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if best_score < self.min_score:
+            return None
+        if (best_score - runner_up) / best_score < self.min_margin:
+            return None
+        return best_rule
@@ -1,11 +1,22 @@
 import os
 import sys
+import json
 import logging
-from typing import List, Dict, Any
-from datetime import datetime, timedelta
-from crewai import Agent, Task, Crew, Process
-from openai import AzureOpenAI
+import math
+import threading
+import weakref
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from config import OpenAIConfig, openai_config
+from cache import QueryCache, SQLiteQueryCache, LayeredCache, SingleFlight, normalize_query
+from semantic_cache import SemanticCache
+from rule_config import RULES_PATH, RuleSet, build_rules_prompt_prefix, load_rules
+from file_watch import FileWatcher
+from answer_index import AnswerIndex, AnswerLog
+from prompts import CachedPrompt
+from routing_common.source_registry import get_registry
+from routing_common.tracing import tracer, start_metrics_server
+from routing_common.resilience import Resilient, RetryPolicy, CircuitBreaker, is_unavailable
+from routing_common.rate_limit import BATCH, BACKGROUND, priority, shared_limiter, with_priority
 
 class QueryMatchError(Exception):
     """Query matching error"""
@@ -15,126 +26,194 @@ class OpenAIConnectionError(Exception):
     """OpenAI connection error"""
     pass
 
-client = AzureOpenAI(
-    azure_endpoint=openai_config.endpoint,
-    api_key=openai_config.subscription_key,
-    api_version=openai_config.api_version
-)
+# openai and crewai are imported on first use, so routing from the cache or
+# the keyword router never pays for them at startup
+_client = None
 
-data_source_expert = Agent(
-    role='Data Source Selection Expert',
-    goal='Determine the most appropriate data source based on query content',
-    backstory="""I am an expert in different data sources and responsible for 
-    selecting the most accurate data source based on query content.""",
-    allow_delegation=False,
-    llm_config={
-        "model": openai_config.deployment,
-        "api_type": "azure",
-        "temperature": 0.3,
-        "client": client
-    },    
-    verbose=True
-)
+def get_client():
+    """Shared AzureOpenAI client, created on the first LLM call"""
+    global _client
+    if _client is None:
+        from openai import AzureOpenAI
+        _client = AzureOpenAI(
+            azure_endpoint=openai_config.endpoint,
+            api_key=openai_config.subscription_key,
+            api_version=openai_config.api_version,
+            # llm_guard owns retries, so the SDK must not retry on its own
+            max_retries=0
+        )
+    return _client
 
-rule_analyst = Agent(
-    role='Rule Analyst',
-    goal='Analyze and apply data source selection rules',
-    backstory="""I analyze data source selection rules and 
-    determine the most appropriate rule for the query.""",
-    allow_delegation=False,
-    llm_config={
-        "model": openai_config.deployment,
-        "api_type": "azure",
-        "temperature": 0.3,
-        "client": client
-    },    
-    verbose=True
-)
+def set_client(new_client):
+    """Use another client (tests, benchmarks, a different endpoint)"""
+    global _client
+    _client = new_client
 
-rules = {
-    'price_rules': {
-        'keywords': ['price', 'cost', 'value', 'purchase', 'sale'],
-        'default_table': 'Fast Markets',
-        'description': 'Used for queries related to price information, cost analysis, purchase-sale values and market pricing.',
-        'example_queries': [
-            "Fast markets corn price list for this month ?",
-            "What are the average, low, and high prices of used cooking oil at international in different regions over time?",
-            "What are the average, low, and high prices of Used Cooking Oil in the Atlantic Seaboard region over time?",
-            "What is the average value of barley assessments in USD over the past 90 days, grouped by FOB details and day-time?"
-        ]
+# Agent personas; build_agents turns them into crewai Agents and the ensemble
+# router (ensemble.py) uses them as independent LLM voters
+AGENT_PERSONAS = {
+    'data_source_expert': {
+        'role': 'Data Source Selection Expert',
+        'goal': 'Determine the most appropriate data source based on query content',
+        'backstory': """I am an expert in different data sources and responsible for 
+        selecting the most accurate data source based on query content.""",
     },
-    'agriculture_rules': {
-        'keywords': ['agriculture', 'crop', 'farm', 'yield'],
-        'default_table': 'NASS Statistics',
-        'description': 'Used for queries related to agricultural production, crop data, farm statistics and yield estimates published by the United States Department of Agriculture (USDA).',
-        'example_queries': [
-            "How many pounds of crude soybean oil stocks are stored onsite and offsite nationally by month and year?",
-            "What is the weekly percentage of sorghum in excellent and good condition at the national level?",
-            "What are the annual national statistics for acres of spring durum wheat harvested and planted?",
-            "What is the weekly percentage of corn planted in each state?",
-            "What is the weekly percentage distribution of winter wheat conditions classified as \"EXCELLENT\" or \"GOOD\" at the state level over the years?",
-            "What is the annual national production of winter wheat in bushels?"
-        ]
+    'rule_analyst': {
+        'role': 'Rule Analyst',
+        'goal': 'Analyze and apply data source selection rules',
+        'backstory': """I analyze data source selection rules and 
+        determine the most appropriate rule for the query.""",
     },
-    'export_rules': {
-        'keywords': ['export', 'sales'],
-        'default_table': 'Export Sales Report',
-        'description': 'Used for queries related to export sales, foreign trade reports and international sales data.',
-        'example_queries': [
-            "What is the weekly progress of Barley exports in comparison to 99% of the USDA forecast and the USDA forecast minus cumulative sales for each week?",
-            "What is the weekly and cumulative percentage of total U.S. corn exports over different weeks and years?",
-            "What are the weekly net sales and cumulative sales for 'Wheat - SRW' over time?",
-            "What are the weekly net sales and cumulative sales for all wheat, adjusted by a factor, over a given time period?",
-            "What is the weekly and cumulative percentage of total barley exports for each week?"
-        ]
-    },
-    'europe_rules': {
-        'keywords': ['europe', 'eu', 'european'],
-        'default_table': 'European Agricultural Statistics',
-        'description': 'Used for queries containing price, production and trade data related to European Union and European countries.',
-        'example_queries': [
-            "How does the total wheat production in European countries compare to the total wheat production in the United States, measured in tons, over the same years?",
-            "What was the production of wheat in France for the years 2016 and 2017?" 
-        ]     
-    },
-    'trade_rules': {
-        'keywords': ['trade', 'export', 'import'],
-        'default_table': 'Trade Data Monitor',
-        'description': 'Used for queries related to international trade flows, import-export statistics and trade balance data.',
-        'example_queries': [
-            "What is the seasonal export quantity and cumulative export quantity of corn (in tons) for specific countries (Argentina, Brazil, Ukraine, and the United States) over different market and calendar years and months?"
-        ]
-    },
-    'psd_rules': {
-        'keywords': ['production', 'supply', 'distribution', 'psd'],
-        'default_table': 'Production, Supply, and Distribution (PSD) Statistics',
-        'description': 'Used for queries related to production, supply, distribution statistics and PSD reports.',
-        'example_queries': [
-            "What is the weekly progress of Barley exports in comparison to 99% of the USDA forecast and the USDA forecast minus cumulative sales for each week?",
-            "What is the weekly and cumulative percentage of total U.S. corn exports over different weeks and years?",
-            "What is the weekly and cumulative percentage of total U.S. sorghum exports, by week, for each year?"
-        ]
-    }
 }
 
-# Caching class
-class QueryCache:
-    def __init__(self, expiry_minutes: int = 60):
-        self.cache = {}
-        self.expiry = expiry_minutes
-
-    def get(self, key: str) -> Dict[str, Any]:
-        if key in self.cache:
-            result, timestamp = self.cache[key]
-            if datetime.now() - timestamp < timedelta(minutes=self.expiry):
-                return result
-            del self.cache[key]
-        return None
+def build_agents() -> Dict[str, Any]:
+    from crewai import Agent
+
+    data_source_expert = Agent(
+        **AGENT_PERSONAS['data_source_expert'],
+        allow_delegation=False,
+        llm_config={
+            "model": openai_config.deployment,
+            "api_type": "azure",
+            "temperature": 0.3,
+            "client": get_client()
+        },    
+        verbose=True
+    )
+
+    rule_analyst = Agent(
+        **AGENT_PERSONAS['rule_analyst'],
+        allow_delegation=False,
+        llm_config={
+            "model": openai_config.deployment,
+            "api_type": "azure",
+            "temperature": 0.3,
+            "client": get_client()
+        },    
+        verbose=True
+    )
+    return {'data_source_expert': data_source_expert, 'rule_analyst': rule_analyst}
+
+def __getattr__(name: str):
+    # main.client, main.data_source_expert and main.rule_analyst keep working, built on first access
+    if name == 'client':
+        return get_client()
+    if name in ('data_source_expert', 'rule_analyst'):
+        agents = build_agents()
+        globals().update(agents)
+        return agents[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Routing rules live in ROUTING_RULES_PATH (rules.json by default) and are
+# swapped by reload_rules as one RuleSet version. Functions below read
+# ``routing`` once per call, so a decision never mixes two versions.
+routing = RuleSet(load_rules())
+_reload_lock = threading.Lock()
+
+# The current version's rules and local pre-router, for callers outside this module
+rules = routing.rules
+keyword_router = routing.keyword_router
+
+# Rules section of the matching prompt, compiled once per rules version
+# whose matching text changed (see apply_rules)
+rule_prompt = CachedPrompt(
+    lambda: build_rules_prompt_prefix(routing.rules),
+    "\nQuery: {query}\n"
+    "Please match the query to the most appropriate rule and explain why. Make sure to include the rule name in your response."
+)
+
+# Structured variant: same rules section, answered through the select_rule function
+structured_rule_prompt = CachedPrompt(
+    lambda: rule_prompt.prefix,
+    "\nQuery: {query}\n"
+    "Call select_rule with the most appropriate rule for the query and your confidence."
+)
 
-    def set(self, key: str, value: Dict[str, Any]):
-        self.cache[key] = (value, datetime.now())
+# Batch variant: same rules section, answers keyed by query index
+batch_rule_prompt = CachedPrompt(
+    lambda: rule_prompt.prefix
+    + "\nMatch each of the numbered queries below to the most appropriate rule. "
+    "Respond with a JSON object that maps every query number to a rule name, "
+    "for example {\"0\": \"price_rules\", \"1\": \"export_rules\"}.\n\nQueries:\n"
+)
+
+# Ranking variant: same rules section, every applicable rule scored through rank_rules
+ranked_rule_prompt = CachedPrompt(
+    lambda: rule_prompt.prefix,
+    "\nQuery: {query}\n"
+    "Call rank_rules with every rule whose data the query needs, most relevant first, "
+    "each with the probability that the rule applies. Queries can span several rules."
+)
+
+# Batch routing limits; prompt size is estimated at ~4 characters per token
+BATCH_MAX_PROMPT_TOKENS = 8000
+BATCH_MAX_QUERIES = 50
+
+# Ranking scores estimate the probability that a rule applies. LLM rankings
+# carry the model's stated probabilities, temperature-scaled: models are
+# overconfident and a temperature above 1 pulls them towards 0.5; 1 keeps
+# them as stated. Keyword rankings (a confident local match, the outage
+# fallback) give the best hit KEYWORD_CONFIDENCE and the other rules their
+# share of its score. Neither is calibrated until both are fitted on
+# labelled traffic with benchmarks/fit_scores.py.
+RANK_TEMPERATURE = float(os.getenv("ROUTING_RANK_TEMPERATURE", "1.0"))
+KEYWORD_CONFIDENCE = float(os.getenv("ROUTING_KEYWORD_CONFIDENCE", "0.9"))
+# Rankings share the query cache under their own key space
+RANK_CACHE_PREFIX = "ranked:"
+
+# Minutes an expired entry may still be served while one background refresh
+# runs (stale-while-revalidate); 0 disables it
+STALE_MINUTES = int(os.getenv("ROUTING_CACHE_STALE_MINUTES", "0"))
+
+# Bounded LRU+TTL cache shared by all worker threads. Setting ROUTING_CACHE_PATH
+# backs it with a SQLite file that every worker process on the host shares.
+query_cache = QueryCache(expiry_minutes=60, max_entries=10000, stale_minutes=STALE_MINUTES)
+if os.getenv("ROUTING_CACHE_PATH"):
+    query_cache = LayeredCache(query_cache, SQLiteQueryCache(os.environ["ROUTING_CACHE_PATH"], expiry_minutes=60,
+                                                             stale_minutes=STALE_MINUTES))
+    query_cache.warm_start(limit=int(os.getenv("ROUTING_CACHE_WARM_KEYS", "1000")))
+
+# Near-duplicate lookup for queries that miss the exact cache
+semantic_cache = SemanticCache(threshold=0.9, max_entries=100000)
+
+# Known-good answers (the rules' example queries, logged traffic) compiled
+# offline by `python answer_index.py build`; consulted before the cache and
+# swapped in whole when the file is rebuilt. ROUTING_ANSWER_INDEX moves it.
+answer_index = AnswerIndex()
+
+# ROUTING_ANSWER_LOG appends every routing decision as input for the next build
+answer_log = AnswerLog(os.environ["ROUTING_ANSWER_LOG"]) if os.getenv("ROUTING_ANSWER_LOG") else None
+
+# Concurrent misses for the same normalized query share one LLM call
+route_flight = SingleFlight()
 
-query_cache = QueryCache()
+# Every Azure OpenAI call goes through this guard: per-call timeout, jittered
+# exponential retry (Retry-After wins), and a breaker that opens when the
+# recent error rate is too high. While it is open queries are routed by
+# fallback_rule instead of failing. With ROUTING_LLM_RPM / ROUTING_LLM_TPM set,
+# calls also queue for quota by priority: single-query routing is
+# interactive, batch routing and background refreshes wait behind it. The
+# quota is the deployment's, shared with every other call site that uses it.
+llm_guard = Resilient(
+    "router",
+    timeout=float(os.getenv("ROUTING_LLM_TIMEOUT", "10")),
+    policy=RetryPolicy(max_attempts=int(os.getenv("ROUTING_LLM_MAX_ATTEMPTS", "3"))),
+    breaker=CircuitBreaker(
+        error_rate=float(os.getenv("ROUTING_BREAKER_ERROR_RATE", "0.5")),
+        min_calls=int(os.getenv("ROUTING_BREAKER_MIN_CALLS", "10")),
+        open_seconds=float(os.getenv("ROUTING_BREAKER_OPEN_SECONDS", "30")),
+    ),
+    on_event=lambda name, event: tracer.count(f"{name}.{event}"),
+    limiter=shared_limiter(openai_config.deployment),
+)
+# Named after the guard: the crews register their own on the same tracer
+tracer.gauge("router.breaker_state", llm_guard.state_value)
+if llm_guard.limiter is not None:
+    tracer.gauge("router.rate_limit_queue", llm_guard.limiter.queue_depth)
+
+# Fallback answers are guesses: cache them briefly so the LLM decides once it is back
+FALLBACK_TTL_SECONDS = 60
+FALLBACK_MIN_SIMILARITY = 0.6
 
 # Logging settings
 def setup_logging(debug: bool = False):
@@ -144,7 +223,9 @@ def setup_logging(debug: bool = False):
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
 
-def match_query_to_rule(query: str, debug: bool = False) -> Dict[str, Any]:
+def match_query_to_rule(query: str, debug: bool = False, local_first: bool = True,
+                        explain: bool = False, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """Rule for a query; with ``explain`` and ``on_token`` the reasoning is streamed as it is generated"""
     logger = logging.getLogger(__name__)
     
     if not query.strip():
@@ -153,78 +234,758 @@ def match_query_to_rule(query: str, debug: bool = False) -> Dict[str, Any]:
     if debug:
         logger.debug(f"Query received: {query}")
 
-    prompt = """Match the query to the most appropriate rule based on the rule descriptions below:
-
-Rules and Descriptions:
-"""
-    for rule_name, rule_details in rules.items():
-        prompt += f"\nRule: {rule_name}\n"
-        prompt += f"Description: {rule_details['description']}\n"
-        prompt += f"Keywords: {', '.join(rule_details['keywords'])}\n"
-        prompt += f"Example Queries:\n"
-        for example in rule_details['example_queries']:
-            prompt += f"- {example}\n"
-            
-    prompt += f"\nQuery: {query}\n"
-    prompt += "Please match the query to the most appropriate rule and explain why. Make sure to include the rule name in your response."
+    # Confident keyword matches never reach the LLM
+    if local_first:
+        config = routing
+        with tracer.span("router.local") as span:
+            local_rule = config.keyword_router.route(query)
+            span.set(matched=bool(local_rule))
+        if local_rule:
+            logger.info(f"Rule matched locally: {local_rule}")
+            return config.rules[local_rule]
+        if debug:
+            logger.debug(f"Local router scores: {config.keyword_router.score(query)[:3]}")
 
     try:
-        completion = client.chat.completions.create(
-            model=openai_config.deployment,
-            messages=[
-                {"role": "system", "content": "You are an AI assistant that matches user queries to appropriate rules based on semantic analysis."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=300,
-            temperature=0.3,
-        )
-        
-        response = completion.to_dict()
-        result = response["choices"][0]["message"]["content"]
-
-        for rule_name in rules.keys():
-            if rule_name.lower() in result.lower():
-                logger.info(f"Rule match successful: {rule_name}")
-                return rules[rule_name]
-                
+        if explain and on_token is not None:
+            explanation = stream_rule_explanation(query, on_token)
+            with tracer.span("parse"):
+                return parse_rule_explanation(explanation)
+        with tracer.span("prompt.build"):
+            request = build_rule_request(query, explain)
+        with tracer.span("llm.call", explain=explain) as span:
+            completion = llm_guard.call(get_client().chat.completions.create, **request)
+            record_usage(span, completion)
+        with tracer.span("parse"):
+            return parse_rule_reply(completion, explain)
     except Exception as e:
         logger.error(f"OpenAI error: {str(e)}")
-        raise OpenAIConnectionError(f"OpenAI connection error: {str(e)}")
-    
+        raise OpenAIConnectionError(f"OpenAI connection error: {str(e)}") from e
+
+def build_rule_tool() -> Dict[str, Any]:
+    """Function schema that constrains the answer to one of the rule names"""
+    return {
+        "type": "function",
+        "function": {
+            "name": "select_rule",
+            "description": "Select the rule that best matches the query.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "rule": {"type": "string", "enum": list(routing.rules.keys())},
+                    "confidence": {"type": "number", "minimum": 0, "maximum": 1}
+                },
+                "required": ["rule", "confidence"]
+            }
+        }
+    }
+
+def build_rule_request(query: str, explain: bool = False, persona: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Chat completion arguments for matching one query.
+
+    By default the model must call ``select_rule``, so the reply is a few
+    tokens of JSON. ``explain`` asks for the free-text reasoning instead.
+    ``persona`` (an AGENT_PERSONAS entry) replaces the system message.
+    """
+    system_message = {"role": "system", "content": "You are an AI assistant that matches user queries to appropriate rules based on semantic analysis."}
+    if persona is not None:
+        system_message = {"role": "system", "content": f"You are a {persona['role']}. Your goal: {persona['goal']}. "
+                                                       f"{' '.join(persona['backstory'].split())}"}
+    if explain:
+        return {
+            "model": openai_config.deployment,
+            "messages": [system_message, {"role": "user", "content": rule_prompt.render(query=query)}],
+            "max_tokens": 300,
+            "temperature": 0.3,
+        }
+    return {
+        "model": openai_config.deployment,
+        "messages": [system_message, {"role": "user", "content": structured_rule_prompt.render(query=query)}],
+        "tools": [build_rule_tool()],
+        "tool_choice": {"type": "function", "function": {"name": "select_rule"}},
+        "max_tokens": 30,
+        "temperature": 0,
+    }
+
+def record_usage(span, completion):
+    """Copy the token counts of a completion onto its trace span"""
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+def stream_rule_explanation(query: str, on_token: Callable[[str], None]) -> str:
+    """Request the explained match with ``stream=True``, forward each text delta, return the full text"""
+    with tracer.span("prompt.build"):
+        request = build_rule_request(query, explain=True)
+    parts = []
+    with tracer.span("llm.call", explain=True, stream=True) as span:
+        # The guard covers the whole stream, so a failure mid-answer reaches the breaker
+        for chunk in llm_guard.stream(get_client().chat.completions.create, stream=True, **request):
+            # Azure sends a leading chunk without choices (content filter results)
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                if not parts:
+                    span.mark("ttft")
+                parts.append(text)
+                on_token(text)
+        span.set(chunks=len(parts))
+    return "".join(parts)
+
+def parse_rule_explanation(result: str) -> Dict[str, Any]:
+    logger = logging.getLogger(__name__)
+
+    # The answer names its choice before any alternatives it rules out, so the
+    # earliest mention wins rather than the first rule in dict order
+    rules = routing.rules
+    text = result.lower()
+    positions = {rule_name: text.find(rule_name.lower()) for rule_name in rules}
+    mentioned = [rule_name for rule_name, position in positions.items() if position >= 0]
+    if mentioned:
+        rule_name = min(mentioned, key=positions.__getitem__)
+        logger.info(f"Rule match successful: {rule_name}")
+        return rules[rule_name]
     return {"default_table": "Unknown Source"}
 
+def parse_rule_selection(completion) -> Tuple[Optional[str], float]:
+    """Rule name and stated confidence from the select_rule call; (None, 0.0) without a known rule"""
+    logger = logging.getLogger(__name__)
+
+    message = completion.to_dict()["choices"][0]["message"]
+    rules = routing.rules
+    for tool_call in message.get("tool_calls") or []:
+        try:
+            arguments = json.loads(tool_call["function"]["arguments"])
+        except (KeyError, ValueError):
+            continue
+        rule_name = arguments.get("rule")
+        if rule_name in rules:
+            confidence = arguments.get("confidence")
+            logger.info(f"Rule match successful: {rule_name} (confidence {confidence})")
+            return rule_name, float(confidence) if isinstance(confidence, (int, float)) else 1.0
+        logger.warning(f"Model selected an unknown rule: {rule_name}")
+    return None, 0.0
+
+def parse_rule_reply(completion, explain: bool = False) -> Dict[str, Any]:
+    if explain:
+        return parse_rule_explanation(completion.to_dict()["choices"][0]["message"]["content"])
+
+    rule_name, _ = parse_rule_selection(completion)
+    return routing.rules.get(rule_name) or {"default_table": "Unknown Source"}
+
+def build_rank_tool() -> Dict[str, Any]:
+    """Function schema for an ordered list of (rule, probability) pairs"""
+    rules = routing.rules
+    return {
+        "type": "function",
+        "function": {
+            "name": "rank_rules",
+            "description": "Rank every rule that applies to the query, most relevant first.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "rankings": {
+                        "type": "array",
+                        "minItems": 1,
+                        "maxItems": len(rules),
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "rule": {"type": "string", "enum": list(rules.keys())},
+                                "score": {"type": "number", "minimum": 0, "maximum": 1}
+                            },
+                            "required": ["rule", "score"]
+                        }
+                    }
+                },
+                "required": ["rankings"]
+            }
+        }
+    }
+
+def build_rank_request(query: str) -> Dict[str, Any]:
+    """Chat completion arguments for ranking all applicable rules of one query"""
+    return {
+        "model": openai_config.deployment,
+        "messages": [
+            {"role": "system", "content": "You are an AI assistant that matches user queries to appropriate rules based on semantic analysis."},
+            {"role": "user", "content": ranked_rule_prompt.render(query=query)}
+        ],
+        "tools": [build_rank_tool()],
+        "tool_choice": {"type": "function", "function": {"name": "rank_rules"}},
+        "max_tokens": 20 * len(routing.rules) + 20,
+        "temperature": 0,
+    }
+
+def calibrate_score(score: float, temperature: Optional[float] = None) -> float:
+    """Temperature-scaled probability: the score's log-odds divided by ``temperature``"""
+    temperature = RANK_TEMPERATURE if temperature is None else temperature
+    probability = min(max(float(score), 1e-4), 1 - 1e-4)
+    return round(1.0 / (1.0 + math.exp(-math.log(probability / (1 - probability)) / temperature)), 4)
+
+def keyword_ranking(scored: List[Tuple[str, float]], confidence: Optional[float] = None) -> List[Tuple[str, float]]:
+    """Keyword router scores on the ranking scale: the best rule gets ``confidence``, the rest their share of it"""
+    confidence = KEYWORD_CONFIDENCE if confidence is None else confidence
+    if not scored:
+        return []
+    top = scored[0][1]
+    return [(rule_name, round(confidence * score / top, 4)) for rule_name, score in scored]
+
+def parse_rule_ranking(completion) -> List[Tuple[str, float]]:
+    """(rule name, temperature-scaled score) pairs from a rank_rules call, best first; unknown rules are dropped"""
+    message = completion.to_dict()["choices"][0]["message"]
+    rules = routing.rules
+    scores: Dict[str, float] = {}
+    for tool_call in message.get("tool_calls") or []:
+        try:
+            arguments = json.loads(tool_call["function"]["arguments"])
+        except (KeyError, ValueError):
+            continue
+        for item in arguments.get("rankings") or []:
+            if not isinstance(item, dict):
+                continue
+            rule_name, score = item.get("rule"), item.get("score")
+            if rule_name in rules and isinstance(score, (int, float)):
+                scores[rule_name] = max(scores.get(rule_name, 0.0), calibrate_score(score))
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def rank_query_rules(query: str, debug: bool = False, local_first: bool = True) -> List[Tuple[str, float]]:
+    """Every rule that applies to a query, best first, with scores from one LLM call.
+
+    Only a confident keyword match on a single rule skips the LLM: queries
+    whose keywords hit several rules are the ones that need a ranking.
+    """
+    logger = logging.getLogger(__name__)
+
+    if not query.strip():
+        raise QueryMatchError("Query cannot be empty")
+
+    if local_first:
+        keyword_router = routing.keyword_router
+        with tracer.span("router.local", ranked=True) as span:
+            scored = keyword_router.score(query)
+            single = len(scored) == 1 and keyword_router.route(query) == scored[0][0]
+            span.set(matched=single)
+        if single:
+            return keyword_ranking(scored)
+
+    try:
+        with tracer.span("prompt.build"):
+            request = build_rank_request(query)
+        with tracer.span("llm.call", ranked=True) as span:
+            completion = llm_guard.call(get_client().chat.completions.create, **request)
+            record_usage(span, completion)
+        with tracer.span("parse"):
+            ranking = parse_rule_ranking(completion)
+    except Exception as e:
+        logger.error(f"OpenAI error: {str(e)}")
+        raise OpenAIConnectionError(f"OpenAI connection error: {str(e)}") from e
+    if debug:
+        logger.debug(f"Rule ranking: {ranking}")
+    return ranking
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def match_queries_to_rules(queries: List[str], debug: bool = False) -> List[Dict[str, Any]]:
+    """Match several queries in one LLM round-trip; results follow input order"""
+    logger = logging.getLogger(__name__)
+
+    if any(not query.strip() for query in queries):
+        raise QueryMatchError("Query cannot be empty")
+    if not queries:
+        return []
+
+    prompt = batch_rule_prompt.render() + "".join(
+        f"{index}: {' '.join(query.split())}\n" for index, query in enumerate(queries)
+    )
+    if debug:
+        logger.debug(f"Batch of {len(queries)} queries, ~{estimate_tokens(prompt)} prompt tokens")
+
+    try:
+        with tracer.span("llm.batch", queries=len(queries)) as span:
+            completion = llm_guard.call(
+                get_client().chat.completions.create,
+                model=openai_config.deployment,
+                messages=[
+                    {"role": "system", "content": "You are an AI assistant that matches user queries to appropriate rules based on semantic analysis."},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={"type": "json_object"},
+                max_tokens=12 * len(queries) + 20,
+                temperature=0,
+            )
+            record_usage(span, completion)
+        response = completion.to_dict()
+        answers = json.loads(response["choices"][0]["message"]["content"])
+    except Exception as e:
+        logger.error(f"OpenAI error: {str(e)}")
+        raise OpenAIConnectionError(f"OpenAI connection error: {str(e)}") from e
+
+    rules = routing.rules
+    results = []
+    for index in range(len(queries)):
+        rule_name = str(answers.get(str(index), "")).strip()
+        results.append(rules.get(rule_name, {"default_table": "Unknown Source"}))
+    return results
+
+def chunk_queries(queries: List[str], max_prompt_tokens: int = BATCH_MAX_PROMPT_TOKENS,
+                  max_queries: int = BATCH_MAX_QUERIES) -> List[List[str]]:
+    """Split queries into chunks whose prompts stay under the token budget"""
+    budget = max_prompt_tokens - estimate_tokens(batch_rule_prompt.prefix)
+    chunks, current, used = [], [], 0
+    for query in queries:
+        cost = estimate_tokens(query) + 2
+        if current and (used + cost > budget or len(current) >= max_queries):
+            chunks.append(current)
+            current, used = [], 0
+        current.append(query)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
 def process_with_azure_openai(query: str, debug: bool = False) -> str:
     return match_query_to_rule(query, debug)
 
+def lookup_cached_rule(query: str, allow_stale: bool = False) -> Dict[str, Any]:
+    """Exact cache first, then the semantic cache; None on a miss.
+
+    With ``allow_stale`` an expired entry inside the stale window is returned
+    and a single background refresh is started for it.
+    """
+    with tracer.span("cache.lookup") as span:
+        result, outcome = _lookup_cached_rule(query, allow_stale)
+        span.set(cache=outcome)
+    return result
+
+def _lookup_cached_rule(query: str, allow_stale: bool) -> Tuple[Optional[Dict[str, Any]], str]:
+    logger = logging.getLogger(__name__)
+
+    entry = query_cache.get_stale(query)
+    if entry:
+        cached_result, fresh = entry
+        if fresh:
+            logger.info("Result retrieved from cache")
+            return cached_result, "hit"
+        if allow_stale:
+            logger.info("Stale result retrieved from cache, refreshing")
+            route_flight.do_in_background(normalize_query(query), lambda: with_priority(BACKGROUND, _match_and_cache, query, fallback=False))
+            return cached_result, "stale"
+
+    similar_result = semantic_cache.get(query)
+    if similar_result:
+        logger.info("Result retrieved from semantic cache")
+        query_cache.set(query, similar_result)
+        return similar_result, "semantic"
+    return None, "miss"
+
+def lookup_indexed_source(query: str) -> Optional[str]:
+    """Table from the precomputed answer index; None when the query is not in it"""
+    with tracer.span("index.lookup") as span:
+        entry = answer_index.lookup_entry(query)
+        # An index built under other rules may hold answers a rules reload changed
+        table = entry[0] if entry and not routing.affects_indexed(entry[1], query, entry[0]) else None
+        span.set(cache="hit" if table else ("stale" if entry else "miss"))
+    return table
+
+def cache_rule(query: str, rule_details: Dict[str, Any]):
+    if rule_details in routing.rules.values():
+        query_cache.set(query, rule_details)
+        semantic_cache.set(query, rule_details)
+        if answer_log is not None:
+            answer_log.record(query, rule_details['default_table'])
+    elif 'keywords' not in rule_details:
+        # "Unknown Source"; a rule missing from the current version was decided
+        # under rules swapped out meanwhile and is not worth keeping
+        query_cache.set(query, rule_details)
+
+def apply_rules(new_rules: Dict[str, Dict[str, Any]]) -> RuleSet:
+    """Swap in a new version of the rules and return it.
+
+    Only what the change touches is rebuilt: the keyword router and the rule
+    prompts when matching text changed, nothing when only tables moved.
+    Cached answers (exact, ranked and semantic) that may route differently
+    under the new rules are dropped; the rest of the caches stays warm.
+    """
+    global routing, rules, keyword_router
+    with _reload_lock:
+        updated = RuleSet(new_rules, routing.version + 1, previous=routing)
+        routing = updated
+        rules, keyword_router = updated.rules, updated.keyword_router
+        if updated.matching_changed:
+            for prompt in (rule_prompt, structured_rule_prompt, batch_rule_prompt, ranked_rule_prompt):
+                prompt.invalidate()
+        affected = lambda key, value: value is not None and updated.affects(key, value)
+        invalidated = query_cache.invalidate(affected) + semantic_cache.invalidate(affected)
+    tracer.count("rules.reload")
+    logging.getLogger(__name__).info(
+        f"Rules version {updated.version} loaded: {len(updated.changed)} rules changed, "
+        f"{invalidated} cached answers invalidated")
+    return updated
+
+def reload_rules(path: Optional[str] = None) -> RuleSet:
+    """Load the rules file again; an invalid file raises and the current rules stay in place"""
+    return apply_rules(load_rules(path))
+
+def watch_rules(interval: float = 5.0, path: Optional[str] = None) -> FileWatcher:
+    """Reload the rules whenever the rules file changes; returns the running watcher"""
+    global _rules_watcher
+    if _rules_watcher is None:
+        _rules_watcher = FileWatcher(interval)
+        _rules_watcher.watch(path or RULES_PATH, reload_rules)
+        _rules_watcher.start()
+    return _rules_watcher
+
+_rules_watcher: Optional[FileWatcher] = None
+tracer.gauge("rules.version", lambda: routing.version)
+
+def fallback_rule(query: str) -> Optional[Dict[str, Any]]:
+    """Local best guess for when the LLM cannot be reached.
+
+    The top keyword score wins even below the router's confidence
+    thresholds; without any keyword hit the nearest semantic cache entry is
+    used if it is reasonably close. None when there is nothing to go on.
+    """
+    config = routing
+    ranked = config.keyword_router.score(query)
+    if ranked:
+        return config.rules[ranked[0][0]]
+    value, similarity = semantic_cache.search(query)
+    if value is not None and similarity >= FALLBACK_MIN_SIMILARITY:
+        return value
+    return None
+
+def llm_unavailable(error: OpenAIConnectionError) -> bool:
+    """Whether the wrapped failure was an outage rather than a bad request or a bug"""
+    return is_unavailable(error.__cause__ or error)
+
+def _fallback(query: str, error: OpenAIConnectionError) -> Dict[str, Any]:
+    """Degrade to fallback_rule when the LLM is unavailable; re-raise other failures and when it has no answer"""
+    if not llm_unavailable(error):
+        raise error
+    with tracer.span("router.fallback", breaker=llm_guard.state) as span:
+        rule_details = fallback_rule(query)
+        span.set(matched=rule_details is not None)
+    if rule_details is None:
+        raise error
+    logging.getLogger(__name__).warning(f"LLM unavailable, using local fallback: {rule_details['default_table']}")
+    query_cache.set(query, rule_details, ttl_seconds=FALLBACK_TTL_SECONDS)
+    return rule_details
+
+def _match_and_cache(query: str, debug: bool = False, fallback: bool = True) -> Dict[str, Any]:
+    try:
+        rule_details = match_query_to_rule(query, debug)
+    except OpenAIConnectionError as e:
+        if not fallback:
+            raise
+        return _fallback(query, e)
+    cache_rule(query, rule_details)
+    return rule_details
+
+def fallback_ranking(query: str) -> List[Tuple[str, float]]:
+    """Keyword ranking of every rule with a hit; a rough ranking for when the LLM cannot be reached"""
+    return keyword_ranking(routing.keyword_router.score(query))
+
+def lookup_cached_ranking(query: str) -> Optional[List[Tuple[str, float]]]:
+    with tracer.span("cache.lookup", ranked=True) as span:
+        cached = query_cache.get(RANK_CACHE_PREFIX + query)
+        span.set(cache="hit" if cached is not None else "miss")
+    if cached is None:
+        return None
+    # Tuples come back as lists from the SQLite layer
+    return [(rule_name, score) for rule_name, score in cached['rankings']]
+
+def _rank_and_cache(query: str, debug: bool = False) -> List[Tuple[str, float]]:
+    try:
+        ranking = rank_query_rules(query, debug)
+    except OpenAIConnectionError as e:
+        if not llm_unavailable(e):
+            raise
+        with tracer.span("router.fallback", breaker=llm_guard.state, ranked=True) as span:
+            ranking = fallback_ranking(query)
+            span.set(matched=bool(ranking))
+        if not ranking:
+            raise e
+        query_cache.set(RANK_CACHE_PREFIX + query, {'rankings': ranking}, ttl_seconds=FALLBACK_TTL_SECONDS)
+        return ranking
+    query_cache.set(RANK_CACHE_PREFIX + query, {'rankings': ranking})
+    # The top entry is also the single-rule answer; later get_appropriate_data_source calls need no LLM
+    rules = routing.rules
+    if ranking and ranking[0][0] in rules and query_cache.get(query) is None:
+        cache_rule(query, rules[ranking[0][0]])
+    return ranking
+
+def get_ranked_rules(query: str, k: int = 3, min_score: float = 0.0,
+                     debug: bool = False) -> List[Tuple[str, float]]:
+    """Up to ``k`` (rule name, score) pairs, best first.
+
+    The full ranking is routed and cached as one unit; ``k`` and
+    ``min_score`` only cut the cached list, so asking for more alternatives
+    later costs no extra LLM call.
+    """
+    if not query.strip():
+        raise QueryMatchError("Query cannot be empty")
+    ranking = lookup_cached_ranking(query)
+    if ranking is None:
+        ranking = route_flight.do(RANK_CACHE_PREFIX + normalize_query(query), lambda: _rank_and_cache(query, debug))
+    return [(rule_name, score) for rule_name, score in ranking if score >= min_score][:k]
+
+def get_ranked_data_sources(query: str, k: int = 3, min_score: float = 0.0,
+                            debug: bool = False) -> List[Tuple[str, float]]:
+    """(data source, score) pairs for querying several tables of a multi-topic query in parallel"""
+    rules = routing.rules
+    with tracer.span("route", mode="ranked") as span:
+        sources = [(rules[rule_name]['default_table'], score)
+                   for rule_name, score in get_ranked_rules(query, k, min_score, debug) if rule_name in rules]
+        span.set(sources=len(sources))
+    return sources
+
 def get_appropriate_data_source(query: str, debug: bool = False) -> str:
+    with tracer.span("route") as span:
+        source = _get_appropriate_data_source(query, debug)
+        span.set(source=source)
+    return source
+
+def _get_appropriate_data_source(query: str, debug: bool) -> str:
     logger = logging.getLogger(__name__)
     
+    indexed = lookup_indexed_source(query)
+    if indexed:
+        return indexed
+
     # Check cache
-    cached_result = query_cache.get(query)
+    cached_result = lookup_cached_rule(query, allow_stale=STALE_MINUTES > 0)
     if cached_result:
-        logger.info("Result retrieved from cache")
         return cached_result["default_table"]
     
-    # Rule matching
-    rule_details = match_query_to_rule(query, debug)
-    
-    # Save result to cache
-    query_cache.set(query, rule_details)
+    # Rule matching; callers that miss at the same moment wait for the first one
+    rule_details = route_flight.do(normalize_query(query), lambda: _match_and_cache(query, debug))
     
     if debug:
         logger.debug(f"Rule details: {rule_details}")
     
     return rule_details.get("default_table", "Data source not found")
 
+def get_data_source_details(query: str, debug: bool = False) -> Dict[str, Any]:
+    """Registry entry (name, url, description) of the source that serves a query"""
+    table = get_appropriate_data_source(query, debug)
+    return get_registry().get(table) or {"name": table, "url": "No matching source found"}
+
+def get_appropriate_data_sources(queries: List[str], debug: bool = False,
+                                 max_prompt_tokens: int = BATCH_MAX_PROMPT_TOKENS,
+                                 max_queries: int = BATCH_MAX_QUERIES) -> List[str]:
+    """Route many queries at once.
+
+    Duplicates (after normalization) are resolved once, answer index, cache
+    and local router hits are served first, and the remaining misses are sent in
+    token-bounded multi-query prompts. Results follow the input order. When
+    the LLM cannot be reached, a query without a local fallback answers
+    "Unknown Source" instead of failing the whole batch.
+    """
+    logger = logging.getLogger(__name__)
+
+    unique: Dict[str, str] = {}
+    for query in queries:
+        if not query.strip():
+            raise QueryMatchError("Query cannot be empty")
+        unique.setdefault(normalize_query(query), query)
+
+    resolved: Dict[str, Dict[str, Any]] = {}
+    misses = []
+    for key, query in unique.items():
+        indexed = lookup_indexed_source(query)
+        if indexed:
+            resolved[key] = {"default_table": indexed}
+            continue
+        rule_details = lookup_cached_rule(query)
+        if rule_details is None:
+            config = routing
+            local_rule = config.keyword_router.route(query)
+            if local_rule:
+                rule_details = config.rules[local_rule]
+                cache_rule(query, rule_details)
+        if rule_details is None:
+            misses.append(query)
+        else:
+            resolved[key] = rule_details
+
+    chunks = chunk_queries(misses, max_prompt_tokens, max_queries)
+    logger.info(f"Batch routing: {len(queries)} queries, {len(unique)} unique, "
+                f"{len(misses)} sent to the LLM in {len(chunks)} calls")
+    for chunk in chunks:
+        try:
+            with priority(BATCH):
+                answers = match_queries_to_rules(chunk, debug)
+        except OpenAIConnectionError as e:
+            if not llm_unavailable(e):
+                raise
+            for query in chunk:
+                try:
+                    resolved[normalize_query(query)] = _fallback(query, e)
+                except OpenAIConnectionError:
+                    logger.warning(f"LLM unavailable and no local fallback for batch query: {query}")
+                    resolved[normalize_query(query)] = {"default_table": "Unknown Source"}
+            continue
+        for query, rule_details in zip(chunk, answers):
+            cache_rule(query, rule_details)
+            resolved[normalize_query(query)] = rule_details
+
+    return [resolved[normalize_query(query)].get("default_table", "Data source not found") for query in queries]
+
+# Async routing. The client and in-flight bookkeeping are per event loop,
+# since asyncio primitives and pooled connections cannot cross loops.
+# asyncio itself is imported inside these functions: it is the largest
+# part of the module's import time and sync callers never need it.
+ASYNC_MAX_IN_FLIGHT = 32
+
+class _AsyncRouterState:
+    def __init__(self):
+        import asyncio
+        from openai import AsyncAzureOpenAI
+
+        self.client = AsyncAzureOpenAI(
+            azure_endpoint=openai_config.endpoint,
+            api_key=openai_config.subscription_key,
+            api_version=openai_config.api_version,
+            max_retries=0
+        )
+        self.semaphore = asyncio.Semaphore(ASYNC_MAX_IN_FLIGHT)
+        self.in_flight: Dict[str, asyncio.Future] = {}
+
+_async_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncRouterState]" = weakref.WeakKeyDictionary()
+
+def _async_state() -> _AsyncRouterState:
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    state = _async_states.get(loop)
+    if state is None:
+        state = _async_states[loop] = _AsyncRouterState()
+    return state
+
+async def amatch_query_to_rule(query: str, debug: bool = False, local_first: bool = True,
+                              explain: bool = False) -> Dict[str, Any]:
+    logger = logging.getLogger(__name__)
+
+    if not query.strip():
+        raise QueryMatchError("Query cannot be empty")
+
+    if debug:
+        logger.debug(f"Query received: {query}")
+
+    if local_first:
+        config = routing
+        with tracer.span("router.local") as span:
+            local_rule = config.keyword_router.route(query)
+            span.set(matched=bool(local_rule))
+        if local_rule:
+            logger.info(f"Rule matched locally: {local_rule}")
+            return config.rules[local_rule]
+
+    state = _async_state()
+    try:
+        with tracer.span("prompt.build"):
+            request = build_rule_request(query, explain)
+        with tracer.span("llm.call", explain=explain) as span:
+            # The semaphore is held per attempt, not across retry back-off
+            async def create(**kwargs):
+                async with state.semaphore:
+                    span.mark("queue")
+                    return await state.client.chat.completions.create(**kwargs)
+
+            completion = await llm_guard.acall(create, **request)
+            record_usage(span, completion)
+        with tracer.span("parse"):
+            return parse_rule_reply(completion, explain)
+    except Exception as e:
+        logger.error(f"OpenAI error: {str(e)}")
+        raise OpenAIConnectionError(f"OpenAI connection error: {str(e)}") from e
+
+async def _amatch_and_cache(query: str, debug: bool, fallback: bool = True) -> Dict[str, Any]:
+    try:
+        rule_details = await amatch_query_to_rule(query, debug)
+    except OpenAIConnectionError as e:
+        if not fallback:
+            raise
+        return _fallback(query, e)
+    cache_rule(query, rule_details)
+    return rule_details
+
+def _async_flight(query: str, debug: bool = False, fallback: bool = True) -> "asyncio.Future":
+    """The in-flight request for this query on the running loop, started if needed"""
+    import asyncio
+
+    state = _async_state()
+    key = normalize_query(query)
+    future = state.in_flight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_amatch_and_cache(query, debug, fallback))
+        state.in_flight[key] = future
+        future.add_done_callback(lambda _: state.in_flight.pop(key, None))
+    elif debug:
+        logging.getLogger(__name__).debug(f"Joining in-flight request for: {query}")
+    return future
+
+async def aget_appropriate_data_source(query: str, debug: bool = False) -> str:
+    """Async get_appropriate_data_source; concurrent identical misses share one request"""
+    with tracer.span("route", mode="async") as span:
+        source = await _aget_appropriate_data_source(query, debug)
+        span.set(source=source)
+    return source
+
+async def _aget_appropriate_data_source(query: str, debug: bool) -> str:
+    import asyncio
+
+    logger = logging.getLogger(__name__)
+
+    indexed = lookup_indexed_source(query)
+    if indexed:
+        return indexed
+
+    # The SQLite layer and the semantic search block; keep them off the event loop
+    cached_result = await asyncio.to_thread(lookup_cached_rule, query)
+    if cached_result:
+        return cached_result["default_table"]
+
+    if STALE_MINUTES > 0:
+        entry = await asyncio.to_thread(query_cache.get_stale, query)
+        if entry:
+            logger.info("Stale result retrieved from cache, refreshing")
+            # The refresh task copies this context, so it queues as background work
+            with priority(BACKGROUND):
+                _async_flight(query, fallback=False).add_done_callback(lambda f: f.exception())
+            return entry[0]["default_table"]
+
+    future = _async_flight(query, debug)
+
+    # shield: one cancelled caller must not cancel the shared request
+    rule_details = await asyncio.shield(future)
+
+    if debug:
+        logger.debug(f"Rule details: {rule_details}")
+
+    return rule_details.get("default_table", "Data source not found")
+
 def main():
     setup_logging(debug=True)
     logger = logging.getLogger(__name__)
+
+    # ROUTING_METRICS_PORT exposes the trace histograms for Prometheus scraping
+    if os.getenv("ROUTING_METRICS_PORT"):
+        start_metrics_server(tracer, port=int(os.getenv("ROUTING_METRICS_PORT")))
+
+    # ROUTING_RULES_WATCH_SECONDS reloads the rules file when it changes, checking that often
+    if float(os.getenv("ROUTING_RULES_WATCH_SECONDS", "0")) > 0:
+        watch_rules(float(os.getenv("ROUTING_RULES_WATCH_SECONDS")))
     
     try:
-        query = "mısırın türkiye fiyatı nedir"
-        result = get_appropriate_data_source(query, debug=True)
-        logger.info(f"Most appropriate data source: {result}")
-        print(f"Most appropriate data source: {result}")
+        # python main.py "query" ... routes the given queries; only openai is needed
+        for query in sys.argv[1:] or ["mısırın türkiye fiyatı nedir"]:
+            result = get_appropriate_data_source(query, debug=True)
+            logger.info(f"Most appropriate data source: {result}")
+            print(f"Most appropriate data source: {result}")
         
     except (QueryMatchError, OpenAIConnectionError) as e:
         logger.error(f"Process error: {str(e)}")
@@ -0,0 +1,36 @@
+import threading
+from typing import Callable, Optional
+
+
+class CachedPrompt:
+    """Prompt whose static prefix is built once and reused until invalidated.
+
+    ``render`` only formats the short per-call suffix, so repeated calls send
+    a byte-identical prefix, which is also what Azure prompt caching keys on.
+    """
+
+    def __init__(self, build_prefix: Callable[[], str], suffix_template: str = ""):
+        self.build_prefix = build_prefix
+        self.suffix_template = suffix_template
+        self.version = 0
+        self._prefix: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def prefix(self) -> str:
+        prefix = self._prefix
+        if prefix is None:
+            with self._lock:
+                if self._prefix is None:
+                    self._prefix = self.build_prefix()
+                    self.version += 1
+                prefix = self._prefix
+        return prefix
+
+    def invalidate(self):
+        """Drop the compiled prefix; call after mutating what it was built from"""
+        with self._lock:
+            self._prefix = None
+
+    def render(self, **values) -> str:
+        return self.prefix + self.suffix_template.format(**values)
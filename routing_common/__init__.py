@@ -0,0 +1,3 @@
+"""
+Modules shared by the router and the crews
+"""
@@ -0,0 +1,231 @@
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+# Lower value is served first
+INTERACTIVE = 0
+BATCH = 1
+BACKGROUND = 2
+
+# Completion tokens assumed when a request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 256
+
+_priority: "contextvars.ContextVar[int]" = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """LLM calls made inside the block (same thread or task) queue at ``level``"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def with_priority(level: int, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Call ``func`` at ``level``; for work handed to another thread, where context does not follow"""
+    with priority(level):
+        return func(*args, **kwargs)
+
+
+def estimate_request_tokens(request: Dict[str, Any]) -> int:
+    """Tokens a chat completion request will be charged for, estimated before sending it.
+
+    Prompt text (messages and tool schemas) is counted at ~4 characters per
+    token; the completion is assumed to use all of ``max_tokens``, which is
+    how Azure reserves TPM quota for a request.
+    """
+    chars = 0
+    for message in request.get('messages') or []:
+        content = message.get('content') if isinstance(message, dict) else None
+        if isinstance(content, str):
+            chars += len(content)
+        elif content:
+            chars += len(json.dumps(content))
+    if request.get('tools'):
+        chars += len(json.dumps(request['tools']))
+    return chars // 4 + 1 + (request.get('max_tokens') or DEFAULT_COMPLETION_TOKENS)
+
+
+def usage_tokens(response: Any) -> Optional[int]:
+    """Total tokens reported by a completion (openai>=1 objects or legacy dicts); None for streams"""
+    usage = getattr(response, 'usage', None)
+    if usage is None and isinstance(response, dict):
+        usage = response.get('usage')
+    if usage is None:
+        return None
+    total = usage.get('total_tokens') if isinstance(usage, dict) else getattr(usage, 'total_tokens', None)
+    return total if isinstance(total, int) else None
+
+
+class RateLimiter:
+    """Request and token buckets shared by every LLM call site of the process.
+
+    Both buckets refill continuously at ``headroom`` times the deployment's
+    RPM/TPM quota and hold at most ``burst_seconds`` worth of it, so traffic
+    is smoothed instead of spending a minute of quota in one burst. Waiters
+    are served strictly by (priority, arrival): an interactive request never
+    waits behind a queued batch request. ``settle`` corrects the token bucket
+    once the real usage of a response is known.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 headroom: float = 0.9, burst_seconds: float = 10.0):
+        self.quota = (requests_per_minute, tokens_per_minute, headroom)
+        self._rates = (requests_per_minute * headroom / 60.0, tokens_per_minute * headroom / 60.0)
+        self._capacity = tuple(max(rate * burst_seconds, 1.0) if rate else 0.0 for rate in self._rates)
+        self._levels = list(self._capacity)
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue: list = []
+        self._tickets = itertools.count()
+        self.metrics = {'acquired': 0, 'waited': 0, 'wait_ms': 0.0}
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        for index, rate in enumerate(self._rates):
+            if rate:
+                self._levels[index] = min(self._capacity[index], self._levels[index] + elapsed * rate)
+
+    def _wait_time(self, cost: Tuple[float, float]) -> float:
+        wait = 0.0
+        for level, amount, rate in zip(self._levels, cost, self._rates):
+            if rate and level < amount:
+                wait = max(wait, (amount - level) / rate)
+        return wait
+
+    def _cost(self, tokens: int) -> Tuple[float, float]:
+        # A request larger than the bucket would wait forever; it is let through on a full bucket
+        return (1.0, min(float(tokens), self._capacity[1]) if self._rates[1] else 0.0)
+
+    def _take(self, cost: Tuple[float, float], started: float) -> float:
+        heapq.heappop(self._queue)
+        for index, amount in enumerate(cost):
+            if self._rates[index]:
+                self._levels[index] -= amount
+        waited_ms = (time.monotonic() - started) * 1000.0
+        self.metrics['acquired'] += 1
+        if waited_ms >= 1.0:
+            self.metrics['waited'] += 1
+            self.metrics['wait_ms'] += waited_ms
+        self._cond.notify_all()
+        return waited_ms
+
+    def _leave(self, ticket):
+        self._queue.remove(ticket)
+        heapq.heapify(self._queue)
+        self._cond.notify_all()
+
+    def acquire(self, tokens: int = 0, level: Optional[int] = None) -> float:
+        """Block until the request fits both buckets; returns the time spent waiting in ms"""
+        cost = self._cost(tokens)
+        started = time.monotonic()
+        with self._cond:
+            ticket = (current_priority() if level is None else level, next(self._tickets))
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    if self._queue[0] == ticket:
+                        self._refill()
+                        wait = self._wait_time(cost)
+                        if wait <= 0:
+                            return self._take(cost, started)
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                if ticket in self._queue:
+                    self._leave(ticket)
+                raise
+
+    async def aacquire(self, tokens: int = 0, level: Optional[int] = None, poll: float = 0.01) -> float:
+        """acquire for coroutines; sleeps instead of blocking the event loop"""
+        import asyncio
+
+        cost = self._cost(tokens)
+        started = time.monotonic()
+        with self._cond:
+            ticket = (current_priority() if level is None else level, next(self._tickets))
+            heapq.heappush(self._queue, ticket)
+        try:
+            while True:
+                with self._cond:
+                    if self._queue[0] == ticket:
+                        self._refill()
+                        wait = self._wait_time(cost)
+                        if wait <= 0:
+                            return self._take(cost, started)
+                    else:
+                        wait = poll
+                await asyncio.sleep(wait)
+        except BaseException:
+            with self._cond:
+                if ticket in self._queue:
+                    self._leave(ticket)
+            raise
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        """Refund (or charge) the difference between the estimate and the reported usage"""
+        if actual is None or not self._rates[1]:
+            return
+        with self._cond:
+            self._refill()
+            charged = min(float(estimated), self._capacity[1])
+            self._levels[1] = min(self._capacity[1], self._levels[1] + charged - actual)
+            self._cond.notify_all()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            self._refill()
+            return {**self.metrics, 'queued': len(self._queue),
+                    'requests_available': round(self._levels[0], 2), 'tokens_available': round(self._levels[1], 2)}
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _setting(prefix: str, name: str, default: str) -> str:
+    return os.getenv(f"{prefix}_{name}") or os.getenv(f"ROUTING_{name}") or default
+
+
+def shared_limiter(deployment: str, prefix: str = "ROUTING") -> Optional[RateLimiter]:
+    """Process-wide limiter for one Azure deployment; None when no quota is set.
+
+    Azure enforces RPM/TPM per deployment, so every call site on the same
+    deployment gets the same buckets whatever its prefix. The quota comes
+    from <prefix>_LLM_RPM / <prefix>_LLM_TPM, falling back to the ROUTING_
+    settings; the first call site to create a deployment's limiter sets it.
+    """
+    rpm = float(_setting(prefix, "LLM_RPM", "0"))
+    tpm = float(_setting(prefix, "LLM_TPM", "0"))
+    headroom = float(_setting(prefix, "LLM_RATE_HEADROOM", "0.9"))
+    with _limiters_lock:
+        limiter = _limiters.get(deployment)
+        if limiter is not None:
+            if (rpm or tpm) and (rpm, tpm, headroom) != limiter.quota:
+                logging.getLogger(__name__).warning(
+                    f"{prefix}_LLM_* quota ignored: deployment '{deployment}' already uses {limiter.quota}")
+            return limiter
+        if not rpm and not tpm:
+            return None
+        limiter = _limiters[deployment] = RateLimiter(rpm, tpm, headroom=headroom)
+        return limiter
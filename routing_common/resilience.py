@@ -0,0 +1,342 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from .rate_limit import RateLimiter, estimate_request_tokens, usage_tokens
+
+# HTTP statuses worth another attempt; other 4xx errors will not change on retry
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker is open; the call was not attempted"""
+    pass
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status of an SDK error (openai>=1 ``status_code``, openai<1 ``http_status``)"""
+    for attribute in ('status_code', 'http_status'):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), if any"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or getattr(error, 'headers', None)
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after-ms')
+        if value is not None:
+            return float(value) / 1000.0
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # Timeouts and connection failures carry no status
+    name = type(error).__name__
+    return isinstance(error, (TimeoutError, ConnectionError)) or 'Timeout' in name or 'Connection' in name
+
+
+def is_unavailable(error: BaseException) -> bool:
+    """Whether a failed LLM call means the service could not answer.
+
+    An open breaker, transport errors, throttling and 5xx responses qualify;
+    a bad request or a bug does not, and a local fallback would only hide it.
+    """
+    return isinstance(error, CircuitOpenError) or is_retryable(error)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter; a server Retry-After wins when present"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.25, max_delay: float = 4.0,
+                 max_retry_after: float = 30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt: int, error: BaseException) -> float:
+        """Wait before attempt ``attempt + 1`` (attempts count from 1)"""
+        requested = retry_after(error)
+        if requested is not None:
+            return min(requested, self.max_retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """Trips on the error rate of recent calls.
+
+    Outcomes from the last ``window_seconds`` are kept; once at least
+    ``min_calls`` are recorded and the failure share reaches
+    ``error_rate`` the breaker opens for ``open_seconds``. After that one
+    probe call is let through (half-open): success closes the breaker,
+    failure opens it again.
+
+    Only failures that say something about the service count (see
+    ``is_retryable``); an attempt that ends otherwise (a 4xx, a bug, a
+    cancellation) is ``release``d so a half-open probe never stays taken.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    # Gauge encoding of the state
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, error_rate: float = 0.5, min_calls: int = 10, window_seconds: float = 30.0,
+                 open_seconds: float = 30.0):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes: "deque[Tuple[float, bool]]" = deque()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.trips = 0
+
+    def _trim(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probing = False
+            # Half-open: a single probe at a time
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, success: bool):
+        now = time.monotonic()
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probing = False
+                if success:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+            self._outcomes.append((now, success))
+            self._trim(now)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if (self._state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.error_rate):
+                self._open(now)
+
+    def release(self):
+        """End an attempt without an outcome; frees the half-open probe slot it may hold"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probing = False
+
+    def _open(self, now: float):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self.trips += 1
+
+
+class Resilient:
+    """Runs LLM calls with per-call timeout, retries and a circuit breaker.
+
+    ``func`` receives the timeout as its ``timeout_arg`` keyword argument so
+    the SDK enforces it on the HTTP request (``timeout`` for openai>=1,
+    ``request_timeout`` for the legacy ``openai.ChatCompletion`` API). Every attempt outcome feeds the
+    breaker; while it is open calls fail fast with CircuitOpenError. With a
+    ``limiter`` every attempt first queues for quota at its estimated token
+    cost.
+    """
+
+    def __init__(self, name: str, timeout: float = 10.0, policy: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 on_event: Optional[Callable[[str, str], None]] = None, timeout_arg: str = 'timeout',
+                 limiter: Optional[RateLimiter] = None):
+        self.name = name
+        self.timeout = timeout
+        self.timeout_arg = timeout_arg
+        self.limiter = limiter
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.on_event = on_event
+        self._lock = threading.Lock()
+        self.metrics = {'calls': 0, 'successes': 0, 'failures': 0, 'retries': 0, 'short_circuits': 0,
+                        'throttled': 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.metrics[name] += 1
+        if self.on_event is not None:
+            self.on_event(self.name, name)
+
+    def _before_attempt(self):
+        if not self.breaker.allow():
+            self._count('short_circuits')
+            raise CircuitOpenError(f"{self.name}: circuit open, call skipped")
+
+    def _admit(self, request: Dict[str, Any]) -> int:
+        """Wait for rate-limit quota; returns the estimated token cost"""
+        tokens = estimate_request_tokens(request)
+        if self.limiter is not None and self.limiter.acquire(tokens) >= 1.0:
+            self._count('throttled')
+        return tokens
+
+    async def _aadmit(self, request: Dict[str, Any]) -> int:
+        tokens = estimate_request_tokens(request)
+        if self.limiter is not None and await self.limiter.aacquire(tokens) >= 1.0:
+            self._count('throttled')
+        return tokens
+
+    def _after_success(self, tokens: int, result: Any):
+        self.breaker.record(True)
+        self._count('successes')
+        if self.limiter is not None:
+            self.limiter.settle(tokens, usage_tokens(result))
+
+    def _after_failure(self, attempt: int, error: BaseException) -> Optional[float]:
+        """Delay before the next attempt, or None when the error should be raised"""
+        retryable = is_retryable(error)
+        # A 4xx or a programming error is not an outage and must not trip the breaker
+        if retryable:
+            self.breaker.record(False)
+        else:
+            self.breaker.release()
+        if attempt >= self.policy.max_attempts or not retryable:
+            self._count('failures')
+            return None
+        self._count('retries')
+        delay = self.policy.delay(attempt, error)
+        logging.getLogger(__name__).warning(
+            f"{self.name}: attempt {attempt} failed ({type(error).__name__}: {error}), retrying in {delay:.2f}s")
+        return delay
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        self._count('calls')
+        attempt = 0
+        while True:
+            attempt += 1
+            self._before_attempt()
+            try:
+                tokens = self._admit(kwargs)
+                result = func(*args, **{self.timeout_arg: self.timeout}, **kwargs)
+            except Exception as e:
+                delay = self._after_failure(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # Interrupted: no outcome to record, but the probe slot must be given back
+                self.breaker.release()
+                raise
+            self._after_success(tokens, result)
+            return result
+
+    async def acall(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        # asyncio is only loaded for async callers
+        import asyncio
+
+        self._count('calls')
+        attempt = 0
+        while True:
+            attempt += 1
+            self._before_attempt()
+            try:
+                tokens = await self._aadmit(kwargs)
+                result = await func(*args, **{self.timeout_arg: self.timeout}, **kwargs)
+            except Exception as e:
+                delay = self._after_failure(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled (asyncio.CancelledError) or interrupted: give the probe slot back
+                self.breaker.release()
+                raise
+            self._after_success(tokens, result)
+            return result
+
+    def stream(self, func: Callable[..., Any], *args, **kwargs) -> Iterator[Any]:
+        """Iterate the response ``func`` streams, guarded until its last item.
+
+        Opening the stream is retried like ``call``. Once an item has reached
+        the caller a failure is raised without a retry, which would repeat
+        what the caller already consumed, but it still counts against the
+        breaker; success is recorded only when the stream is exhausted.
+        """
+        self._count('calls')
+        attempt = 0
+        while True:
+            attempt += 1
+            self._before_attempt()
+            started = False
+            try:
+                tokens = self._admit(kwargs)
+                for item in func(*args, **{self.timeout_arg: self.timeout}, **kwargs):
+                    started = True
+                    yield item
+            except Exception as e:
+                delay = self._after_failure(self.policy.max_attempts if started else attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # Closed early (GeneratorExit) or interrupted: give the probe slot back
+                self.breaker.release()
+                raise
+            self._after_success(tokens, None)
+            return
+
+    @property
+    def state(self) -> str:
+        return self.breaker.state
+
+    def state_value(self) -> int:
+        return CircuitBreaker.STATE_VALUES[self.breaker.state]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {**self.metrics, 'state': self.breaker.state, 'trips': self.breaker.trips,
+                     'timeout_seconds': self.timeout}
+        if self.limiter is not None:
+            stats['rate_limit'] = self.limiter.stats()
+        return stats
@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+SOURCE_REGISTRY_PATH = os.getenv(
+    "SOURCE_REGISTRY_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "sources.yaml"),
+)
+
+# Seconds between checks of the registry file for changes; 0 loads it once
+REGISTRY_CHECK_SECONDS = float(os.getenv("SOURCE_REGISTRY_CHECK_SECONDS", "5"))
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_URL_RE = re.compile(r"(?:https?://|www\.)[^\s<>()\[\]\"'`]+", re.IGNORECASE)
+
+
+def _name_key(text: str) -> Tuple[str, ...]:
+    """Case, punctuation and spacing insensitive key for names and aliases"""
+    return tuple(_WORD_RE.findall(text.casefold()))
+
+
+def _term(word: str) -> str:
+    """Crude word stem: lower case, trailing plural -s dropped"""
+    return word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word
+
+
+def _url_key(url: str) -> str:
+    key = url.strip().lower().rstrip('.,;:!?/')
+    key = re.sub(r"^https?://", "", key)
+    return key[4:] if key.startswith("www.") else key
+
+
+class SourceRegistry:
+    """Data sources with precomputed name, alias and URL indexes.
+
+    ``match`` maps a free-text LLM answer to a source without scanning the
+    source list: URLs in the answer are looked up first, then word windows of
+    the answer against the name/alias index, longest window first.
+    """
+
+    def __init__(self, sources: List[Dict[str, Any]]):
+        self.sources = [dict(source) for source in sources]
+        self.version = 1
+        self._by_name: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self._by_url: Dict[str, Dict[str, Any]] = {}
+        hosts: Dict[str, List[Dict[str, Any]]] = {}
+
+        for source in self.sources:
+            for label in [source['name'], *source.get('aliases', [])]:
+                key = _name_key(label)
+                if not key:
+                    continue
+                owner = self._by_name.setdefault(key, source)
+                if owner is not source:
+                    raise ValueError(f"'{label}' is used by both '{owner['name']}' and '{source['name']}'")
+            url = _url_key(source['url'])
+            self._by_url[url] = source
+            hosts.setdefault(url.split('/', 1)[0], []).append(source)
+
+        # A bare host identifies a source only when no other source shares it
+        for host, owners in hosts.items():
+            if len(owners) == 1:
+                self._by_url.setdefault(host, owners[0])
+
+        self._max_words = max((len(key) for key in self._by_name), default=0)
+
+        # Term index for guess: name/alias words outweigh description words,
+        # and words shared by many sources count for little
+        weights: Dict[str, Dict[int, float]] = {}
+        for index, source in enumerate(self.sources):
+            fields = ((2.0, [source['name'], *source.get('aliases', [])]), (1.0, [source.get('description', '')]))
+            for weight, texts in fields:
+                for text in texts:
+                    for word in _name_key(text):
+                        if len(word) > 2:
+                            per_source = weights.setdefault(_term(word), {})
+                            per_source[index] = max(per_source.get(index, 0.0), weight)
+        self._terms = {
+            term: {index: weight / len(per_source) for index, weight in per_source.items()}
+            for term, per_source in weights.items()
+        }
+        self.prompt_entries: Tuple[Tuple[str, str], ...] = tuple(
+            (source['name'], source['description']) for source in self.sources
+        )
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.sources)
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def names(self) -> List[str]:
+        return [source['name'] for source in self.sources]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Exact lookup by name, alias or URL"""
+        return self._by_name.get(_name_key(key)) or self._lookup_url(key)
+
+    def _lookup_url(self, url: str) -> Optional[Dict[str, Any]]:
+        key = _url_key(url)
+        while key:
+            source = self._by_url.get(key)
+            if source is not None:
+                return source
+            if '/' not in key:
+                return None
+            key = key.rsplit('/', 1)[0]
+        return None
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        """Source named in an LLM answer, or None"""
+        if not text:
+            return None
+        source = self.get(text)
+        if source is not None:
+            return source
+        for url in _URL_RE.findall(text):
+            source = self._lookup_url(url)
+            if source is not None:
+                return source
+        words = _name_key(text)
+        for start in range(len(words)):
+            for size in range(min(self._max_words, len(words) - start), 0, -1):
+                source = self._by_name.get(words[start:start + size])
+                if source is not None:
+                    return source
+        return None
+
+    def match_all(self, text: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Sources named line by line in an LLM answer, in order of first mention, without repeats"""
+        found: List[Dict[str, Any]] = []
+        for line in (text or '').splitlines():
+            source = self.match(line)
+            if source is not None and all(source is not seen for seen in found):
+                found.append(source)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def guess(self, query: str) -> Optional[Dict[str, Any]]:
+        """Source inferred from the query itself, for when the LLM is unreachable.
+
+        Query words are compared with name, alias and description words;
+        None when no word overlaps.
+        """
+        scores: Dict[int, float] = {}
+        for term in {_term(word) for word in _name_key(query or '')}:
+            for index, weight in self._terms.get(term, {}).items():
+                scores[index] = scores.get(index, 0.0) + weight
+        if not scores:
+            return None
+        return self.sources[max(scores, key=scores.__getitem__)]
+
+
+def load_registry(path: Optional[str] = None) -> SourceRegistry:
+    """Read a registry from a YAML or JSON file with a top-level ``sources`` list"""
+    path = path or SOURCE_REGISTRY_PATH
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.json'):
+            data = json.load(f)
+        else:
+            import yaml
+            data = yaml.safe_load(f)
+    return SourceRegistry(data['sources'] if isinstance(data, dict) else data)
+
+
+_registry: Optional[SourceRegistry] = None
+_signature: Optional[Tuple[int, int, int]] = None
+_checked = 0.0
+_lock = threading.RLock()
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def reload_registry(path: Optional[str] = None) -> SourceRegistry:
+    """Load the registry file now and swap it in; raises, keeping the current registry, when the file is invalid"""
+    global _registry, _signature, _checked
+    path = path or SOURCE_REGISTRY_PATH
+    with _lock:
+        signature = _file_signature(path)
+        registry = load_registry(path)
+        if _registry is not None:
+            registry.version = _registry.version + 1
+        _registry, _signature, _checked = registry, signature, time.monotonic()
+    return registry
+
+
+def get_registry() -> SourceRegistry:
+    """Process-wide registry loaded from SOURCE_REGISTRY_PATH.
+
+    The file is checked for changes at most every REGISTRY_CHECK_SECONDS;
+    an edited file is loaded and swapped in whole with the next ``version``,
+    an invalid one is logged and the current registry stays in use. Callers
+    holding a registry keep a consistent, possibly older, version.
+    """
+    global _signature, _checked
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                reload_registry()
+    elif (REGISTRY_CHECK_SECONDS > 0 and time.monotonic() - _checked >= REGISTRY_CHECK_SECONDS
+          and _lock.acquire(blocking=False)):
+        # One caller re-checks the file, the others keep using the current registry
+        try:
+            _checked = time.monotonic()
+            signature = _file_signature(SOURCE_REGISTRY_PATH)
+            if signature is not None and signature != _signature:
+                try:
+                    reload_registry()
+                except Exception as e:
+                    _signature = signature
+                    logging.getLogger(__name__).warning(
+                        f"Source registry {SOURCE_REGISTRY_PATH} not reloaded: {type(e).__name__}: {e}")
+        finally:
+            _lock.release()
+    return _registry
@@ -0,0 +1,273 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple
+
+# Upper bounds in milliseconds, Prometheus style; the last bucket is +Inf
+DEFAULT_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+_current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("current_span", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram with sum and count"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return float(bound)
+        return float('inf')
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'sum_ms': round(self.total, 3),
+            'mean_ms': round(self.total / self.count, 3) if self.count else 0.0,
+            'p50_ms': self.quantile(0.50),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+        }
+
+
+class Span:
+    """One timed stage; attributes (tokens, cache outcome, ...) are exported with it"""
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(8).hex()
+        self.span_id = os.urandom(4).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def mark(self, name: str):
+        """Record the time since the span started under ``<name>_ms`` (e.g. ttft)"""
+        self.attributes[f"{name}_ms"] = round((time.perf_counter() - self._started) * 1000.0, 3)
+
+    def finish(self):
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self._started) * 1000.0
+            self.tracer._record(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration_ms': round(self.duration_ms or 0.0, 3),
+        }
+        if self.attributes:
+            record['attributes'] = self.attributes
+        if self.error:
+            record['error'] = self.error
+        return record
+
+
+class Tracer:
+    """Per-stage timings and counters.
+
+    Every finished span updates an in-process duration histogram keyed by
+    span name, adds its numeric ``*_tokens`` attributes to counters, counts
+    ``cache`` outcomes, and is appended to a JSONL file when ``path`` is set.
+    """
+
+    def __init__(self, path: Optional[str] = None, buckets: Tuple[float, ...] = DEFAULT_BUCKETS_MS):
+        self.path = path
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._file = None
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[Tuple[str, str], float] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        current = Span(self, name, _current_span.get(), attributes)
+        token = _current_span.set(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            current.finish()
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """Span that is finished explicitly, for stages that do not fit a with block"""
+        return Span(self, name, _current_span.get(), attributes)
+
+    def observe(self, name: str, duration_ms: float):
+        with self._lock:
+            self._observe(name, duration_ms)
+
+    def _observe(self, name: str, duration_ms: float):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram(self.buckets)
+        histogram.observe(duration_ms)
+
+    def count(self, name: str, label: str = '', value: float = 1):
+        """Add to a counter outside any span (e.g. agent steps)"""
+        with self._lock:
+            self._count(name, label, value)
+
+    def _count(self, name: str, label: str, value: float):
+        self._counters[(name, label)] = self._counters.get((name, label), 0) + value
+
+    def gauge(self, name: str, func: Callable[[], float]):
+        """Point-in-time value (e.g. circuit breaker state); ``func`` is called at export time"""
+        with self._lock:
+            previous = self._gauges.get(name)
+            self._gauges[name] = func
+        if previous is not None and previous != func:
+            logging.getLogger(__name__).warning(f"Gauge {name} registered twice; the earlier one is replaced")
+
+    def _record(self, span: Span):
+        with self._lock:
+            self._observe(span.name, span.duration_ms)
+            for key, value in span.attributes.items():
+                if key.endswith('_ms') and isinstance(value, (int, float)):
+                    self._observe(f"{span.name}.{key[:-3]}", value)
+                elif key.endswith('_tokens') and isinstance(value, (int, float)):
+                    self._count(f"{span.name}.{key}", '', value)
+            if 'cache' in span.attributes:
+                self._count(f"{span.name}.cache", str(span.attributes['cache']), 1)
+            if self.path:
+                try:
+                    if self._file is None:
+                        self._file = open(self.path, 'a', encoding='utf-8')
+                    self._file.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+                    self._file.flush()
+                except OSError as e:
+                    logging.getLogger(__name__).warning(f"Trace export failed: {e}")
+
+    def histograms(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: histogram.snapshot() for name, histogram in sorted(self._histograms.items())}
+
+    def counters(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            result: Dict[str, Dict[str, float]] = {}
+            for (name, label), value in sorted(self._counters.items()):
+                result.setdefault(name, {})[label or 'total'] = value
+            return result
+
+    def gauges(self) -> Dict[str, float]:
+        with self._lock:
+            gauges = sorted(self._gauges.items())
+        return {name: func() for name, func in gauges}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def prometheus_text(self, prefix: str = "routing") -> str:
+        """Histograms and counters in the Prometheus text exposition format"""
+        lines: List[str] = []
+        with self._lock:
+            for name, histogram in sorted(self._histograms.items()):
+                metric = f"{prefix}_{_metric_name(name)}_ms"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.total:.3f}")
+                lines.append(f"{metric}_count {histogram.count}")
+            typed = set()
+            for (name, label), value in sorted(self._counters.items()):
+                metric = f"{prefix}_{_metric_name(name)}_total"
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} counter")
+                labels = f'{{outcome="{label}"}}' if label else ""
+                lines.append(f"{metric}{labels} {value:g}")
+        for name, value in self.gauges().items():
+            metric = f"{prefix}_{_metric_name(name)}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _metric_name(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_metrics_server(tracer: Tracer, host: str = "127.0.0.1", port: int = 9464,
+                         prefix: str = "routing") -> "ThreadingHTTPServer":
+    """Serve GET /metrics (Prometheus text) and GET /metrics.json on a daemon thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body = json.dumps({'histograms': tracer.histograms(), 'counters': tracer.counters(),
+                                   'gauges': tracer.gauges()}).encode("utf-8")
+                content_type = "application/json"
+            elif self.path.startswith("/metrics"):
+                body = tracer.prometheus_text(prefix).encode("utf-8")
+                content_type = "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+# Process-wide tracer; ROUTING_TRACE_PATH turns on the JSONL export
+tracer = Tracer(os.getenv("ROUTING_TRACE_PATH"))
@@ -0,0 +1,148 @@
+import json
+import os
+from functools import cached_property
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+
+from keyword_router import KeywordRouter, tokenize
+
+RULES_PATH = os.getenv(
+    "ROUTING_RULES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"),
+)
+
+# Text the keyword router and the rules prompt are built from; default_table
+# only decides which table a matched rule answers with
+MATCHING_FIELDS = ('keywords', 'description', 'example_queries')
+REQUIRED_FIELDS = ('default_table',) + MATCHING_FIELDS
+
+# Earlier rule versions RuleSet.changes_since remembers; an index built from
+# an older one is no longer trusted, so rebuild it at least this often
+TRACKED_VERSIONS = int(os.getenv("ROUTING_RULES_TRACKED_VERSIONS", "16"))
+
+
+def load_rules(path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Read rules from a JSON or YAML file mapping rule names to their fields"""
+    path = path or RULES_PATH
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.json'):
+            data = json.load(f)
+        else:
+            import yaml
+            data = yaml.safe_load(f)
+    if isinstance(data, dict) and isinstance(data.get('rules'), dict):
+        data = data['rules']
+    if not isinstance(data, dict) or not data:
+        raise ValueError(f"{path}: expected a mapping of rule names to rules")
+    for rule_name, rule_details in data.items():
+        missing = [field for field in REQUIRED_FIELDS if field not in (rule_details or {})]
+        if missing:
+            raise ValueError(f"{path}: rule '{rule_name}' has no {', '.join(missing)}")
+    return data
+
+
+def build_rules_prompt_prefix(rules: Dict[str, Dict[str, Any]]) -> str:
+    parts = ["Match the query to the most appropriate rule based on the rule descriptions below:\n\nRules and Descriptions:\n"]
+    for rule_name, rule_details in rules.items():
+        parts.append(f"\nRule: {rule_name}\n")
+        parts.append(f"Description: {rule_details['description']}\n")
+        parts.append(f"Keywords: {', '.join(rule_details['keywords'])}\n")
+        parts.append("Example Queries:\n")
+        for example in rule_details['example_queries']:
+            parts.append(f"- {example}\n")
+    return "".join(parts)
+
+
+def _matching_text(rule_details: Optional[Dict[str, Any]]) -> Optional[tuple]:
+    if rule_details is None:
+        return None
+    return tuple(json.dumps(rule_details.get(field), sort_keys=True) for field in MATCHING_FIELDS)
+
+
+def _terms(rule_details: Dict[str, Any]) -> FrozenSet[str]:
+    texts = [rule_details['description'], *rule_details['keywords'], *rule_details['example_queries']]
+    return frozenset(token for text in texts for token in tokenize(text))
+
+
+class RuleSet:
+    """One version of the routing rules and the keyword router compiled from them.
+
+    Built from the previous version it reuses that router when no rule's
+    matching text (keywords, description, examples) or the rule order
+    changed, e.g. when only a ``default_table`` moved; ``matching_changed``
+    tells whether the rules prompt has to be rebuilt too. ``changed`` holds
+    the rules added, edited or removed against the previous version and
+    ``new_terms`` the words an added or edited rule gained. ``affects``
+    decides from those whether an answer cached under the previous version
+    may now route differently.
+
+    ``changes_since`` carries, for the last ``TRACKED_VERSIONS`` earlier
+    versions in this process's reload chain (keyed by ``fingerprint``), the
+    tables and new terms of the rules changed since; ``affects_indexed`` uses
+    it to tell which answers of an index built from such a version still hold.
+    """
+
+    def __init__(self, rules: Dict[str, Dict[str, Any]], version: int = 1, previous: Optional["RuleSet"] = None,
+                 min_score: float = 1.0, min_margin: float = 0.5):
+        self.rules = rules
+        self.version = version
+        self.tables = frozenset(rule_details['default_table'] for rule_details in rules.values())
+        old = previous.rules if previous is not None else {}
+        self.changed = frozenset(name for name in {*rules, *old} if rules.get(name) != old.get(name))
+        self.added = frozenset(name for name in rules if name not in old)
+        self.new_terms = frozenset(
+            term
+            for name in self.changed if name in rules
+            for term in _terms(rules[name]) - (_terms(old[name]) if name in old else frozenset())
+        )
+        self.matching_changed = previous is None or list(rules) != list(old) or any(
+            _matching_text(rules.get(name)) != _matching_text(old.get(name)) for name in self.changed)
+        if self.matching_changed:
+            self.keyword_router = KeywordRouter(rules, min_score, min_margin)
+        else:
+            self.keyword_router = previous.keyword_router
+        self.changes_since: Dict[int, Tuple[FrozenSet[str], FrozenSet[str]]] = {}
+        if previous is not None and TRACKED_VERSIONS > 0:
+            touched = frozenset(
+                source[name]['default_table'] for name in self.changed for source in (rules, old) if name in source)
+            # Oldest first; a version the rules return to moves to the end
+            earlier = [item for item in previous.changes_since.items() if item[0] != previous.fingerprint]
+            for fingerprint, (tables, terms) in earlier[max(0, len(earlier) - TRACKED_VERSIONS + 1):]:
+                self.changes_since[fingerprint] = (tables | touched, terms | self.new_terms)
+            self.changes_since[previous.fingerprint] = (touched, self.new_terms)
+
+    @cached_property
+    def fingerprint(self) -> int:
+        """Content hash of the rules, identifying this version across processes"""
+        # hashlib loads OpenSSL; only computed once an index or a reload needs it
+        from hashlib import blake2b
+        text = json.dumps(self.rules, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        return int.from_bytes(blake2b(text, digest_size=8).digest(), 'little')
+
+    def affects(self, query: str, value: Dict[str, Any]) -> bool:
+        """Whether a cached answer for ``query`` (rule details or a ranking) may route differently now"""
+        if 'rankings' in value:
+            if any(rule_name in self.changed for rule_name, _ in value['rankings']):
+                return True
+        elif 'keywords' in value:
+            # Rule details cached from an edited or removed rule no longer match any rule
+            if value not in self.rules.values():
+                return True
+        elif self.added:
+            # "Unknown Source": a new rule may cover the query now
+            return True
+        return not self.new_terms.isdisjoint(tokenize(query))
+
+    def affects_indexed(self, fingerprint: int, query: str, table: str) -> bool:
+        """Whether ``table``, indexed for ``query`` under the rules ``fingerprint``, may be wrong now.
+
+        Answers from these very rules hold. For an earlier version in the
+        reload chain, answers naming a table of a changed rule, or queries
+        sharing a word a changed rule gained, are suspect; an index built
+        from rules this process never loaded is not trusted at all.
+        """
+        if fingerprint == self.fingerprint:
+            return False
+        if fingerprint not in self.changes_since:
+            return True
+        tables, terms = self.changes_since[fingerprint]
+        return table in tables or table not in self.tables or not terms.isdisjoint(tokenize(query))
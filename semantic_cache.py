@@ -0,0 +1,282 @@
+import math
+import re
+import threading
+import zlib
+from array import array
+from typing import Callable, List, Dict, Any, Optional, Sequence, Tuple
+
+from cache import normalize_query
+from keyword_router import STOPWORDS, stem
+
+Embedder = Callable[[str], Sequence[float]]
+
+# Without NumPy vectors are kept sparse; this caps their memory and insert cost
+PURE_PYTHON_MAX_ENTRIES = 5000
+
+_numpy_module = None
+_numpy_checked = False
+
+
+def _numpy():
+    """NumPy, imported on first use; None selects the pure Python path"""
+    # Importing NumPy costs more than the rest of the router; processes that
+    # never cache a query should not pay for it
+    global _numpy_module, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_module, _numpy_checked = numpy, True
+    return _numpy_module
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+# Function words the keyword router can live with but a paraphrase check cannot
+_EXTRA_STOPWORDS = frozenset({'be', 'been', 'did', 'do', 'had', 'has', 'have', 'much', 'were'})
+# Inflections folded away after plural stripping: 'exported' -> 'export', 'percentage' -> 'percent'
+_SUFFIXES = ('ing', 'ed', 'age')
+
+
+def query_terms(text: str) -> List[str]:
+    """Content words of a query, lightly stemmed; numbers (years, quantities) are kept verbatim"""
+    terms = []
+    for token in _TOKEN_RE.findall(normalize_query(text.replace('%', ' percent '))):
+        if token in STOPWORDS or token in _EXTRA_STOPWORDS:
+            continue
+        if not token.isdigit():
+            token = stem(token)
+            for suffix in _SUFFIXES:
+                if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+                    token = token[:-len(suffix)]
+                    break
+        terms.append(token)
+    return terms
+
+
+class HashingEmbedder:
+    """Network-free embedder: stemmed words plus their character n-grams.
+
+    Each feature is hashed into one of ``dim`` buckets with a hash-derived
+    sign, and the result is L2-normalized so a dot product is the cosine.
+    N-grams stay inside a word, so word order does not change the vector
+    ("weekly corn exports %" and "percentage of corn exported weekly" are
+    the same query). Numbers are one heavy feature each without n-grams: a
+    different year is a different question.
+    """
+
+    def __init__(self, dim: int = 512, ngram_range: Tuple[int, int] = (3, 5), word_weight: float = 2.0,
+                 number_weight: float = 4.0):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.word_weight = word_weight
+        self.number_weight = number_weight
+
+    def _add(self, vector: List[float], feature: str, weight: float):
+        h = zlib.crc32(feature.encode('utf-8'))
+        vector[h % self.dim] += weight if h & 0x80000000 else -weight
+
+    def __call__(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        low, high = self.ngram_range
+        for term in query_terms(text):
+            if term.isdigit():
+                self._add(vector, 'n:' + term, self.number_weight)
+                continue
+            self._add(vector, 'w:' + term, self.word_weight)
+            padded = f" {term} "
+            for n in range(low, high + 1):
+                for i in range(len(padded) - n + 1):
+                    self._add(vector, padded[i:i + n], 1.0)
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of answered queries.
+
+    A lookup does not scan every entry. An inverted index from query terms
+    to slots yields at most ``max_candidates`` candidates, taking the rarest
+    terms and the newest entries first. Only those candidates are scored.
+    A near-duplicate close enough to clear the threshold shares the query's
+    content words, so it is among them. Scoring runs outside the lock.
+    With NumPy the vectors live in one preallocated float32 matrix. Without
+    it they are stored sparse and capacity is capped at
+    PURE_PYTHON_MAX_ENTRIES. Once ``max_entries`` is reached the oldest slot
+    is overwritten.
+    """
+
+    def __init__(self, embedder: Optional[Embedder] = None, threshold: float = 0.9, max_entries: int = 100000,
+                 max_candidates: int = 128):
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self._max_entries = max_entries
+        self.max_candidates = max_candidates
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._values: List[Optional[Dict[str, Any]]] = []
+        self._keys: Dict[str, int] = {}
+        self._slot_keys: List[str] = []
+        self._slot_terms: List[Tuple[str, ...]] = []
+        # term -> slots holding it, oldest first (a dict as an ordered set)
+        self._postings: Dict[str, Dict[int, None]] = {}
+        self._next = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_entries(self) -> int:
+        if _numpy() is None:
+            return min(self._max_entries, PURE_PYTHON_MAX_ENTRIES)
+        return self._max_entries
+
+    def _embed(self, query: str):
+        vector = self.embedder(query)
+        np = _numpy()
+        if np is None:
+            vector = list(vector)
+            norm = math.sqrt(sum(v * v for v in vector))
+            return [v / norm for v in vector] if norm else vector
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _sparse(vector: List[float]) -> Tuple[array, array]:
+        indexes = array('I', (i for i, v in enumerate(vector) if v))
+        return indexes, array('f', (vector[i] for i in indexes))
+
+    def _ensure_capacity(self, dim: int):
+        np = _numpy()
+        if np is None:
+            if self._matrix is None:
+                self._matrix = []
+            return
+        if self._matrix is None:
+            self._matrix = np.zeros((min(1024, self.max_entries), dim), dtype=np.float32)
+        elif self._next >= len(self._matrix) and len(self._matrix) < self.max_entries:
+            grown = np.zeros((min(len(self._matrix) * 2, self.max_entries), dim), dtype=np.float32)
+            grown[:len(self._matrix)] = self._matrix
+            self._matrix = grown
+
+    def _index(self, slot: int, terms: Tuple[str, ...]):
+        self._slot_terms[slot] = terms
+        for term in terms:
+            self._postings.setdefault(term, {})[slot] = None
+
+    def _unindex(self, slot: int):
+        for term in self._slot_terms[slot]:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(slot, None)
+                if not posting:
+                    del self._postings[term]
+        self._slot_terms[slot] = ()
+
+    def _candidates(self, terms: List[str]) -> List[int]:
+        if len(self._values) <= self.max_candidates:
+            return [slot for slot, value in enumerate(self._values) if value is not None]
+        found: Dict[int, None] = {}
+        postings = sorted((self._postings[term] for term in set(terms) if term in self._postings), key=len)
+        for posting in postings:
+            for slot in reversed(posting):
+                found[slot] = None
+                if len(found) >= self.max_candidates:
+                    return list(found)
+        return list(found)
+
+    def search(self, query: str) -> Tuple[Optional[Dict[str, Any]], float]:
+        """Best cached value among the candidates and its cosine similarity, regardless of threshold"""
+        terms = query_terms(query)
+        vector = self._embed(query)
+        np = _numpy()
+        with self._lock:
+            slots = self._candidates(terms)
+            if not slots:
+                return None, 0.0
+            values = [self._values[slot] for slot in slots]
+            rows = self._matrix[slots] if np is not None else [self._matrix[slot] for slot in slots]
+        if np is not None:
+            scores = rows @ vector
+            best = int(np.argmax(scores))
+            return values[best], float(scores[best])
+        scores = [sum(vector[i] * v for i, v in zip(*row)) for row in rows]
+        best = max(range(len(scores)), key=scores.__getitem__)
+        return values[best], scores[best]
+
+    def get(self, query: str) -> Optional[Dict[str, Any]]:
+        value, similarity = self.search(query)
+        with self._lock:
+            if value is not None and similarity >= self.threshold:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return None
+
+    def set(self, query: str, value: Dict[str, Any]):
+        key = normalize_query(query)
+        terms = tuple(dict.fromkeys(query_terms(query)))
+        vector = self._embed(query)
+        np = _numpy()
+        row = vector if np is not None else self._sparse(vector)
+        with self._lock:
+            slot = self._keys.get(key)
+            if slot is None:
+                self._ensure_capacity(len(vector))
+                slot = self._next % self.max_entries
+                self._next += 1
+                if slot < len(self._values):
+                    # Ring buffer wrapped: forget the query that owned this slot,
+                    # unless it was invalidated and has been cached again elsewhere
+                    if self._keys.get(self._slot_keys[slot]) == slot:
+                        del self._keys[self._slot_keys[slot]]
+                    self._unindex(slot)
+                    self._slot_keys[slot] = key
+                    self._values[slot] = value
+                else:
+                    self._slot_keys.append(key)
+                    self._slot_terms.append(())
+                    self._values.append(value)
+                self._keys[key] = slot
+                self._index(slot, terms)
+            else:
+                self._values[slot] = value
+            if np is None and slot == len(self._matrix):
+                self._matrix.append(row)
+            else:
+                self._matrix[slot] = row
+
+    def invalidate(self, predicate: Callable[[str, Dict[str, Any]], bool]) -> int:
+        """Forget the entries whose (normalized query, value) match ``predicate``; returns how many.
+
+        The slot keeps its place in the ring but leaves the term index and
+        gets a zero vector, so it can never be the nearest neighbour of a
+        real query.
+        """
+        np = _numpy()
+        with self._lock:
+            doomed = [(key, slot) for key, slot in self._keys.items() if predicate(key, self._values[slot])]
+            for key, slot in doomed:
+                del self._keys[key]
+                self._values[slot] = None
+                self._unindex(slot)
+                if np is None:
+                    self._matrix[slot] = (array('I'), array('f'))
+                else:
+                    self._matrix[slot] = 0.0
+        return len(doomed)
+
+    def clear(self):
+        with self._lock:
+            self._matrix = None
+            self._values = []
+            self._keys = {}
+            self._slot_keys = []
+            self._slot_terms = []
+            self._postings = {}
+            self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,15 @@
+from setuptools import setup
+
+# The modules shared by the router and both crews: source registry, rate
+# limiter, resilience and tracing. The router runs from this checkout; the
+# crew packages install it as the routing-common dependency.
+setup(
+    name="routing-common",
+    version="0.1.0",
+    packages=["routing_common"],
+    package_data={"routing_common": ["sources.yaml"]},
+    python_requires=">=3.10",
+    install_requires=[
+        "pyyaml>=6.0.1",
+    ],
+)
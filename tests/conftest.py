@@ -0,0 +1,22 @@
+import importlib.util
+import sys
+import types
+from dataclasses import dataclass
+
+# main reads its Azure settings from a deployment-specific ``config`` module
+# that is not part of the repository; tests run against a stand-in whose
+# endpoint refuses connections, so nothing reaches a real deployment
+if importlib.util.find_spec("config") is None:
+    @dataclass
+    class OpenAIConfig:
+        endpoint: str
+        deployment: str
+        subscription_key: str
+        api_version: str = ""
+        location: str = ""
+
+    config = types.ModuleType("config")
+    config.OpenAIConfig = OpenAIConfig
+    config.openai_config = OpenAIConfig(endpoint="http://127.0.0.1:9", deployment="test-deployment",
+                                        subscription_key="test-key", api_version="2024-02-15-preview")
+    sys.modules["config"] = config
@@ -0,0 +1,154 @@
+import copy
+import os
+
+import pytest
+
+from answer_index import AnswerIndex, AnswerLog, collect_answers, write_index
+from rule_config import RuleSet
+
+RULES = {
+    'price_rules': {
+        'keywords': ['price', 'cost'],
+        'default_table': 'Fast Markets',
+        'description': 'Price information and market pricing.',
+        'example_queries': ['Corn price list for this month'],
+    },
+    'trade_rules': {
+        'keywords': ['export', 'import'],
+        'default_table': 'GTT',
+        'description': 'Trade flows between countries.',
+        'example_queries': ['Weekly corn exports to Mexico', 'Soybean imports of China'],
+    },
+    'production_rules': {
+        'keywords': ['production', 'yield'],
+        'default_table': 'PSD',
+        'description': 'Production and supply estimates.',
+        'example_queries': ['Brazil soybean production forecast'],
+    },
+}
+
+
+def test_lookup_normalizes_queries(tmp_path):
+    path = str(tmp_path / "index.bin")
+    write_index(collect_answers(RULES), path, version=7, rules_fingerprint=42)
+    index = AnswerIndex(path)
+    assert index.lookup("  weekly CORN exports to mexico ") == "GTT"
+    assert index.lookup("Brazil soybean production forecast") == "PSD"
+    assert index.lookup("unknown query") is None
+    assert index.lookup_entry("Corn price list for this month") == ("Fast Markets", 42)
+    assert index.version == 7
+
+
+def test_many_entries_survive_probing(tmp_path):
+    path = str(tmp_path / "index.bin")
+    answers = {f"query {number}": f"table {number % 13}" for number in range(5000)}
+    write_index(answers, path)
+    index = AnswerIndex(path)
+    assert all(index.lookup(key) == table for key, table in answers.items())
+    assert index.stats()['entries'] == 5000
+
+
+def test_missing_or_foreign_file_means_no_index(tmp_path):
+    assert AnswerIndex(str(tmp_path / "missing.bin")).lookup("q") is None
+    path = tmp_path / "foreign.bin"
+    path.write_bytes(b"not an index" * 10)
+    assert AnswerIndex(str(path)).lookup("q") is None
+
+
+def test_rebuilt_file_is_swapped_in(tmp_path):
+    path = str(tmp_path / "index.bin")
+    write_index({'q': 'GTT'}, path, version=1)
+    index = AnswerIndex(path, check_seconds=3600)
+    assert index.lookup("q") == "GTT"
+    write_index({'q': 'PSD'}, path, version=2)
+    index.reload()
+    assert index.lookup("q") == "PSD"
+    assert index.version == 2
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_logged_answers_need_min_count_and_examples_win(tmp_path):
+    log = AnswerLog(str(tmp_path / "answers.jsonl"))
+    for table in ("PSD", "PSD", "GTT"):
+        log.record("Rice stocks in India", table)
+    log.record("Once only", "GTT")
+    log.record("Weekly corn exports to Mexico", "PSD")
+    log.close()
+    answers = collect_answers(RULES, [log.path], min_count=2)
+    assert answers["rice stocks in india"] == "PSD"
+    assert "once only" not in answers
+    assert answers["weekly corn exports to mexico"] == "GTT"
+
+
+def moved_example():
+    # The example moves from trade_rules to production_rules; both tables still exist
+    rules = copy.deepcopy(RULES)
+    rules['trade_rules']['example_queries'].remove('Soybean imports of China')
+    rules['production_rules']['example_queries'].append('Soybean imports of China')
+    return rules
+
+
+def test_index_from_the_current_rules_is_trusted():
+    routing = RuleSet(RULES)
+    assert not routing.affects_indexed(routing.fingerprint, "soybean imports of china", "GTT")
+
+
+def test_reload_marks_answers_of_changed_rules_stale():
+    previous = RuleSet(RULES)
+    routing = RuleSet(moved_example(), 2, previous=previous)
+    assert routing.affects_indexed(previous.fingerprint, "soybean imports of china", "GTT")
+    assert not routing.affects_indexed(previous.fingerprint, "corn price list for this month", "Fast Markets")
+
+
+def test_staleness_accumulates_over_reloads():
+    first = RuleSet(RULES)
+    second = RuleSet(moved_example(), 2, previous=first)
+    third_rules = copy.deepcopy(second.rules)
+    third_rules['price_rules']['keywords'].append('premium')
+    third = RuleSet(third_rules, 3, previous=second)
+    assert third.affects_indexed(first.fingerprint, "soybean imports of china", "GTT")
+    assert not third.affects_indexed(second.fingerprint, "soybean imports of china", "PSD")
+    assert third.affects_indexed(second.fingerprint, "corn price list for this month", "Fast Markets")
+
+
+def test_index_from_unknown_rules_is_not_trusted():
+    routing = RuleSet(moved_example())
+    assert routing.affects_indexed(RuleSet(RULES).fingerprint, "corn price list for this month", "Fast Markets")
+    assert routing.affects_indexed(0, "corn price list for this month", "Fast Markets")
+
+
+def test_build_needs_only_the_rules_file(tmp_path, monkeypatch, capsys):
+    import json
+    import sys
+
+    import answer_index
+
+    # Importing main would need the deployment settings; the build must not
+    monkeypatch.setitem(sys.modules, "main", None)
+    rules_path, index_path = str(tmp_path / "rules.json"), str(tmp_path / "index.bin")
+    with open(rules_path, "w", encoding="utf-8") as f:
+        json.dump(RULES, f)
+    answer_index.main(["build", "--rules", rules_path, "--out", index_path])
+    assert json.loads(capsys.readouterr().out)['entries'] == 4
+    assert AnswerIndex(index_path).lookup_entry("weekly corn exports to mexico") == ("GTT", RuleSet(RULES).fingerprint)
+
+
+def test_change_log_keeps_only_the_recent_versions(monkeypatch):
+    import rule_config
+
+    monkeypatch.setattr(rule_config, "TRACKED_VERSIONS", 3)
+    versions = [RuleSet(RULES)]
+    for number in range(5):
+        rules = copy.deepcopy(versions[-1].rules)
+        rules['price_rules']['keywords'].append(f'term{number}')
+        versions.append(RuleSet(rules, number + 2, previous=versions[-1]))
+    current = versions[-1]
+    assert list(current.changes_since) == [version.fingerprint for version in versions[-4:-1]]
+    assert current.affects_indexed(versions[0].fingerprint, "soybean imports of china", "GTT")
+    assert not current.affects_indexed(versions[-2].fingerprint, "soybean imports of china", "GTT")
+
+    # Rules that return to an earlier version count as the newest one
+    reverted = RuleSet(copy.deepcopy(versions[-3].rules), 7, previous=current)
+    following = RuleSet(copy.deepcopy(RULES), 8, previous=reverted)
+    assert list(following.changes_since) == [versions[-2].fingerprint, current.fingerprint,
+                                              versions[-3].fingerprint]
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import pytest
+
+import azureAIsystem
+from routing_common.resilience import CircuitBreaker, Resilient, RetryPolicy
+
+
+def client(create):
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def reply(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+@pytest.fixture
+def selector(monkeypatch):
+    guard = Resilient("test", policy=RetryPolicy(max_attempts=1), breaker=CircuitBreaker(min_calls=100))
+    monkeypatch.setattr(azureAIsystem, "llm_guard", guard)
+    return azureAIsystem.AgricultureSourceSelector()
+
+
+def test_recommendation_comes_from_the_llm(monkeypatch, selector):
+    source = selector.registry.sources[0]
+    monkeypatch.setattr(azureAIsystem, "get_client", lambda: client(lambda **request: reply(source['name'])))
+    assert selector.recommend_source("anything")['name'] == source['name']
+
+
+def test_unreachable_llm_falls_back_to_a_guess(monkeypatch, selector):
+    def create(**request):
+        raise ConnectionError("connection refused")
+
+    monkeypatch.setattr(azureAIsystem, "get_client", lambda: client(create))
+    source = selector.registry.sources[0]
+    assert selector.recommend_source(source['name'])['name'] == source['name']
+
+
+def test_other_errors_are_not_hidden_behind_a_guess(monkeypatch, selector):
+    def create(**request):
+        raise TypeError("unexpected keyword argument 'engine'")
+
+    monkeypatch.setattr(azureAIsystem, "get_client", lambda: client(create))
+    with pytest.raises(TypeError):
+        selector.recommend_source(selector.registry.sources[0]['name'])
+
+
+def test_jsonl_reports_bad_lines_and_keeps_going():
+    import io
+    import json
+
+    class Selector:
+        def recommend_source(self, query):
+            if query == "fail":
+                raise ValueError("no source")
+            return {'name': query.upper(), 'url': ""}
+
+    lines = ['{"id": 1, "query": "fao"}', 'not json', '{"id": 3}', '', '[1]', '{"id": 5, "query": "fail"}',
+             '{"id": 6, "query": "usda"}']
+    out = io.StringIO()
+    azureAIsystem.recommend_sources_jsonl(Selector(), io.StringIO("\n".join(lines) + "\n"), out,
+                                          workers=2, max_in_flight=1)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert sorted(record['line'] for record in records if 'line' in record) == [2, 3, 5]
+    by_id = {record['id']: record for record in records if 'line' not in record}
+    assert by_id[1]['source']['name'] == 'FAO' and by_id[6]['source']['name'] == 'USDA'
+    assert by_id[5] == {'id': 5, 'query': 'fail', 'status': 'error', 'error': 'no source'}
+    assert len(records) == 6
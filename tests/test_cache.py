@@ -0,0 +1,149 @@
+import threading
+
+import pytest
+
+import cache
+from cache import LayeredCache, QueryCache, SQLiteQueryCache, normalize_query
+
+
+class Clock:
+    """Stands in for the ``time`` module so both wall-clock and monotonic time can be advanced"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def layered(tmp_path, clock):
+    return LayeredCache(QueryCache(expiry_minutes=60), SQLiteQueryCache(str(tmp_path / "cache.db"), expiry_minutes=60))
+
+
+def test_normalize_query_folds_case_spacing_and_turkish_i():
+    assert normalize_query("  İthalat   VERİLERİ ") == "ithalat verileri"
+    assert normalize_query("Istanbul") == normalize_query("ıstanbul")
+
+
+def test_query_cache_expires_entries(clock):
+    memory = QueryCache(expiry_minutes=1)
+    memory.set("Wheat prices", {'source': 'FAO'})
+    assert memory.get("wheat  prices") == {'source': 'FAO'}
+    clock.advance(61)
+    assert memory.get("wheat prices") is None
+
+
+def test_query_cache_serves_stale_entries_within_the_window(clock):
+    memory = QueryCache(expiry_minutes=1, stale_minutes=1)
+    memory.set("q", {'source': 'FAO'})
+    clock.advance(90)
+    assert memory.get("q") is None
+    assert memory.get_stale("q") == ({'source': 'FAO'}, False)
+    clock.advance(60)
+    assert memory.get_stale("q") is None
+
+
+def test_query_cache_evicts_least_recently_used():
+    memory = QueryCache(max_entries=2, stripes=1)
+    memory.set("a", {'source': 'A'})
+    memory.set("b", {'source': 'B'})
+    memory.get("a")
+    memory.set("c", {'source': 'C'})
+    assert memory.get("b") is None
+    assert memory.get("a") == {'source': 'A'}
+    assert memory.stats()['evictions'] == 1
+
+
+def test_query_cache_byte_cap_evicts():
+    memory = QueryCache(max_bytes=200, stripes=1)
+    for number in range(10):
+        memory.set(f"query {number}", {'source': 'x' * 40})
+    assert memory.stats()['bytes'] <= 200
+    assert memory.get("query 9") is not None
+    assert memory.get("query 0") is None
+
+
+def test_query_cache_concurrent_writers_stay_within_caps():
+    memory = QueryCache(max_entries=64, stripes=4, sweep_every=8)
+
+    def write(worker):
+        for number in range(500):
+            memory.set(f"{worker} {number}", {'source': worker})
+            memory.get(f"{worker} {number // 2}")
+
+    threads = [threading.Thread(target=write, args=(str(worker),)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(memory) <= 64
+    assert memory.stats()['entries'] == len(memory)
+
+
+def test_query_cache_invalidate_by_predicate():
+    memory = QueryCache()
+    memory.set("a", {'source': 'A'})
+    memory.set("b", {'source': 'B'})
+    assert memory.invalidate(lambda key, value: value['source'] == 'A') == 1
+    assert memory.get("a") is None
+    assert memory.get("b") == {'source': 'B'}
+
+
+def test_sqlite_cache_round_trips_and_expires(tmp_path, clock):
+    persistent = SQLiteQueryCache(str(tmp_path / "cache.db"), expiry_minutes=1)
+    persistent.set("Corn exports", {'source': 'USDA'})
+    assert persistent.get("corn exports") == {'source': 'USDA'}
+    value, fresh, expires_at = persistent.get_entry("corn exports")
+    assert fresh and expires_at == clock.now + 60
+    clock.advance(60)
+    assert persistent.get("corn exports") is None
+
+
+def test_sqlite_warm_start_keeps_the_remaining_ttl(tmp_path, clock):
+    persistent = SQLiteQueryCache(str(tmp_path / "cache.db"), expiry_minutes=60)
+    persistent.set("q", {'source': 'FAO'}, ttl_seconds=10)
+    memory = QueryCache(expiry_minutes=60)
+    assert persistent.warm_start(memory) == 1
+    clock.advance(11)
+    assert memory.get("q") is None
+
+
+def test_layered_get_backfills_with_the_remaining_ttl(layered, clock):
+    # Written by another worker shortly before it expires
+    layered.back.set("q", {'source': 'FAO'}, ttl_seconds=5)
+    assert layered.get("q") == {'source': 'FAO'}
+    assert layered.front.get("q") == {'source': 'FAO'}
+    clock.advance(6)
+    assert layered.front.get("q") is None
+    assert layered.get("q") is None
+
+
+def test_layered_get_stale_backfills_with_the_remaining_ttl(layered, clock):
+    layered.back.set("q", {'source': 'FAO'}, ttl_seconds=5)
+    assert layered.get_stale("q") == ({'source': 'FAO'}, True)
+    clock.advance(6)
+    assert layered.front.get_stale("q") is None
+
+
+def test_layered_get_does_not_backfill_expired_rows(tmp_path, clock):
+    back = SQLiteQueryCache(str(tmp_path / "cache.db"), expiry_minutes=1, stale_minutes=5)
+    layered = LayeredCache(QueryCache(expiry_minutes=60, stale_minutes=5), back)
+    back.set("q", {'source': 'FAO'})
+    clock.advance(90)
+    assert layered.get("q") is None
+    assert layered.get_stale("q") == ({'source': 'FAO'}, False)
+    assert len(layered.front) == 0
@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from ensemble import EnsembleRouter, Voter
+
+
+def fixed(rule, confidence=1.0):
+    return lambda query: (rule, confidence)
+
+
+def test_quorum_returns_without_waiting_for_slow_voters():
+    release = threading.Event()
+
+    def slow(query):
+        release.wait(5)
+        return 'trade_rules', 1.0
+
+    router = EnsembleRouter([Voter('a', fixed('price_rules')), Voter('b', fixed('price_rules')),
+                             Voter('slow', slow)], quorum=0.5)
+    try:
+        result = router.vote("corn price")
+    finally:
+        release.set()
+    assert result.rule == 'price_rules'
+    assert result.quorum_reached
+    assert {vote.voter for vote in result.votes} == {'a', 'b'}
+
+
+def test_plurality_wins_without_quorum_and_failures_abstain():
+    def broken(query):
+        raise TimeoutError("read timed out")
+
+    router = EnsembleRouter([Voter('a', fixed('price_rules', 0.9)), Voter('b', fixed('trade_rules', 0.4)),
+                             Voter('broken', broken)], quorum=0.9)
+    result = router.vote("corn price")
+    assert result.rule == 'price_rules'
+    assert not result.quorum_reached
+    assert result.tally == {'price_rules': 0.9, 'trade_rules': 0.4}
+    assert [vote.error for vote in result.votes if vote.voter == 'broken'] == ["TimeoutError: read timed out"]
+
+
+def test_no_votes_means_unknown_source():
+    result = EnsembleRouter([Voter('a', fixed(None, 0.0))]).vote("hello")
+    assert result.rule is None
+    assert result.rule_details == {"default_table": "Unknown Source"}
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+openai = pytest.importorskip("openai")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from fake_azure import FakeAzure, start_server  # noqa: E402
+
+QUERY = "weekly corn exports"
+
+
+@pytest.fixture
+def client():
+    server = start_server(FakeAzure({'rule': {QUERY: 'export_rules'}, 'source': {QUERY: 'GTT'}}))
+    yield openai.AzureOpenAI(azure_endpoint=f"http://127.0.0.1:{server.server_address[1]}", api_key="fake",
+                             api_version="2024-02-15-preview", max_retries=0)
+    server.shutdown()
+
+
+def ask(prompt):
+    return {'model': 'fake', 'messages': [{'role': 'user', 'content': prompt}], 'temperature': 0}
+
+
+def test_answers_rule_and_source_prompts(client):
+    rule = client.chat.completions.create(**ask(f"Rules...\nQuery: {QUERY}\nPick one."))
+    assert "export_rules" in rule.choices[0].message.content
+    source = client.chat.completions.create(**ask(f"Sources...\nUser query: {QUERY}\nWhich one?"))
+    assert "GTT" in source.choices[0].message.content
+
+
+def test_streams_the_reply_word_by_word(client):
+    chunks = list(client.chat.completions.create(stream=True, **ask(f"Query: {QUERY}\n")))
+    assert chunks[0].choices == []
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices)
+    assert text == "The most appropriate choice is export_rules."
+    assert len([chunk for chunk in chunks if chunk.choices and chunk.choices[0].delta.content]) == 6
+    assert chunks[-1].choices[0].finish_reason == "stop"
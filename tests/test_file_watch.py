@@ -0,0 +1,61 @@
+import os
+
+from file_watch import FileWatcher
+
+
+def touch(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_check_runs_the_callback_once_per_change(tmp_path):
+    path = str(tmp_path / "rules.json")
+    touch(path, "{}")
+    seen = []
+    watcher = FileWatcher()
+    watcher.watch(path, seen.append)
+    assert watcher.check() == []
+    touch(path, '{"a": 1}')
+    assert watcher.check() == [path]
+    assert watcher.check() == []
+    assert seen == [path]
+
+
+def test_replaced_file_counts_as_changed(tmp_path):
+    path = str(tmp_path / "rules.json")
+    touch(path, "{}")
+    watcher = FileWatcher()
+    watcher.watch(path, lambda changed: None)
+    replacement = str(tmp_path / "rules.json.tmp")
+    touch(replacement, "{}")
+    os.replace(replacement, path)
+    assert watcher.check() == [path]
+
+
+def test_missing_file_keeps_the_last_state(tmp_path):
+    path = str(tmp_path / "rules.json")
+    touch(path, "{}")
+    watcher = FileWatcher()
+    watcher.watch(path, lambda changed: None)
+    os.remove(path)
+    assert watcher.check() == []
+
+
+def test_failing_callback_is_logged_and_not_retried_until_the_next_change(tmp_path, caplog):
+    path = str(tmp_path / "rules.json")
+    touch(path, "{}")
+    calls = []
+
+    def reload(changed):
+        calls.append(changed)
+        raise ValueError("invalid rules")
+
+    watcher = FileWatcher()
+    watcher.watch(path, reload)
+    touch(path, "{broken")
+    assert watcher.check() == [path]
+    assert "invalid rules" in caplog.text
+    assert watcher.check() == []
+    touch(path, "{still broken")
+    watcher.check()
+    assert len(calls) == 2
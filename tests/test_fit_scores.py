@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from fit_scores import fit_keyword_confidence, fit_temperature, load_labels, log_loss  # noqa: E402
+from main import calibrate_score  # noqa: E402
+
+
+def test_fitted_temperature_matches_the_observed_accuracy():
+    # Stated 0.9 but right only 70% of the time
+    samples = [(0.9, True)] * 70 + [(0.9, False)] * 30
+    temperature = fit_temperature(samples)
+    assert temperature > 1.0
+    assert calibrate_score(0.9, temperature) == pytest.approx(0.7, abs=0.01)
+    assert log_loss(samples, temperature) < log_loss(samples)
+
+
+def test_underconfident_scores_get_a_temperature_below_one():
+    samples = [(0.6, True)] * 95 + [(0.6, False)] * 5
+    assert fit_temperature(samples) < 1.0
+
+
+def test_keyword_confidence_is_the_top_hit_precision():
+    assert fit_keyword_confidence([True] * 8 + [False] * 2) == 0.8
+    assert fit_keyword_confidence([True] * 5) == 0.99
+    assert fit_keyword_confidence([]) is None
+
+
+def test_load_labels_accepts_one_or_several_rules(tmp_path):
+    path = tmp_path / "labels.jsonl"
+    path.write_text('{"query": "corn price", "rule": "price_rules"}\n'
+                    'not json\n'
+                    '{"query": "corn exports", "rules": ["export_rules", "trade_rules"]}\n'
+                    '{"query": "no label"}\n')
+    assert load_labels(str(path)) == [("corn price", {"price_rules"}),
+                                      ("corn exports", {"export_rules", "trade_rules"})]
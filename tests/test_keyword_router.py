@@ -0,0 +1,45 @@
+from keyword_router import KeywordRouter, stem, tokenize
+
+RULES = {
+    'price_rules': {
+        'keywords': ['price', 'cost'],
+        'description': 'Price information and market pricing.',
+        'example_queries': ['Corn price list for this month'],
+    },
+    'trade_rules': {
+        'keywords': ['export', 'import'],
+        'description': 'Trade flows between countries.',
+        'example_queries': ['Weekly corn exports to Mexico'],
+    },
+    'production_rules': {
+        'keywords': ['production', 'yield'],
+        'description': 'Production and supply estimates.',
+        'example_queries': ['Brazil soybean production forecast'],
+    },
+}
+
+
+def test_tokenize_drops_stopwords_and_numbers_and_strips_plurals():
+    assert tokenize("What are the Exports of corn in 2023?") == ['export', 'corn']
+    assert stem("glass") == "glass"
+    assert stem("gas") == "gas"
+
+
+def test_confident_match_routes_locally():
+    router = KeywordRouter(RULES)
+    assert router.route("corn export and import volumes") == 'trade_rules'
+    assert router.score("corn export and import volumes")[0][0] == 'trade_rules'
+
+
+def test_terms_in_every_rule_carry_no_weight():
+    rules = {name: dict(rule, keywords=rule['keywords'] + ['commodity']) for name, rule in RULES.items()}
+    router = KeywordRouter(rules)
+    assert 'commodity' not in router.index
+    assert router.route("commodity") is None
+
+
+def test_ambiguous_or_weak_queries_are_left_to_the_llm():
+    router = KeywordRouter(RULES)
+    assert router.route("price of exports") is None
+    assert router.route("weather in Iowa") is None
+    assert KeywordRouter(RULES, min_score=100.0).route("corn export and import volumes") is None
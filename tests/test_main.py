@@ -0,0 +1,198 @@
+import copy
+import threading
+
+import pytest
+
+import main
+
+
+def test_import_starts_no_rules_watcher():
+    assert main._rules_watcher is None
+    assert "file-watch" not in {thread.name for thread in threading.enumerate()}
+
+
+@pytest.fixture
+def restore_rules():
+    original = main.routing
+    yield
+    main.apply_rules(original.rules)
+
+
+def test_index_hits_moved_by_a_reload_are_not_served(tmp_path, monkeypatch, restore_rules):
+    from answer_index import AnswerIndex, collect_answers, write_index
+
+    path = str(tmp_path / "index.bin")
+    write_index(collect_answers(main.routing.rules), path, rules_fingerprint=main.routing.fingerprint)
+    monkeypatch.setattr(main, "answer_index", AnswerIndex(path))
+
+    rules = copy.deepcopy(main.routing.rules)
+    source, target = [name for name in rules][:2]
+    assert rules[source]['default_table'] != rules[target]['default_table']
+    moved = rules[source]['example_queries'].pop()
+    kept = next(example for example in rules[target]['example_queries'])
+    rules[target]['example_queries'].append(moved)
+    assert main.lookup_indexed_source(moved) == rules[source]['default_table']
+
+    main.apply_rules(rules)
+    assert main.lookup_indexed_source(moved) is None
+    assert main.lookup_indexed_source(kept) is None
+
+
+@pytest.fixture
+def cold_caches(tmp_path, monkeypatch):
+    from answer_index import AnswerIndex
+    from cache import QueryCache
+    from semantic_cache import SemanticCache
+
+    monkeypatch.setattr(main, "query_cache", QueryCache())
+    monkeypatch.setattr(main, "semantic_cache", SemanticCache())
+    monkeypatch.setattr(main, "answer_index", AnswerIndex(str(tmp_path / "missing.bin")))
+
+
+def test_batch_outage_degrades_per_query(monkeypatch, cold_caches):
+    def unreachable(queries, debug=False):
+        raise main.OpenAIConnectionError("OpenAI connection error: timed out") from TimeoutError("timed out")
+
+    rule = next(iter(main.routing.rules.values()))
+    monkeypatch.setattr(main, "match_queries_to_rules", unreachable)
+    monkeypatch.setattr(main, "fallback_rule", lambda query: rule if query == "zzq known" else None)
+    assert main.get_appropriate_data_sources(["zzq known", "zzq unknown", "ZZQ known"]) == [
+        rule['default_table'], "Unknown Source", rule['default_table']]
+
+
+def test_batch_bad_request_is_not_masked_by_the_fallback(monkeypatch, cold_caches):
+    def rejected(queries, debug=False):
+        raise main.OpenAIConnectionError("OpenAI connection error: bad request") from ValueError("bad request")
+
+    rule = next(iter(main.routing.rules.values()))
+    monkeypatch.setattr(main, "match_queries_to_rules", rejected)
+    monkeypatch.setattr(main, "fallback_rule", lambda query: rule)
+    with pytest.raises(main.OpenAIConnectionError):
+        main.get_appropriate_data_sources(["zzq known"])
+
+
+class FailingClient:
+    """A client whose chat completions always fail with ``error``"""
+
+    def __init__(self, error):
+        def create(**kwargs):
+            raise error
+
+        self.chat = type("Chat", (), {"completions": type("Completions", (), {"create": staticmethod(create)})})()
+
+
+def test_match_keeps_the_cause_and_falls_back_only_on_outages(monkeypatch, cold_caches):
+    rule = next(iter(main.routing.rules.values()))
+    monkeypatch.setattr(main, "fallback_rule", lambda query: rule)
+    monkeypatch.setattr(main.llm_guard, "call", lambda fn, **kwargs: fn(**kwargs))
+
+    monkeypatch.setattr(main, "get_client", lambda: FailingClient(ValueError("bad request")))
+    with pytest.raises(main.OpenAIConnectionError) as raised:
+        main._match_and_cache("zzq bug")
+    assert isinstance(raised.value.__cause__, ValueError)
+    assert main.query_cache.get("zzq bug") is None
+
+    monkeypatch.setattr(main, "get_client", lambda: FailingClient(ConnectionError("refused")))
+    assert main._match_and_cache("zzq outage") is rule
+    assert main.query_cache.get("zzq outage") is rule
+
+
+def test_keyword_rankings_share_one_scale():
+    scored = [('price_rules', 4.0), ('trade_rules', 1.0)]
+    assert main.keyword_ranking(scored, confidence=0.8) == [('price_rules', 0.8), ('trade_rules', 0.2)]
+    assert main.keyword_ranking([('price_rules', 2.5)], confidence=0.8) == [('price_rules', 0.8)]
+    assert main.keyword_ranking([]) == []
+
+
+def test_calibrate_score_temperature():
+    assert main.calibrate_score(0.9, 1.0) == 0.9
+    assert 0.5 < main.calibrate_score(0.9, 2.0) < 0.9
+    assert main.calibrate_score(0.1, 2.0) > 0.1
+
+
+def test_chunk_queries_respects_the_query_and_token_caps():
+    queries = [f"query number {number}" for number in range(23)]
+    chunks = main.chunk_queries(queries, max_queries=10)
+    assert [len(chunk) for chunk in chunks] == [10, 10, 3]
+    assert [query for chunk in chunks for query in chunk] == queries
+    budget = main.estimate_tokens(main.batch_rule_prompt.prefix) + 30
+    chunks = main.chunk_queries(queries, max_prompt_tokens=budget)
+    assert len(chunks) > 3
+    assert all(sum(main.estimate_tokens(query) + 2 for query in chunk) <= 30 for chunk in chunks)
+
+
+def test_batch_resolves_duplicates_once(monkeypatch, cold_caches):
+    sent = []
+    rule = next(iter(main.routing.rules.values()))
+
+    def answer(queries, debug=False):
+        sent.extend(queries)
+        return [rule] * len(queries)
+
+    monkeypatch.setattr(main, "match_queries_to_rules", answer)
+    assert main.get_appropriate_data_sources(["zzq one", "ZZQ  one", "zzq two"]) == [rule['default_table']] * 3
+    assert sent == ["zzq one", "zzq two"]
+
+
+class Completion:
+    def __init__(self, message):
+        self.message = message
+
+    def to_dict(self):
+        return {'choices': [{'message': self.message}]}
+
+
+def tool_reply(*arguments):
+    return Completion({'role': 'assistant', 'content': None, 'tool_calls': [
+        {'id': f'call_{index}', 'type': 'function', 'function': {'name': 'select_rule', 'arguments': text}}
+        for index, text in enumerate(arguments)]})
+
+
+def test_parse_rule_reply_reads_the_select_rule_call():
+    rule_name, rule = next(iter(main.routing.rules.items()))
+    assert main.parse_rule_reply(tool_reply(f'{{"rule": "{rule_name}", "confidence": 0.8}}')) is rule
+    assert main.parse_rule_reply(tool_reply('not json', f'{{"rule": "{rule_name}"}}')) is rule
+    assert main.parse_rule_reply(tool_reply('{"rule": "no_such_rule"}')) == {"default_table": "Unknown Source"}
+    assert main.parse_rule_reply(Completion({'role': 'assistant', 'content': 'none'})) == {
+        "default_table": "Unknown Source"}
+
+
+def test_parse_rule_selection_returns_the_stated_confidence():
+    rule_name = next(iter(main.routing.rules))
+    assert main.parse_rule_selection(tool_reply(f'{{"rule": "{rule_name}", "confidence": 0.3}}')) == (rule_name, 0.3)
+    assert main.parse_rule_selection(tool_reply(f'{{"rule": "{rule_name}"}}')) == (rule_name, 1.0)
+    assert main.parse_rule_selection(tool_reply('{"rule": "no_such_rule"}')) == (None, 0.0)
+
+
+def test_rule_tool_schema_lists_the_current_rules():
+    tool = main.build_rule_tool()
+    assert tool['function']['name'] == 'select_rule'
+    assert tool['function']['parameters']['properties']['rule']['enum'] == list(main.routing.rules)
+
+
+def test_async_stale_hit_reads_the_cache_off_the_event_loop(monkeypatch, cold_caches):
+    import asyncio
+
+    rule = next(iter(main.routing.rules.values()))
+    readers, refreshed = [], []
+
+    class StaleCache:
+        def get(self, query):
+            return None
+
+        def get_stale(self, query):
+            readers.append(threading.current_thread())
+            return rule, False
+
+    def flight(query, debug=False, fallback=True):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(rule)
+        refreshed.append(query)
+        return future
+
+    monkeypatch.setattr(main, "STALE_MINUTES", 5)
+    monkeypatch.setattr(main, "query_cache", StaleCache())
+    monkeypatch.setattr(main, "_async_flight", flight)
+    assert asyncio.run(main.aget_appropriate_data_source("zzq stale")) == rule['default_table']
+    assert refreshed == ["zzq stale"]
+    assert readers and threading.main_thread() not in readers
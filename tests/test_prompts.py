@@ -0,0 +1,44 @@
+import threading
+
+from prompts import CachedPrompt
+from rule_config import build_rules_prompt_prefix
+
+
+def test_prefix_is_built_once_until_invalidated():
+    sources = ['Fastmarkets']
+    builds = []
+
+    def build():
+        builds.append(1)
+        return "Sources: " + ", ".join(sources) + "\n"
+
+    prompt = CachedPrompt(build, "Query: {query}\n")
+    assert prompt.render(query="corn") == "Sources: Fastmarkets\nQuery: corn\n"
+    assert prompt.render(query="wheat") == "Sources: Fastmarkets\nQuery: wheat\n"
+    assert len(builds) == 1 and prompt.version == 1
+    sources.append('PSD')
+    prompt.invalidate()
+    assert prompt.render(query="corn").startswith("Sources: Fastmarkets, PSD\n")
+    assert len(builds) == 2 and prompt.version == 2
+
+
+def test_concurrent_first_renders_build_once():
+    builds = []
+    prompt = CachedPrompt(lambda: builds.append(1) or "prefix\n", "{query}")
+    threads = [threading.Thread(target=prompt.render, kwargs={'query': 'q'}) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert builds == [1]
+
+
+def test_rules_prefix_lists_every_rule_field():
+    prefix = build_rules_prompt_prefix({
+        'price_rules': {'keywords': ['price', 'cost'], 'default_table': 'Fast Markets',
+                        'description': 'Prices.', 'example_queries': ['Corn price list']},
+    })
+    assert "Rule: price_rules\n" in prefix
+    assert "Keywords: price, cost\n" in prefix
+    assert "- Corn price list\n" in prefix
+    assert "Fast Markets" not in prefix
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from routing_common import rate_limit
+from routing_common.rate_limit import BACKGROUND, BATCH, INTERACTIVE, RateLimiter, estimate_request_tokens, priority, usage_tokens
+
+
+def test_burst_is_capped_then_refills_at_the_rate():
+    limiter = RateLimiter(requests_per_minute=600, headroom=1.0, burst_seconds=0.2)
+    assert limiter.acquire() < 1.0
+    assert limiter.acquire() < 1.0
+    waited = limiter.acquire()
+    assert 50.0 <= waited <= 500.0
+    assert limiter.stats()['waited'] == 1
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    limiter = RateLimiter(requests_per_minute=600, headroom=1.0, burst_seconds=0.1)
+    limiter.acquire()
+    served = []
+
+    def call(name, level):
+        limiter.acquire(level=level)
+        served.append(name)
+
+    threads = []
+    for name, level in (("background", BACKGROUND), ("batch 1", BATCH), ("batch 2", BATCH), ("interactive", INTERACTIVE)):
+        thread = threading.Thread(target=call, args=(name, level))
+        thread.start()
+        threads.append(thread)
+        while limiter.queue_depth() < len(threads):
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    assert served == ["interactive", "batch 1", "batch 2", "background"]
+
+
+def test_priority_context_sets_the_level():
+    limiter = RateLimiter(requests_per_minute=600, headroom=1.0, burst_seconds=0.1)
+    limiter.acquire()
+    served = []
+
+    def call(name, level):
+        with priority(level):
+            limiter.acquire()
+        served.append(name)
+
+    batch = threading.Thread(target=call, args=("batch", BATCH))
+    batch.start()
+    while limiter.queue_depth() < 1:
+        time.sleep(0.001)
+    interactive = threading.Thread(target=call, args=("interactive", INTERACTIVE))
+    interactive.start()
+    batch.join()
+    interactive.join()
+    assert served == ["interactive", "batch"]
+
+
+def test_settle_refunds_unused_tokens():
+    limiter = RateLimiter(tokens_per_minute=6000, headroom=1.0, burst_seconds=10.0)
+    limiter.acquire(tokens=800)
+    assert limiter.stats()['tokens_available'] == pytest.approx(200, abs=5)
+    limiter.settle(800, 300)
+    assert limiter.stats()['tokens_available'] == pytest.approx(700, abs=5)
+    limiter.settle(800, None)
+    assert limiter.stats()['tokens_available'] == pytest.approx(700, abs=5)
+
+
+def test_async_acquire_waits_without_blocking_the_loop():
+    limiter = RateLimiter(requests_per_minute=600, headroom=1.0, burst_seconds=0.1)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.ensure_future(tick())
+        await limiter.aacquire()
+        await limiter.aacquire()
+        ticker.cancel()
+        return ticks
+
+    assert asyncio.run(run()) > 5
+    assert limiter.queue_depth() == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    limiter = RateLimiter(requests_per_minute=60, headroom=1.0, burst_seconds=1.0)
+    limiter.acquire()
+
+    async def run():
+        waiter = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0.02)
+        assert limiter.queue_depth() == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(run())
+    assert limiter.queue_depth() == 0
+
+
+def test_request_tokens_reserve_max_tokens():
+    request = {'messages': [{'role': 'user', 'content': 'x' * 400}], 'max_tokens': 30}
+    assert estimate_request_tokens(request) == 101 + 30
+    assert estimate_request_tokens({'messages': []}) == 1 + rate_limit.DEFAULT_COMPLETION_TOKENS
+    assert usage_tokens({'usage': {'total_tokens': 42}}) == 42
+    assert usage_tokens(object()) is None
+
+
+def test_shared_limiter_is_one_per_deployment(monkeypatch):
+    monkeypatch.delenv("ROUTING_LLM_RPM", raising=False)
+    monkeypatch.delenv("ROUTING_LLM_TPM", raising=False)
+    monkeypatch.setenv("TESTPREFIX_LLM_RPM", "120")
+    limiter = rate_limit.shared_limiter("test-deployment-a", "TESTPREFIX")
+    assert isinstance(limiter, RateLimiter) and limiter.quota == (120.0, 0.0, 0.9)
+    # Another call site on the same deployment shares the buckets, configured or not
+    assert rate_limit.shared_limiter("test-deployment-a", "OTHERPREFIX") is limiter
+    assert rate_limit.shared_limiter("test-deployment-b", "TESTPREFIX") is not limiter
+    assert rate_limit.shared_limiter("test-deployment-c", "UNSET_PREFIX") is None
+
+
+def test_shared_limiter_falls_back_to_the_routing_quota(monkeypatch):
+    monkeypatch.setenv("ROUTING_LLM_TPM", "6000")
+    assert rate_limit.shared_limiter("test-deployment-d", "UNSET_PREFIX").quota == (0.0, 6000.0, 0.9)
@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+from routing_common.resilience import CircuitBreaker, CircuitOpenError, Resilient, RetryPolicy, is_unavailable
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def guard(**breaker):
+    breaker = CircuitBreaker(**{'error_rate': 0.5, 'min_calls': 1, 'open_seconds': 0.0, **breaker})
+    return Resilient("test", policy=RetryPolicy(max_attempts=1, base_delay=0.0), breaker=breaker)
+
+
+def fail(status_code):
+    def call(timeout):
+        raise StatusError(status_code)
+    return call
+
+
+def ok(timeout):
+    return "ok"
+
+
+def trip(resilient):
+    with pytest.raises(StatusError):
+        resilient.call(fail(503))
+    assert resilient.breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_retryable_failures_open_the_breaker():
+    resilient = guard(open_seconds=60.0)
+    with pytest.raises(StatusError):
+        resilient.call(fail(503))
+    assert resilient.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        resilient.call(ok)
+
+
+@pytest.mark.parametrize("error", [StatusError(400), StatusError(404), TypeError("bad argument")])
+def test_client_errors_do_not_open_the_breaker(error):
+    resilient = guard(open_seconds=60.0)
+
+    def call(timeout):
+        raise error
+
+    for _ in range(3):
+        with pytest.raises(type(error)):
+            resilient.call(call)
+    assert resilient.breaker.state == CircuitBreaker.CLOSED
+    assert resilient.call(ok) == "ok"
+
+
+def test_retries_then_succeeds():
+    resilient = guard()
+    resilient.policy = RetryPolicy(max_attempts=3, base_delay=0.0)
+    outcomes = [StatusError(429), StatusError(502)]
+
+    def flaky(timeout):
+        if outcomes:
+            raise outcomes.pop(0)
+        return "ok"
+
+    assert resilient.call(flaky) == "ok"
+    assert resilient.metrics['retries'] == 2
+
+
+def test_stream_retries_opening_but_not_a_half_read_stream():
+    resilient = guard(open_seconds=60.0, min_calls=2)
+    resilient.policy = RetryPolicy(max_attempts=3, base_delay=0.0)
+    opens = []
+
+    def drops_after_one(timeout):
+        opens.append(timeout)
+        if len(opens) == 1:
+            raise StatusError(503)
+        yield "first"
+        raise ConnectionError("stream reset")
+
+    received = []
+    with pytest.raises(ConnectionError):
+        for item in resilient.stream(drops_after_one):
+            received.append(item)
+    assert received == ["first"] and len(opens) == 2
+    assert resilient.breaker.state == CircuitBreaker.OPEN
+    assert resilient.metrics['successes'] == 0
+
+
+def test_stream_success_is_recorded_when_exhausted():
+    resilient = guard()
+    items = resilient.stream(lambda timeout: iter(["a", "b"]))
+    assert next(items) == "a" and resilient.metrics['successes'] == 0
+    assert list(items) == ["b"] and resilient.metrics['successes'] == 1
+
+
+def test_cancelled_probe_releases_the_half_open_slot():
+    resilient = guard()
+    trip(resilient)
+
+    async def hang(timeout):
+        await asyncio.sleep(10)
+
+    async def cancel_probe():
+        probe = asyncio.ensure_future(resilient.acall(hang))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(cancel_probe())
+    assert resilient.call(ok) == "ok"
+    assert resilient.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_interrupted_probe_releases_the_half_open_slot():
+    resilient = guard()
+    trip(resilient)
+
+    def interrupted(timeout):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        resilient.call(interrupted)
+    assert resilient.call(ok) == "ok"
+
+
+def test_failing_limiter_releases_the_half_open_slot():
+    resilient = guard()
+    trip(resilient)
+
+    class BrokenLimiter:
+        def acquire(self, tokens):
+            raise RuntimeError("limiter failed")
+
+    resilient.limiter = BrokenLimiter()
+    with pytest.raises(RuntimeError):
+        resilient.call(ok)
+    resilient.limiter = None
+    assert resilient.call(ok) == "ok"
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = CircuitBreaker(min_calls=1, open_seconds=0.0)
+    breaker.record(False)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_is_unavailable():
+    assert is_unavailable(CircuitOpenError("open"))
+    assert is_unavailable(StatusError(429))
+    assert is_unavailable(StatusError(503))
+    assert is_unavailable(TimeoutError())
+    assert not is_unavailable(StatusError(400))
+    assert not is_unavailable(TypeError("bug"))
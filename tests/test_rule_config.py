@@ -0,0 +1,82 @@
+import copy
+import json
+
+import pytest
+
+from rule_config import RuleSet, load_rules
+
+RULES = {
+    'price_rules': {
+        'keywords': ['price', 'cost'],
+        'default_table': 'Fast Markets',
+        'description': 'Price information and market pricing.',
+        'example_queries': ['Corn price list for this month'],
+    },
+    'trade_rules': {
+        'keywords': ['export', 'import'],
+        'default_table': 'GTT',
+        'description': 'Trade flows between countries.',
+        'example_queries': ['Weekly corn exports to Mexico'],
+    },
+}
+
+
+def edited(**changes):
+    rules = copy.deepcopy(RULES)
+    for rule_name, fields in changes.items():
+        rules[rule_name].update(fields)
+    return rules
+
+
+def test_load_rules_rejects_rules_missing_fields(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({'rules': RULES}))
+    assert load_rules(str(path)) == RULES
+    path.write_text(json.dumps({'price_rules': {'keywords': ['price']}}))
+    with pytest.raises(ValueError, match="price_rules"):
+        load_rules(str(path))
+
+
+def test_table_move_keeps_the_keyword_router():
+    previous = RuleSet(RULES)
+    updated = RuleSet(edited(trade_rules={'default_table': 'Comtrade'}), 2, previous=previous)
+    assert updated.changed == {'trade_rules'}
+    assert not updated.matching_changed
+    assert updated.keyword_router is previous.keyword_router
+    assert updated.tables == {'Fast Markets', 'Comtrade'}
+
+
+def test_new_keyword_rebuilds_the_router_and_records_its_terms():
+    previous = RuleSet(RULES)
+    updated = RuleSet(edited(trade_rules={'keywords': ['export', 'import', 'shipment']}), 2, previous=previous)
+    assert updated.matching_changed
+    assert updated.keyword_router is not previous.keyword_router
+    assert updated.new_terms == {'shipment'}
+    assert updated.keyword_router.score('shipment volumes')[0][0] == 'trade_rules'
+
+
+def test_affects_cached_answers_from_changed_rules_only():
+    previous = RuleSet(RULES)
+    updated = RuleSet(edited(trade_rules={'default_table': 'Comtrade'}), 2, previous=previous)
+    assert updated.affects('corn exports', RULES['trade_rules'])
+    assert not updated.affects('corn price', RULES['price_rules'])
+    assert updated.affects('q', {'rankings': [('trade_rules', 0.9)]})
+    assert not updated.affects('q', {'rankings': [('price_rules', 0.9)]})
+
+
+def test_affects_queries_sharing_a_new_term():
+    previous = RuleSet(RULES)
+    updated = RuleSet(edited(trade_rules={'keywords': ['export', 'import', 'shipment']}), 2, previous=previous)
+    assert updated.affects('shipment cost', RULES['price_rules'])
+    assert not updated.affects('corn cost', RULES['price_rules'])
+
+
+def test_added_rule_affects_unknown_source_answers():
+    rules = edited()
+    rules['weather_rules'] = {
+        'keywords': ['rain'], 'default_table': 'NOAA',
+        'description': 'Weather.', 'example_queries': ['Rainfall in Iowa'],
+    }
+    updated = RuleSet(rules, 2, previous=RuleSet(RULES))
+    assert updated.added == {'weather_rules'}
+    assert updated.affects('anything', {'source': 'Unknown Source'})
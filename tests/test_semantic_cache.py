@@ -0,0 +1,73 @@
+import pytest
+
+import semantic_cache
+from semantic_cache import HashingEmbedder, SemanticCache, query_terms
+
+
+def cosine(a, b):
+    embed = HashingEmbedder()
+    return sum(x * y for x, y in zip(embed(a), embed(b)))
+
+
+@pytest.mark.parametrize("cached, query", [
+    ("weekly corn exports %", "percentage of corn exported weekly"),
+    ("What is the price of wheat in Turkey?", "wheat price in turkey"),
+    ("corn exports 2021", "2021 corn exports"),
+])
+def test_paraphrases_clear_the_threshold(cached, query):
+    cache = SemanticCache(threshold=0.9)
+    cache.set(cached, {'default_table': 'table'})
+    assert cache.get(query) == {'default_table': 'table'}
+
+
+@pytest.mark.parametrize("cached, query", [
+    ("corn exports 2020", "corn exports 2021"),
+    ("weekly corn exports", "weekly wheat exports"),
+    ("price of wheat in Turkey", "price of wheat in Egypt"),
+])
+def test_different_questions_stay_below_the_threshold(cached, query):
+    assert cosine(cached, query) < 0.9
+
+
+def test_query_terms_keep_numbers_and_fold_inflections():
+    assert query_terms("Percentage of corn exported in 2021") == ['percent', 'corn', 'export', '2021']
+    assert query_terms("weekly corn exports %") == ['weekly', 'corn', 'export', 'percent']
+
+
+def test_lookup_scores_only_candidates_sharing_a_term():
+    cache = SemanticCache(max_candidates=8)
+    for i in range(200):
+        cache.set(f"filler query number {i} about livestock", {'i': i})
+    cache.set("weekly corn exports %", {'default_table': 'exports'})
+    assert len(cache._candidates(query_terms("percentage of corn exported weekly"))) <= 8
+    assert cache.get("percentage of corn exported weekly") == {'default_table': 'exports'}
+
+
+def test_ring_buffer_forgets_the_oldest_entry():
+    cache = SemanticCache(max_entries=2)
+    cache.set("corn exports", {'t': 1})
+    cache.set("wheat prices", {'t': 2})
+    cache.set("rice yields", {'t': 3})
+    assert len(cache) == 2
+    assert cache.get("corn exports") is None
+    assert cache.get("wheat prices") == {'t': 2}
+    assert 'corn' not in cache._postings
+
+
+def test_invalidate_drops_matching_entries():
+    cache = SemanticCache()
+    cache.set("corn exports", {'t': 1})
+    cache.set("wheat prices", {'t': 2})
+    assert cache.invalidate(lambda key, value: value['t'] == 1) == 1
+    assert cache.get("corn exports") is None
+    assert cache.get("wheat prices") == {'t': 2}
+    cache.set("corn exports", {'t': 3})
+    assert cache.get("corn exports") == {'t': 3}
+
+
+def test_pure_python_capacity_is_capped(monkeypatch):
+    monkeypatch.setattr(semantic_cache, "_numpy", lambda: None)
+    cache = SemanticCache(max_entries=100000)
+    assert cache.max_entries == semantic_cache.PURE_PYTHON_MAX_ENTRIES
+    cache.set("weekly corn exports %", {'t': 1})
+    assert cache.get("percentage of corn exported weekly") == {'t': 1}
@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from cache import SingleFlight
+
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return {'source': 'FAO'}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("q", slow))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flight.shared < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert results == [{'source': 'FAO'}] * 5
+    assert not flight.in_flight("q")
+
+
+def test_followers_receive_the_leaders_error():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ValueError("LLM down")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("q", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while flight.shared < 1:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+def test_later_calls_run_again():
+    flight = SingleFlight()
+    assert flight.do("q", lambda: 1) == 1
+    assert flight.do("q", lambda: 2) == 2
+    with pytest.raises(KeyError):
+        flight.do("q", lambda: {}["missing"])
+    assert flight.do("q", lambda: 3) == 3
+
+
+def test_background_refresh_runs_once_per_key():
+    flight = SingleFlight()
+    release, done = threading.Event(), threading.Event()
+
+    def refresh():
+        release.wait(5)
+        done.set()
+
+    assert flight.do_in_background("q", refresh)
+    while not flight.in_flight("q"):
+        time.sleep(0.001)
+    assert not flight.do_in_background("q", refresh)
+    release.set()
+    assert done.wait(5)
+
+
+def test_failed_background_refresh_is_logged(caplog):
+    flight = SingleFlight()
+
+    def failing():
+        raise RuntimeError("timed out")
+
+    assert flight.do_in_background("q", failing)
+    deadline = time.monotonic() + 5
+    while "timed out" not in caplog.text and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert "Background refresh failed" in caplog.text
@@ -0,0 +1,65 @@
+import pytest
+
+from routing_common.source_registry import SourceRegistry, get_registry, load_registry
+
+SOURCES = [
+    {'name': 'Fastmarkets', 'url': 'https://www.fastmarkets.com/',
+     'description': 'Market intelligence on commodity prices.', 'aliases': ['Fast Markets']},
+    {'name': 'USDA ESRQuery', 'url': 'https://apps.fas.usda.gov/esrquery/ESRHome.aspx',
+     'description': 'Export sales reporting data.', 'aliases': ['Export Sales Report']},
+    {'name': 'USDA PSD Online', 'url': 'https://apps.fas.usda.gov/psdonline/app/index.html',
+     'description': 'Production, supply and distribution balances.', 'aliases': ['PSD']},
+]
+
+
+@pytest.fixture
+def registry():
+    return SourceRegistry(SOURCES)
+
+
+def test_get_by_name_alias_or_url(registry):
+    assert registry.get("fast markets")['name'] == 'Fastmarkets'
+    assert registry.get("USDA-ESRQuery")['name'] == 'USDA ESRQuery'
+    assert registry.get("http://fastmarkets.com/prices/corn")['name'] == 'Fastmarkets'
+
+
+def test_shared_host_alone_identifies_no_source(registry):
+    assert registry.get("https://apps.fas.usda.gov/") is None
+    assert registry.get("https://apps.fas.usda.gov/psdonline/app/index.html")['name'] == 'USDA PSD Online'
+
+
+def test_match_reads_names_and_urls_out_of_free_text(registry):
+    assert registry.match("The most relevant source is **Export Sales Report**.")['name'] == 'USDA ESRQuery'
+    assert registry.match("See https://www.fastmarkets.com/, it covers prices.")['name'] == 'Fastmarkets'
+    assert registry.match("No idea.") is None
+    assert registry.match("") is None
+
+
+def test_match_all_keeps_order_without_repeats(registry):
+    answer = "1. PSD\n2. Fastmarkets (Fast Markets)\n3. PSD again\n4. USDA ESRQuery"
+    assert [source['name'] for source in registry.match_all(answer)] == [
+        'USDA PSD Online', 'Fastmarkets', 'USDA ESRQuery']
+    assert len(registry.match_all(answer, limit=2)) == 2
+
+
+def test_guess_weighs_query_words(registry):
+    assert registry.guess("weekly export sales of corn")['name'] == 'USDA ESRQuery'
+    assert registry.guess("commodity prices")['name'] == 'Fastmarkets'
+    assert registry.guess("hello") is None
+
+
+def test_duplicate_alias_is_rejected():
+    with pytest.raises(ValueError, match="PSD"):
+        SourceRegistry(SOURCES + [{'name': 'Other', 'url': 'https://other.org', 'description': '', 'aliases': ['PSD']}])
+
+
+def test_shared_sources_file_covers_every_rule_table():
+    import json
+    import os
+
+    registry = load_registry()
+    assert get_registry().names() == registry.names()
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rules.json")) as f:
+        rules = json.load(f)
+    rules = rules.get('rules', rules)
+    assert all(registry.get(rule['default_table']) for rule in rules.values())
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from routing_common.tracing import Histogram, Tracer, current_span
+
+
+def test_nested_spans_share_the_trace_and_export_jsonl(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracer = Tracer(str(path))
+    with tracer.span("route", mode="single") as route:
+        with tracer.span("llm.call") as call:
+            assert current_span() is call
+            call.set(prompt_tokens=120, completion_tokens=8)
+    assert current_span() is None
+    tracer.close()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record['name'] for record in records] == ["llm.call", "route"]
+    assert records[0]['trace_id'] == records[1]['trace_id']
+    assert records[0]['parent_id'] == route.span_id
+    assert records[1]['attributes'] == {'mode': 'single'}
+
+
+def test_span_attributes_feed_histograms_and_counters():
+    tracer = Tracer()
+    for outcome in ("hit", "hit", "miss"):
+        with tracer.span("cache.lookup") as span:
+            span.set(cache=outcome)
+    with tracer.span("llm.call", stream=True) as span:
+        span.mark("ttft")
+        span.set(prompt_tokens=100)
+    assert tracer.counters()["cache.lookup.cache"] == {'hit': 2, 'miss': 1}
+    assert tracer.counters()["llm.call.prompt_tokens"] == {'total': 100}
+    histograms = tracer.histograms()
+    assert histograms["cache.lookup"]['count'] == 3
+    assert histograms["llm.call.ttft"]['count'] == 1
+
+
+def test_failed_span_records_the_error():
+    tracer = Tracer()
+    with pytest.raises(TimeoutError):
+        with tracer.span("llm.call") as span:
+            raise TimeoutError("read timed out")
+    assert span.error == "TimeoutError: read timed out"
+    assert tracer.histograms()["llm.call"]['count'] == 1
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    histogram = Histogram((1, 10, 100))
+    for value in (0.5, 5, 5, 50, 500):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 10
+    assert histogram.quantile(0.8) == 100
+    assert histogram.quantile(1.0) == float('inf')
+
+
+def test_gauge_name_collisions_are_reported(caplog):
+    tracer = Tracer()
+    tracer.gauge("router.breaker_state", lambda: 0)
+    tracer.gauge("router.breaker_state", lambda: 1)
+    assert "registered twice" in caplog.text
+    assert tracer.gauges() == {"router.breaker_state": 1}
+
+
+def test_prometheus_text_exposition():
+    tracer = Tracer(buckets=(1, 10))
+    tracer.observe("llm.call", 5)
+    tracer.count("rules.reload")
+    tracer.count("ensemble.decision", "agree")
+    tracer.gauge("llm.breaker_state", lambda: 2)
+    text = tracer.prometheus_text(prefix="crew")
+    assert 'crew_llm_call_ms_bucket{le="1"} 0' in text
+    assert 'crew_llm_call_ms_bucket{le="10"} 1' in text
+    assert 'crew_llm_call_ms_bucket{le="+Inf"} 1' in text
+    assert "crew_rules_reload_total 1" in text
+    assert 'crew_ensemble_decision_total{outcome="agree"} 1' in text
+    assert "# TYPE crew_llm_breaker_state gauge\ncrew_llm_breaker_state 2" in text